@@ -0,0 +1,189 @@
+"""
+Bytes per row of the records the in-memory corpus holds, table by table.
+
+"before" keeps each row in a plain dataclass with a per-instance ``__dict__``
+and its own copy of every id, as the corpus used to. "after" uses the slotted
+records of ``src.datatypes``, with ids that refer to another row sharing that
+row's id object as ``memory.Corpus`` does. A row costs its record, its entry in
+the table's dict and the field objects only it keeps alive: each table is
+fetched and built under ``tracemalloc`` and measured once the fetched rows
+are dropped.
+
+    python -m bench.corpus_memory [--scale 1 10] [--db 10=/tmp/movies-10x.db]
+                                  [--output memory.json]
+
+A scale without a ``--db`` is built into a temporary SQLite file first with
+``bench.dataset``. Allocations are traced while the rows are fetched, so
+a 10x run takes a few minutes.
+"""
+import argparse
+import io
+import json
+import os
+import tempfile
+import tracemalloc
+from dataclasses import dataclass
+from typing import Callable, Dict
+
+import sqlalchemy
+
+from src import loader
+from src.datatypes import Character, Conversation, Line, Movie
+from src.memory import Corpus
+from bench import dataset
+
+
+@dataclass
+class _Character:
+    id: int
+    name: str
+    movie_id: int
+    gender: str
+    age: int
+    num_lines: int
+
+
+@dataclass
+class _Movie:
+    id: int
+    title: str
+    year: int
+    imdb_rating: float
+    imdb_votes: int
+    raw_script_url: str
+
+
+@dataclass
+class _Conversation:
+    id: int
+    c1_id: int
+    c2_id: int
+    movie_id: int
+    num_lines: int
+
+
+@dataclass
+class _Line:
+    id: int
+    c_id: int
+    movie_id: int
+    conv_id: int
+    line_sort: int
+    line_text: str
+
+
+def _before(table: str, held: Dict[str, dict]) -> Callable:
+    return {
+        "movies": lambda r: _Movie(
+            r.movie_id, r.title, r.year, r.imdb_rating, r.imdb_votes, r.raw_script_url
+        ),
+        "characters": lambda r: _Character(
+            r.character_id, r.name, r.movie_id, r.gender, r.age, 0
+        ),
+        "conversations": lambda r: _Conversation(
+            r.conversation_id, r.character1_id, r.character2_id, r.movie_id, 0
+        ),
+        "lines": lambda r: _Line(
+            r.line_id,
+            r.character_id,
+            r.movie_id,
+            r.conversation_id,
+            r.line_sort,
+            r.line_text,
+        ),
+    }[table]
+
+
+def _after(table: str, held: Dict[str, dict]) -> Callable:
+    def shared(other, id):
+        return Corpus._shared(held.get(other, {}), id)
+
+    return {
+        "movies": lambda r: Movie(
+            r.movie_id, r.title, r.year, r.imdb_rating, r.imdb_votes, r.raw_script_url
+        ),
+        "characters": lambda r: Character(
+            r.character_id, r.name, shared("movies", r.movie_id), r.gender, r.age, 0
+        ),
+        "conversations": lambda r: Conversation(
+            r.conversation_id,
+            shared("characters", r.character1_id),
+            shared("characters", r.character2_id),
+            shared("movies", r.movie_id),
+            0,
+        ),
+        "lines": lambda r: Line(
+            r.line_id,
+            shared("characters", r.character_id),
+            shared("movies", r.movie_id),
+            shared("conversations", r.conversation_id),
+            r.line_sort,
+            r.line_text,
+        ),
+    }[table]
+
+
+LAYOUTS = {"before": _before, "after": _after}
+
+
+def measure(engine, layout: Callable) -> Dict[str, dict]:
+    """Rows and bytes per row of each table, held the way ``layout`` says."""
+    held: Dict[str, dict] = {}
+    sizes = {}
+    with engine.connect() as conn:
+        for table in loader.tables:
+            make = layout(table.name, held)
+            tracemalloc.start()
+            records = {}
+            for r in conn.execute(sqlalchemy.select(table)):
+                record = make(r)
+                records[record.id] = record
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            held[table.name] = records
+            sizes[table.name] = {
+                "rows": len(records),
+                "bytes_per_row": round(current / max(len(records), 1), 1),
+            }
+    return sizes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scale", type=int, nargs="+", default=[1, 10])
+    parser.add_argument(
+        "--db",
+        action="append",
+        default=[],
+        metavar="SCALE=PATH",
+        help="an existing SQLite database for a scale",
+    )
+    parser.add_argument("--output", help="file to write the JSON results to")
+    args = parser.parse_args(argv)
+
+    paths = dict(item.split("=", 1) for item in args.db)
+    results = {}
+    print(f"{'scale':>5} {'table':<14} {'rows':>9} {'before B':>9} {'after B':>9}")
+    for scale in args.scale:
+        path = paths.get(str(scale))
+        if path is None:
+            directory = tempfile.mkdtemp(prefix="movie-api-bench-")
+            path = os.path.join(directory, f"movies-{scale}x.db")
+            engine = sqlalchemy.create_engine(f"sqlite:///{path}")
+            dataset.build(engine, scale, out=io.StringIO())
+        engine = sqlalchemy.create_engine(f"sqlite:///{os.path.abspath(path)}")
+        sizes = {name: measure(engine, layout) for name, layout in LAYOUTS.items()}
+        results[f"{scale}x"] = sizes
+        for table in sizes["before"]:
+            before, after = sizes["before"][table], sizes["after"][table]
+            print(
+                f"{scale:>4}x {table:<14} {after['rows']:>9} "
+                f"{before['bytes_per_row']:>9.1f} {after['bytes_per_row']:>9.1f}"
+            )
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
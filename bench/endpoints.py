@@ -0,0 +1,310 @@
+"""
+Drives every route of the API and reports throughput and latency percentiles.
+
+    python -m bench.endpoints --scale 10 --output results.json
+    python -m bench.endpoints --db /tmp/movies-10x.db --requests 2000 --concurrency 16
+    python -m bench.endpoints --server http://127.0.0.1:3000 --db /tmp/movies-10x.db
+
+Without ``--server`` the app runs in this process behind an ASGI transport,
+so the numbers are the app's own cost without a network hop or a web server.
+With it the requests go to a running server, which must be serving the same
+database as ``--db`` (or ``DATABASE_URL``); the database is only read here to
+pick ids that exist.
+
+Without ``--db`` or ``DATABASE_URL`` a SQLite corpus is built with
+``bench.dataset`` at ``--scale`` and kept under the temp dir, so later runs at
+the same scale reuse it. The environment is passed through to the app, so
+``MOVIE_API_BACKEND``, ``RESPONSE_CACHE_SIZE``, ``DB_POOL_SIZE`` and so on
+can be compared between runs.
+
+Each route gets ``--requests`` requests from ``--concurrency`` concurrent
+clients, with ids, offsets and sort options drawn from a seeded generator.
+The POST runs last, since it changes the data the reads see. The results go
+to ``--output`` (stdout by default) as JSON:
+
+    {"meta": {...the run's settings...},
+     "routes": {"get_movie": {"requests": 1000, "errors": 0, "seconds": 0.9,
+                              "throughput": 1111.1, "latency_ms":
+                              {"mean": .., "p50": .., "p95": .., "p99": .., "max": ..}},
+                ...}}
+
+and a summary table goes to stderr.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+import httpx
+import sqlalchemy
+
+from src import database as db
+
+# Which ids exist, for the routes that take one.
+Ids = Dict[str, List[Any]]
+
+
+def sample_ids(url: str, size: int = 5000, seed: int = 0) -> Ids:
+    engine = sqlalchemy.create_engine(url)
+    rng = random.Random(seed)
+
+    def pick(column) -> List[int]:
+        with engine.connect() as conn:
+            ids = [row[0] for row in conn.execute(sqlalchemy.select(column))]
+        return rng.sample(ids, min(size, len(ids)))
+
+    with engine.connect() as conn:
+        casts = conn.execute(
+            sqlalchemy.select(
+                db.characters.c.movie_id,
+                sqlalchemy.func.min(db.characters.c.character_id),
+                sqlalchemy.func.max(db.characters.c.character_id),
+            )
+            .group_by(db.characters.c.movie_id)
+            .having(sqlalchemy.func.count() > 1)
+        ).all()
+    engine.dispose()
+    return {
+        "movie": pick(db.movies.c.movie_id),
+        "character": pick(db.characters.c.character_id),
+        "line": pick(db.lines.c.line_id),
+        "conversation": pick(db.conversations.c.conversation_id),
+        # (movie_id, character_1_id, character_2_id) for the POST.
+        "cast": [tuple(row) for row in casts],
+    }
+
+
+# Each route turns a generator and the ids into (method, path, json body).
+Request = Tuple[str, str, Any]
+ROUTES: Dict[str, Callable[[random.Random, Ids], Request]] = {
+    "list_movies": lambda rng, ids: (
+        "GET",
+        "/movies/?sort=%s&offset=%d"
+        % (rng.choice(["movie_title", "year", "rating"]), rng.randrange(200)),
+        None,
+    ),
+    "get_movie": lambda rng, ids: ("GET", f"/movies/{rng.choice(ids['movie'])}", None),
+    "list_characters": lambda rng, ids: (
+        "GET",
+        "/characters/?sort=%s&offset=%d"
+        % (
+            rng.choice(["character", "movie", "number_of_lines"]),
+            rng.randrange(1000),
+        ),
+        None,
+    ),
+    "get_character": lambda rng, ids: (
+        "GET",
+        f"/characters/{rng.choice(ids['character'])}",
+        None,
+    ),
+    "list_lines": lambda rng, ids: (
+        "GET",
+        "/lines/?sort=%s&offset=%d"
+        % (rng.choice(["movie_title", "line_text"]), rng.randrange(1000)),
+        None,
+    ),
+    "get_line": lambda rng, ids: ("GET", f"/lines/{rng.choice(ids['line'])}", None),
+    "get_conversation": lambda rng, ids: (
+        "GET",
+        f"/conversations/{rng.choice(ids['conversation'])}",
+        None,
+    ),
+    "add_conversation": lambda rng, ids: _add_conversation(rng.choice(ids["cast"])),
+}
+
+
+def _add_conversation(cast) -> Request:
+    movie_id, character_1_id, character_2_id = cast
+    body = {
+        "character_1_id": character_1_id,
+        "character_2_id": character_2_id,
+        "lines": [
+            {"character_id": character_1_id, "line_text": "benchmark line one"},
+            {"character_id": character_2_id, "line_text": "benchmark line two"},
+        ],
+    }
+    return "POST", f"/movies/{movie_id}/conversations/", body
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(latencies: List[float], errors: int, seconds: float) -> Dict[str, Any]:
+    ms = sorted(latency * 1000 for latency in latencies)
+    return {
+        "requests": len(ms),
+        "errors": errors,
+        "seconds": round(seconds, 4),
+        "throughput": round(len(ms) / seconds, 2) if seconds else 0.0,
+        "latency_ms": {
+            "mean": round(sum(ms) / len(ms), 3) if ms else 0.0,
+            "p50": round(percentile(ms, 50), 3),
+            "p95": round(percentile(ms, 95), 3),
+            "p99": round(percentile(ms, 99), 3),
+            "max": round(ms[-1], 3) if ms else 0.0,
+        },
+    }
+
+
+async def drive(
+    client: httpx.AsyncClient,
+    route: Callable[[random.Random, Ids], Request],
+    ids: Ids,
+    requests: int,
+    concurrency: int,
+    seed: int,
+) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    plan = [route(rng, ids) for _ in range(requests)]
+    latencies: List[float] = []
+    errors = 0
+
+    async def worker(mine: List[Request]):
+        nonlocal errors
+        for method, path, body in mine:
+            start = time.perf_counter()
+            response = await client.request(method, path, json=body)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(plan[i::concurrency]) for i in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+async def run(args, ids: Ids) -> Dict[str, Dict[str, Any]]:
+    if args.server:
+        client = httpx.AsyncClient(base_url=args.server, timeout=60)
+    else:
+        from src.api.server import app
+
+        await app.router.startup()
+        client = httpx.AsyncClient(app=app, base_url="http://bench", timeout=60)
+
+    results = {}
+    async with client:
+        for name in args.routes:
+            # A few untimed requests so that lazy indexes and caches of
+            # compiled statements are built before the clock starts.
+            await drive(client, ROUTES[name], ids, args.warmup, 1, args.seed + 1)
+            results[name] = await drive(
+                client, ROUTES[name], ids, args.requests, args.concurrency, args.seed
+            )
+    return results
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def _database_url(args) -> str:
+    if args.db:
+        return f"sqlite:///{os.path.abspath(args.db)}"
+    if os.environ.get("DATABASE_URL") or os.environ.get("POSTGRES_SERVER"):
+        return db.database_connection_url()
+
+    from bench import dataset
+
+    path = os.path.join(tempfile.gettempdir(), f"movie-api-bench-{args.scale}x.db")
+    if not os.path.exists(path):
+        dataset.build(
+            sqlalchemy.create_engine(f"sqlite:///{path}"), args.scale, out=sys.stderr
+        )
+    return f"sqlite:///{path}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench.endpoints")
+    parser.add_argument("--db", help="path of a SQLite database to benchmark")
+    parser.add_argument(
+        "--scale", type=int, default=1, help="corpus size when building one"
+    )
+    parser.add_argument("--server", help="base url of a running server")
+    parser.add_argument("--requests", type=int, default=500, help="per route")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=20, help="per route")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--routes",
+        default=",".join(ROUTES),
+        type=lambda value: value.split(","),
+        help="comma-separated subset of: " + ", ".join(ROUTES),
+    )
+    parser.add_argument("--output", help="file to write the JSON results to")
+    args = parser.parse_args(argv)
+    unknown = set(args.routes) - set(ROUTES)
+    if unknown:
+        parser.error(f"unknown routes: {', '.join(sorted(unknown))}")
+
+    url = _database_url(args)
+    os.environ["DATABASE_URL"] = url
+    ids = sample_ids(url, seed=args.seed)
+    results = asyncio.run(run(args, ids))
+
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "target": args.server or "in-process",
+            "database": sqlalchemy.engine.make_url(url).render_as_string(
+                hide_password=True
+            ),
+            "scale": None if args.db else args.scale,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "seed": args.seed,
+            "env": {
+                name: os.environ[name]
+                for name in sorted(os.environ)
+                if name.startswith(("MOVIE_API_", "RESPONSE_CACHE_", "DB_"))
+            },
+        },
+        "routes": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    print(
+        f"{'route':<18} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+        f" {'errors':>6}",
+        file=sys.stderr,
+    )
+    for name, r in results.items():
+        lat = r["latency_ms"]
+        print(
+            f"{name:<18} {r['throughput']:>9.1f} {lat['p50']:>8.2f} "
+            f"{lat['p95']:>8.2f} {lat['p99']:>8.2f} {r['errors']:>6}",
+            file=sys.stderr,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Per-request Python overhead of the list endpoints' queries.
+
+For each of list_movies, list_characters and list_lines, times building the
+statement the way the handlers used to (a fresh select per request) against
+fetching the cached template and binding the request's values, and then the
+same two with the statement executed. Runs against a SQLite stand-in built
+from the CSVs, or against DATABASE_URL when it is set.
+
+    python -m bench.list_queries [--runs 2000]
+"""
+import argparse
+import io
+import os
+import tempfile
+import time
+
+import sqlalchemy
+
+from src import database as db
+from src import loader
+from src import pagination
+from src.api import characters, lines, movies
+
+
+def _movies_adhoc(sort, limit, offset):
+    order = movies._movie_orders[sort] + [(db.movies.c.movie_id, False)]
+    return (
+        sqlalchemy.select(
+            db.movies.c.movie_id,
+            db.movies.c.title,
+            db.movies.c.year,
+            db.movies.c.imdb_rating,
+            db.movies.c.imdb_votes,
+        )
+        .limit(limit)
+        .offset(offset)
+        .order_by(*pagination.order_by(order))
+    )
+
+
+def _characters_adhoc(sort, limit, offset):
+    order = characters._character_orders[sort] + [(db.characters.c.character_id, False)]
+    return (
+        sqlalchemy.select(
+            db.characters.c.character_id,
+            db.characters.c.name.label("character"),
+            db.movies.c.title.label("movie"),
+            db.character_line_counts.c.num_lines.label("number_of_lines"),
+        )
+        .select_from(
+            db.characters.join(
+                db.movies, db.characters.c.movie_id == db.movies.c.movie_id
+            ).join(
+                db.character_line_counts,
+                db.characters.c.character_id == db.character_line_counts.c.character_id,
+            )
+        )
+        .where(db.character_line_counts.c.num_lines > 0)
+        .order_by(*pagination.order_by(order))
+        .limit(limit)
+        .offset(offset)
+    )
+
+
+def _lines_adhoc(sort, limit, offset):
+    order = lines._line_orders[sort] + [(db.lines.c.line_id, False)]
+    return (
+        sqlalchemy.select(
+            db.lines.c.line_id,
+            db.characters.c.name.label("character"),
+            db.movies.c.title.label("movie"),
+            db.lines.c.conversation_id,
+            db.lines.c.line_text,
+        )
+        .select_from(
+            db.lines.join(
+                db.characters, db.lines.c.character_id == db.characters.c.character_id
+            ).join(db.movies, db.lines.c.movie_id == db.movies.c.movie_id)
+        )
+        .limit(limit)
+        .offset(offset)
+        .order_by(*pagination.order_by(order))
+    )
+
+
+CASES = [
+    ("list_movies", "movie_title", _movies_adhoc, movies._list_movies_query),
+    (
+        "list_characters",
+        "number_of_lines",
+        _characters_adhoc,
+        characters._list_characters_query,
+    ),
+    ("list_lines", "movie_title", _lines_adhoc, lines._list_lines_query),
+]
+
+
+def _per_request(fn, runs: int) -> float:
+    """Microseconds per call of `fn(i)`, after a warm-up call."""
+    fn(0)
+    start = time.perf_counter()
+    for i in range(runs):
+        fn(i)
+    return (time.perf_counter() - start) / runs * 1e6
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    if not os.environ.get("DATABASE_URL") and not os.environ.get("POSTGRES_SERVER"):
+        path = os.path.join(tempfile.mkdtemp(prefix="movie-api-bench-"), "movies.db")
+        loader.load(sqlalchemy.create_engine(f"sqlite:///{path}"), out=io.StringIO())
+        os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    engine = db.engine
+
+    print(f"{'query':<16} {'step':<8} {'before us':>10} {'after us':>10}")
+    with engine.connect() as conn:
+        for name, sort, adhoc, template in CASES:
+            build_before = _per_request(lambda i: adhoc(sort, 50, i % 50), args.runs)
+            build_after = _per_request(
+                lambda i: (
+                    template(sort, False, False),
+                    {"limit": 50, "offset": i % 50},
+                ),
+                args.runs,
+            )
+            run_before = _per_request(
+                lambda i: conn.execute(adhoc(sort, 50, i % 50)).fetchall(), args.runs
+            )
+            run_after = _per_request(
+                lambda i: conn.execute(
+                    template(sort, False, False), {"limit": 50, "offset": i % 50}
+                ).fetchall(),
+                args.runs,
+            )
+            print(f"{name:<16} {'build':<8} {build_before:>10.1f} {build_after:>10.1f}")
+            print(f"{name:<16} {'execute':<8} {run_before:>10.1f} {run_after:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+CPU time per page of turning list query rows into a JSON response body.
+
+"before" is what the list endpoints used to do with a page of rows: copy
+each row into a dict, then let FastAPI run ``jsonable_encoder`` over the
+result and encode it with the standard library. "after" is
+``responses.rows`` and ``responses.dumps``. Both start from the same fetched
+rows, so the database isn't part of the measurement.
+
+    python -m bench.serialization [--limit 250] [--runs 200]
+"""
+import argparse
+import io
+import json
+import os
+import tempfile
+import time
+
+import sqlalchemy
+from fastapi.encoders import jsonable_encoder
+
+from src import database as db
+from src import loader
+from src import responses
+from src.api import characters, lines, movies
+
+
+def _before(keys, page):
+    # Each row went through _asdict() and was then copied into a new dict.
+    content = []
+    for row in page:
+        fields = row._asdict()
+        content.append({key: fields[key] for key in keys})
+    return json.dumps(
+        jsonable_encoder(content),
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def _after(keys, page):
+    return responses.dumps([dict(zip(keys, row)) for row in page])
+
+
+CASES = [
+    ("list_movies", movies._list_movies_query("movie_title", False, False)),
+    ("list_characters", characters._list_characters_query("character", False, False)),
+    ("list_lines", lines._list_lines_query("line_text", False, False)),
+]
+
+
+def _cpu_per_page(fn, keys, page, runs: int) -> float:
+    """CPU microseconds per call, after a warm-up call."""
+    fn(keys, page)
+    start = time.process_time()
+    for _ in range(runs):
+        fn(keys, page)
+    return (time.process_time() - start) / runs * 1e6
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--limit", type=int, default=250, help="rows per page")
+    parser.add_argument("--runs", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    if not os.environ.get("DATABASE_URL") and not os.environ.get("POSTGRES_SERVER"):
+        path = os.path.join(tempfile.mkdtemp(prefix="movie-api-bench-"), "movies.db")
+        loader.load(sqlalchemy.create_engine(f"sqlite:///{path}"), out=io.StringIO())
+        os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+
+    print(f"encoder: {'orjson' if responses.orjson is not None else 'json'}")
+    print(
+        f"{'query':<16} {'rows':>5} {'before us':>10} {'after us':>10} {'speedup':>8}"
+    )
+    with db.engine.connect() as conn:
+        for name, query in CASES:
+            result = conn.execute(query, {"limit": args.limit, "offset": 0})
+            keys = list(result.keys())
+            page = result.fetchall()
+            before = _cpu_per_page(_before, keys, page, args.runs)
+            after = _cpu_per_page(_after, keys, page, args.runs)
+            assert json.loads(_before(keys, page)) == json.loads(_after(keys, page))
+            print(
+                f"{name:<16} {len(page):>5} {before:>10.1f} {after:>10.1f} "
+                f"{before / after if after else float('inf'):>7.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,170 @@
 from fastapi import APIRouter, HTTPException
 from enum import Enum
 from collections import Counter
+from typing import List, Optional
+import functools
 
 from fastapi.params import Query
+from pydantic import BaseModel
 from src import database as db
+from src import memory
+from src import ngrams
+from src import counters
+from src import pagination
+from src import cache
+from src import timing
+from src import responses
+from src import batch
 
 import sqlalchemy 
 from sqlalchemy import *
 
-router = APIRouter()
+router = APIRouter(route_class=timing.TimedRoute)
+
+# Declared before /characters/{id} so "autocomplete" isn't parsed as an id.
+@router.get("/characters/autocomplete", tags=["characters"])
+async def autocomplete_characters(
+    prefix: str,
+    limit: int = Query(10, ge=1, le=50),
+):
+    """
+    This endpoint returns the characters whose names start with `prefix`,
+    ignoring case, in alphabetical order. For each character it returns:
+    * `character_id`: the internal id of the character.
+    * `character`: The name of the character.
+    * `movie`: The movie the character is from.
+    At most `limit` characters are returned.
+    """
+    ids = (await ngrams.character_names_async()).complete(prefix, limit)
+
+    corpus = await memory.get_corpus_async()
+    if corpus is not None:
+        # Like the inner join below, skips characters whose movie is missing.
+        characters = [corpus.characters[id] for id in ids]
+        return [
+            {
+                "character_id": char.id,
+                "character": char.name,
+                "movie": corpus.movies[char.movie_id].title,
+            }
+            for char in characters
+            if char.movie_id in corpus.movies
+        ]
+
+    async with db.async_engine.connect() as conn:
+        rows = await conn.execute(
+            sqlalchemy.select(
+                db.characters.c.character_id,
+                db.characters.c.name.label("character"),
+                db.movies.c.title.label("movie"),
+            )
+            .select_from(
+                db.characters.join(
+                    db.movies, db.characters.c.movie_id == db.movies.c.movie_id
+                )
+            )
+            .where(db.characters.c.character_id.in_(ids))
+        )
+        by_id = {row.character_id: row._asdict() for row in rows}
+    return [by_id[id] for id in ids if id in by_id]
+
+
+_other = db.characters.alias("other")
+_pairs = db.character_pair_lines
+# One row per conversation partner, or a single row of NULLs for a
+# character without any, in one round trip. Built once with a bound id; see
+# _line_query in src/api/lines.py.
+_character_select = (
+    sqlalchemy.select(
+        db.characters.c.character_id,
+        db.characters.c.name,
+        db.characters.c.gender,
+        db.movies.c.title,
+        _other.c.character_id.label("other_id"),
+        _other.c.name.label("other_name"),
+        _other.c.gender.label("other_gender"),
+        _pairs.c.num_lines,
+    )
+    .select_from(
+        db.characters.outerjoin(
+            db.movies, db.characters.c.movie_id == db.movies.c.movie_id
+        )
+        .outerjoin(
+            _pairs,
+            (_pairs.c.character_id == db.characters.c.character_id)
+            & (_pairs.c.num_lines > 0),
+        )
+        .outerjoin(_other, _other.c.character_id == _pairs.c.other_id)
+    )
+    .order_by(sqlalchemy.desc(_pairs.c.num_lines), _pairs.c.other_id)
+)
+_character_query = _character_select.where(
+    db.characters.c.character_id == sqlalchemy.bindparam("id")
+)
+_characters_query = _character_select.where(
+    db.characters.c.character_id.in_(sqlalchemy.bindparam("ids", expanding=True))
+)
+
+
+def _character_json(rows) -> dict:
+    """A character from its rows of _character_select."""
+    var = rows[0]
+    conv = [
+        {
+            "character_id": row.other_id,
+            "character": row.other_name,
+            "gender": row.other_gender,
+            "number_of_lines_together": row.num_lines,
+        }
+        for row in rows
+        if row.other_id is not None
+    ]
+    return {
+        "character_id": var.character_id,
+        "character": var.name,
+        "movie": var.title,
+        "gender": var.gender,
+        "top_conversations": conv,
+    }
+
+
+@router.get("/characters/batch", tags=["characters"])
+async def get_characters(ids: str):
+    """
+    This endpoint returns many characters at once. `ids` is a comma-separated
+    list of up to 250 character ids, e.g. `ids=1,2,3`. The result is an object
+    keyed by character id, whose values are what `/characters/{id}` returns
+    for that character, or `null` if there is no such character.
+    """
+    return await _get_characters(batch.parse(ids))
+
+
+@router.post("/characters/batch", tags=["characters"])
+async def post_characters(body: batch.BatchJson):
+    """
+    The same as `GET /characters/batch`, for lists of ids too long for a
+    url: the body is `{"ids": [1, 2, 3]}`.
+    """
+    return await _get_characters(batch.check(body.ids))
+
+
+async def _get_characters(ids):
+    corpus = await memory.get_corpus_async()
+    if corpus is not None:
+        return batch.respond(ids, batch.from_corpus(ids, corpus.get_character))
+
+    await counters.ensure_async()
+    async with db.async_engine.connect() as conn:
+        rows = await conn.execute(_characters_query, {"ids": ids})
+        by_id = {}
+        for row in rows:
+            by_id.setdefault(row.character_id, []).append(row)
+    return batch.respond(ids, {id: _character_json(r) for id, r in by_id.items()})
+
 
 @router.get("/characters/{id}", tags=["characters"])
-def get_character(id: int):
+@cache.cached("character", "id")
+async def get_character(id: int):
     """
     This endpoint returns a single character by its identifier. For each character
     it returns:
@@ -30,58 +183,19 @@ def get_character(id: int):
     * `number_of_lines_together`: The number of lines the character has with the
       originally queried character.
     """
-    with db.engine.connect() as conn:
-        var = conn.execute(
-            sqlalchemy.select(db.characters).where(db.characters.c.character_id == id)
-        ).fetchone()
-        if var:
-            var = var._asdict()
-            subquery1 = (
-            select(
-                db.conversations.c.conversation_id,
-                db.conversations.c.character1_id.label('character_id'),
-            )
-            .where(db.conversations.c.character2_id == id)
-            .cte(name='pl')
-            )
-            subquery2 = (
-                select(
-                    db.conversations.c.conversation_id,
-                    db.conversations.c.character2_id.label('character_id'),
-                )
-                .where(db.conversations.c.character1_id == id)
-                .cte(name='ml')
-            )
-            listb = (
-                select(
-                    db.characters.c.character_id,
-                    db.characters.c.name.label('character'),
-                    db.characters.c.gender,
-                    func.count().label('number_of_lines_together')
-                )
-                .select_from(
-                    db.lines.join(subquery1, subquery1.c.conversation_id == db.lines.c.conversation_id, isouter=True)
-                    .join(subquery2, subquery2.c.conversation_id == db.lines.c.conversation_id, isouter=True)
-                    .join(db.characters, db.characters.c.character_id == func.coalesce(subquery1.c.character_id, subquery2.c.character_id))
-                )
-                .where(db.characters.c.character_id != id)
-                .group_by(db.characters.c.character_id, db.characters.c.name, db.characters.c.gender)
-                .order_by(func.count().desc())
-            )
+    corpus = await memory.get_corpus_async()
+    if corpus is not None:
+        json = corpus.get_character(id)
+        if json is None:
+            raise HTTPException(status_code=404, detail="character not found.")
+        return json
 
-            conv = conn.execute(listb).fetchall()
-            conv = [c._asdict() for c in list(conv)]
-            movie = (conn.execute(
-                sqlalchemy.select(db.movies).where(db.movies.c.movie_id == var["movie_id"])
-            ).fetchone())._asdict()
-            sol = {
-                "character_id": id,
-                "character": var["name"],
-                "movie": movie["title"],
-                "gender": var["gender"],
-                "top_conversations": conv,
-            }
-            return sol
+    await counters.ensure_async()
+    async with db.async_engine.connect() as conn:
+        rows = (await conn.execute(_character_query, {"id": id})).fetchall()
+
+    if rows:
+        return _character_json(rows)
 
     raise HTTPException(status_code=404, detail="character not found.")
 
@@ -91,12 +205,84 @@ class character_sort_options(str, Enum):
     number_of_lines = "number_of_lines"
 
 
-@router.get("/characters/", tags=["characters"])
-def list_characters(
+class CharacterSummaryJson(BaseModel):
+    character_id: int
+    character: Optional[str]
+    movie: Optional[str]
+    number_of_lines: int
+
+
+_character_orders = {
+    character_sort_options.character: [(db.characters.c.name, False)],
+    character_sort_options.movie: [(db.movies.c.title, False)],
+    character_sort_options.number_of_lines: [
+        (db.character_line_counts.c.num_lines, True)
+    ],
+}
+
+
+def _character_order(sort):
+    # Ties by number of lines are broken on the id in the counts table, which
+    # its index on (-num_lines, character_id) can serve.
+    if sort == character_sort_options.number_of_lines:
+        id = db.character_line_counts.c.character_id
+    else:
+        id = db.characters.c.character_id
+    return _character_orders[sort] + [(id, False)]
+
+
+@functools.lru_cache(maxsize=None)
+def _list_characters_query(sort, filtered: bool, after: bool):
+    """
+    The list_characters statement for one sort option, with or without the
+    name filter and a cursor. Each is built once; a request only binds
+    `limit`, `offset`, the name `pattern` and the cursor values.
+    """
+    order = _character_order(sort)
+    query = (
+        sqlalchemy.select(
+            db.characters.c.character_id,
+            db.characters.c.name.label("character"),
+            db.movies.c.title.label("movie"),
+            db.character_line_counts.c.num_lines.label("number_of_lines"),
+        )
+        .select_from(
+            db.characters.join(
+                db.movies, db.characters.c.movie_id == db.movies.c.movie_id
+            )
+            .join(
+                db.character_line_counts,
+                db.characters.c.character_id == db.character_line_counts.c.character_id,
+            )
+        )
+        .where(db.character_line_counts.c.num_lines > 0)
+        .order_by(*pagination.order_by(order))
+        .limit(sqlalchemy.bindparam("limit"))
+        .offset(sqlalchemy.bindparam("offset"))
+    )
+    if filtered:
+        query = query.where(ngrams.contains(db.characters.c.name))
+    if after:
+        query = query.where(pagination.after_template(order))
+    responses.check(query, CharacterSummaryJson)
+    return query
+
+
+# The templates without a cursor are built at import; see src/api/movies.py.
+for _sort in _character_orders:
+    for _filtered in (False, True):
+        _list_characters_query(_sort, _filtered, False)
+
+
+@router.get(
+    "/characters/", tags=["characters"], response_model=List[CharacterSummaryJson]
+)
+async def list_characters(
     name: str = "",
     limit: int = Query(50, ge=1, le=250),
     offset: int = Query(0, ge=0),
     sort: character_sort_options = character_sort_options.character,
+    cursor: Optional[str] = None,
 ):
     """
     This endpoint returns a list of characters. For each character it returns:
@@ -115,51 +301,37 @@ def list_characters(
     parameters are used for pagination. The `limit` query parameter specifies the
     maximum number of results to return. The `offset` query parameter specifies the
     number of results to skip before returning results.
+    To walk the whole list, pass the `X-Next-Cursor` header of a full page
+    back as the `cursor` query parameter to get the page after it without
+    skipping rows; `offset` then counts from the cursor.
     """
-    json = []
-    sort_options = {
-        character_sort_options.character: db.characters.c.name,
-        character_sort_options.movie: db.movies.c.title,
-        character_sort_options.number_of_lines: sqlalchemy.desc("number_of_lines")
-    }
+    cursor_fields = {
+        character_sort_options.character: ("character", "character_id"),
+        character_sort_options.movie: ("movie", "character_id"),
+        character_sort_options.number_of_lines: ("number_of_lines", "character_id"),
+    }[sort]
+    after = pagination.parse(cursor, sort, _character_order(sort))
 
-    if sort not in sort_options:
-        assert False
+    corpus = await memory.get_corpus_async()
+    if corpus is not None:
+        json = corpus.list_characters(name, limit, offset, sort, after)
+    else:
+        json = await _list_characters(name, limit, offset, sort, after)
 
-    order_by = sort_options[sort]
+    response = responses.JSONResponse(json)
+    pagination.set_next_cursor(response, sort, json, cursor_fields, limit)
+    return response
 
-    query = (
-        sqlalchemy.select(
-            db.characters.c.character_id,
-            db.characters.c.name.label("character"),
-            db.movies.c.title.label("movie"),
-            sqlalchemy.func.count(db.lines.c.line_id).label("number_of_lines"),
-        )
-        .select_from(
-            db.characters.join(db.movies, db.characters.c.movie_id == db.movies.c.movie_id)
-            .join(db.lines, db.characters.c.character_id == db.lines.c.character_id)
-        )
-        .group_by(
-            db.characters.c.character_id,
-            db.characters.c.name,
-            db.movies.c.title,
-        )
-        .order_by(order_by, db.characters.c.character_id)
-        .limit(limit)
-        .offset(offset)
-    )
+
+async def _list_characters(name, limit, offset, sort, after) -> list:
+    await counters.ensure_async()
+    params = {"limit": limit, "offset": offset}
     if name != "":
-        query = query.where(db.characters.c.name.ilike(f"%{name}%"))
-
-    with db.engine.connect() as conn:
-        sol = conn.execute(query)
-        for i in sol:
-            json.append({
-                    "character_id": i.character_id,
-                    "character": i.character,
-                    "movie": i.movie,
-                    "number_of_lines": i.number_of_lines,
-                }
-            )
-    return json
+        params["pattern"] = ngrams.pattern(name)
+    if after is not None:
+        params.update(pagination.after_params(after))
+    query = _list_characters_query(sort, name != "", after is not None)
+
+    async with db.async_engine.connect() as conn:
+        return responses.rows(await conn.execute(query, params))
     
\ No newline at end of file
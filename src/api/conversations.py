@@ -1,11 +1,19 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from src import database as db
-from pydantic import BaseModel
-from typing import List
-from datetime import datetime
+from src import memory
+from src import counters
+from src import ids
+from src import versions
+from src import timing
+from pydantic import BaseModel, ValidationError
+import codecs
+import json
+import re
 import sqlalchemy
 from sqlalchemy import *
-from sqlalchemy.orm import Session 
+# After the star import, which would shadow typing.Tuple.
+from typing import Dict, List, Set, Tuple
 
 # FastAPI is inferring what the request body should look like
 # based on the following two classes.
@@ -22,12 +30,22 @@ class ConversationJson(BaseModel):
     lines: List[LinesJson]
 
 
-router = APIRouter()
+class BulkConversationJson(ConversationJson):
+    movie_id: int
+
+
+router = APIRouter(route_class=timing.TimedRoute)
+
 
 @router.post("/movies/{movie_id}/conversations/", tags=["movies"])
-def add_conversation(movie_id: int, conversation: ConversationJson):
-    with db.engine.begin() as conn:
-        vars = conn.execute(sqlalchemy.select(db.characters.c.character_id).where(db.characters.c.movie_id == movie_id)
+async def add_conversation(movie_id: int, conversation: ConversationJson):
+    await counters.ensure_async()
+    await versions.ensure_async()
+    async with db.async_engine.begin() as conn:
+        vars = await conn.execute(
+            sqlalchemy.select(db.characters.c.character_id).where(
+                db.characters.c.movie_id == movie_id
+            )
         )
         vars = vars.fetchall()
         id_list = {c.character_id for c in vars}
@@ -35,20 +53,16 @@ def add_conversation(movie_id: int, conversation: ConversationJson):
             raise HTTPException(status_code=400, detail="character not in movie")
         if conversation.character_1_id == conversation.character_2_id:
             raise HTTPException(status_code=400, detail="characters are the same")
-        convo_id = conn.execute(
-            sqlalchemy.select(sqlalchemy.func.max(db.conversations.c.conversation_id))
-        ).scalar()+ 1
-        conn.execute(
-            db.conversations.insert().values(
-                conversation_id=convo_id,
-                character1_id=conversation.character_1_id,
-                character2_id=conversation.character_2_id,
-                movie_id=movie_id,
-            )
-        )
-        line_id = conn.execute(
-            sqlalchemy.select(sqlalchemy.func.max(db.lines.c.line_id))
-        ).scalar()+1
+        # Reserved before this transaction writes anything; see src.ids.
+        convo_id = await run_in_threadpool(ids.conversation_ids)
+        line_id = await run_in_threadpool(ids.line_ids, len(conversation.lines))
+        convo = {
+            "conversation_id": convo_id,
+            "character1_id": conversation.character_1_id,
+            "character2_id": conversation.character_2_id,
+            "movie_id": movie_id,
+        }
+        await conn.execute(db.conversations.insert().values(**convo))
         lista = [
             {
                 "line_id": line_id+i,
@@ -61,8 +75,261 @@ def add_conversation(movie_id: int, conversation: ConversationJson):
             for i, line in enumerate(conversation.lines)
         ]
         
-        conn.execute(db.lines.insert(), lista)
-        conn.commit()
+        await conn.execute(db.lines.insert(), lista)
+        await conn.run_sync(counters.record_lines, lista, [convo])
+        await conn.run_sync(versions.record, [convo_id])
+        await conn.commit()
         json = {'id': convo_id}
 
-    return json
\ No newline at end of file
+    # Applies the conversation to this worker's copies of the data and drops
+    # the cached responses it changes.
+    await run_in_threadpool(versions.refresh)
+
+    return json
+
+# Records inserted per transaction by the bulk endpoint.
+BULK_CHUNK_SIZE = 500
+
+
+# A complete string literal, a bracket or comma, or the quote opening a
+# string that hasn't all arrived yet.
+_json_token = re.compile(r'"(?:[^"\\]|\\.)*"|[\[\]{},]|"')
+
+
+def _element_end(buffer: str):
+    """
+    The position of the ``,`` or ``]`` that ends the array element at the
+    start of ``buffer``, or None if it hasn't arrived yet. Only brackets and
+    strings are followed, so this finds the end of a malformed element too.
+    """
+    depth = 0
+    for token in _json_token.finditer(buffer):
+        char = token.group()
+        if char == '"':
+            return None
+        if char in "[{":
+            depth += 1
+        elif char in "]}":
+            depth -= 1
+            if depth < 0:
+                return token.start()
+        elif char == "," and depth == 0:
+            return token.start()
+    return None
+
+
+async def _read_records(request: Request):
+    """
+    Yields ``(value, error)`` for each record of an NDJSON body or of a
+    top-level JSON array, parsing the body as it arrives. A malformed array
+    element is reported and skipped up to the ``,`` or ``]`` that ends it,
+    and anything but whitespace after the closing ``]`` is reported as well.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    is_array = None
+    done = False
+    trailing = False
+
+    async def more():
+        async for chunk in request.stream():
+            yield utf8.decode(chunk)
+        yield utf8.decode(b"", final=True)
+
+    async for text in more():
+        buffer += text
+        if is_array is None:
+            buffer = buffer.lstrip()
+            if not buffer:
+                continue
+            is_array = buffer[0] == "["
+            if is_array:
+                buffer = buffer[1:]
+        if done:
+            # Only whether anything follows the array matters.
+            trailing = trailing or bool(buffer.strip())
+            buffer = ""
+            continue
+        if not is_array:
+            *records, buffer = buffer.split("\n")
+            for record in records:
+                if record.strip():
+                    try:
+                        yield json.loads(record), None
+                    except ValueError as e:
+                        yield None, f"invalid json: {e}"
+            continue
+        while True:
+            buffer = buffer.lstrip().lstrip(",").lstrip()
+            if buffer.startswith("]"):
+                buffer = buffer[1:]
+                done = True
+                break
+            try:
+                value, end = decoder.raw_decode(buffer)
+                rest = buffer[end:].lstrip()
+                if rest[:1] in (",", "]"):
+                    buffer = rest
+                    yield value, None
+                    continue
+            except ValueError:
+                pass
+            # Incomplete, or followed by something other than , or ].
+            end = _element_end(buffer)
+            if end is None:
+                break  # Wait for the rest of the record.
+            element, buffer = buffer[:end], buffer[end:]
+            try:
+                yield json.loads(element), None
+            except ValueError as e:
+                yield None, f"invalid json: {e}"
+
+    if done and (trailing or buffer.strip()):
+        yield None, "invalid json: data after the closing ]"
+    elif is_array and not done:
+        element = buffer.lstrip().lstrip(",").strip()
+        if element:
+            try:
+                yield json.loads(element), None
+            except ValueError as e:
+                yield None, f"invalid json: {e}"
+        yield None, "invalid json: unterminated array"
+    elif not is_array and buffer.strip():
+        try:
+            yield json.loads(buffer), None
+        except ValueError as e:
+            yield None, f"invalid json: {e}"
+
+
+def _insert_chunk(
+    chunk: List[Tuple[int, BulkConversationJson]],
+    movie_characters: Dict[int, Set[int]],
+    inserted: List[dict],
+    errors: List[dict],
+):
+    """Validates and inserts one chunk of records in a single transaction."""
+    corpus = memory.get_corpus()
+    valid = []
+    try:
+        with db.engine.begin() as conn:
+            unknown = {r.movie_id for _, r in chunk} - movie_characters.keys()
+            for movie_id in unknown:
+                movie_characters[movie_id] = set()
+            if corpus is not None:
+                for movie_id in unknown:
+                    movie_characters[movie_id].update(
+                        corpus.characters_by_movie.get(movie_id, ())
+                    )
+            elif unknown:
+                rows = conn.execute(
+                    sqlalchemy.select(
+                        db.characters.c.movie_id, db.characters.c.character_id
+                    ).where(db.characters.c.movie_id.in_(unknown))
+                )
+                for row in rows:
+                    movie_characters[row.movie_id].add(row.character_id)
+
+            for i, record in chunk:
+                pair = {record.character_1_id, record.character_2_id}
+                if not pair.issubset(movie_characters[record.movie_id]):
+                    errors.append({"index": i, "detail": "character not in movie"})
+                elif record.character_1_id == record.character_2_id:
+                    errors.append({"index": i, "detail": "characters are the same"})
+                else:
+                    valid.append((i, record))
+            if not valid:
+                return
+
+            # Reserved before this transaction writes anything; see src.ids.
+            convo_id = ids.conversation_ids(len(valid))
+            line_id = ids.line_ids(sum(len(record.lines) for _, record in valid))
+            conversation_rows = []
+            line_rows = []
+            for n, (_, record) in enumerate(valid):
+                conversation_rows.append(
+                    {
+                        "conversation_id": convo_id + n,
+                        "character1_id": record.character_1_id,
+                        "character2_id": record.character_2_id,
+                        "movie_id": record.movie_id,
+                    }
+                )
+                for sort, line in enumerate(record.lines):
+                    line_rows.append(
+                        {
+                            "line_id": line_id,
+                            "character_id": line.character_id,
+                            "movie_id": record.movie_id,
+                            "conversation_id": convo_id + n,
+                            "line_sort": sort,
+                            "line_text": line.line_text,
+                        }
+                    )
+                    line_id += 1
+
+            # Multi-row executemany batches rather than a statement per row.
+            conn.execute(db.conversations.insert(), conversation_rows)
+            if line_rows:
+                conn.execute(db.lines.insert(), line_rows)
+                counters.record_lines(conn, line_rows, conversation_rows)
+            versions.record(
+                conn, [row["conversation_id"] for row in conversation_rows]
+            )
+    except sqlalchemy.exc.SQLAlchemyError as e:
+        detail = f"insert failed: {getattr(e, 'orig', None) or e}"
+        reported = {error["index"] for error in errors}
+        for i, _ in chunk:
+            if i not in reported:
+                errors.append({"index": i, "detail": detail})
+        return
+
+    for n, (i, _) in enumerate(valid):
+        inserted.append({"index": i, "id": convo_id + n})
+    versions.refresh()
+
+
+@router.post("/conversations/bulk", tags=["conversations"])
+async def add_conversations(request: Request):
+    """
+    This endpoint adds many conversations, possibly across movies, in one
+    request. The body is either newline-delimited JSON (one conversation per
+    line) or a JSON array of conversations, and is processed as it streams
+    in. Each conversation has the same fields as the body of
+    `/movies/{movie_id}/conversations/` plus its `movie_id`.
+
+    Conversations are validated and inserted in chunks, one transaction per
+    chunk. A bad record doesn't stop the others; the response lists:
+    * `inserted`: the `index` of each added conversation in the body and its
+      new conversation `id`.
+    * `errors`: the `index` and `detail` of each rejected conversation.
+    """
+    await counters.ensure_async()
+    await versions.ensure_async()
+    movie_characters: Dict[int, Set[int]] = {}
+    inserted: List[dict] = []
+    errors: List[dict] = []
+    chunk: List[Tuple[int, BulkConversationJson]] = []
+
+    i = -1
+    async for value, error in _read_records(request):
+        i += 1
+        if error is None:
+            try:
+                chunk.append((i, BulkConversationJson.parse_obj(value)))
+            except ValidationError as e:
+                error = e.errors()
+        if error is not None:
+            errors.append({"index": i, "detail": error})
+        if len(chunk) == BULK_CHUNK_SIZE:
+            await run_in_threadpool(
+                _insert_chunk, chunk, movie_characters, inserted, errors
+            )
+            chunk = []
+    if chunk:
+        await run_in_threadpool(
+            _insert_chunk, chunk, movie_characters, inserted, errors
+        )
+
+    errors.sort(key=lambda e: e["index"])
+    return {"inserted": inserted, "errors": errors}
@@ -0,0 +1,103 @@
+import csv
+import io
+from enum import Enum
+from typing import Optional
+
+import sqlalchemy
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+
+from src import database as db
+from src import responses
+from src import timing
+
+router = APIRouter(route_class=timing.TimedRoute)
+
+# Rows fetched from the server-side cursor, and sent, at a time.
+CHUNK_SIZE = 1000
+
+
+class export_tables(str, Enum):
+    movies = "movies"
+    characters = "characters"
+    conversations = "conversations"
+    lines = "lines"
+
+
+class export_formats(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+
+MEDIA_TYPES = {
+    export_formats.ndjson: "application/x-ndjson",
+    export_formats.csv: "text/csv",
+}
+
+
+def _ndjson(keys, rows) -> bytes:
+    return b"".join(responses.dumps(dict(zip(keys, row))) + b"\n" for row in rows)
+
+
+def _csv(rows) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue().encode("utf-8")
+
+
+async def _stream(query, format: export_formats):
+    async with db.async_engine.connect() as conn:
+        result = await conn.stream(query.execution_options(yield_per=CHUNK_SIZE))
+        keys = list(result.keys())
+        if format == export_formats.csv:
+            yield _csv([keys])
+        async for rows in result.partitions():
+            yield _ndjson(keys, rows) if format == export_formats.ndjson else _csv(rows)
+
+
+@router.get("/export/{table}", tags=["export"])
+async def export_table(
+    table: export_tables,
+    format: export_formats = export_formats.ndjson,
+    movie_id: Optional[int] = None,
+    character_id: Optional[int] = None,
+    conversation_id: Optional[int] = None,
+):
+    """
+    This endpoint streams every row of `table` (`movies`, `characters`,
+    `conversations` or `lines`) in id order, with all of its columns. Each
+    row is a JSON object on its own line with `format=ndjson` (the default),
+    or a CSV record after a header with `format=csv`.
+
+    The rows can be narrowed down with `movie_id`, and for the tables that
+    have the column, `character_id` and `conversation_id`. For lines, a
+    `character_id` matches the character who says the line.
+
+    Unlike the paginated list endpoints, the whole table comes in one
+    response, read from the database as it is sent, so it is the way to
+    fetch a full dataset.
+    """
+    t = db.metadata_obj.tables[table.value]
+    query = sqlalchemy.select(t).order_by(*t.primary_key.columns)
+    filters = {
+        "movie_id": movie_id,
+        "character_id": character_id,
+        "conversation_id": conversation_id,
+    }
+    for column, value in filters.items():
+        if value is None:
+            continue
+        if column not in t.c:
+            raise HTTPException(
+                status_code=400, detail=f"{table.value} can't be filtered by {column}."
+            )
+        query = query.where(t.c[column] == value)
+
+    extension = "ndjson" if format == export_formats.ndjson else "csv"
+    return StreamingResponse(
+        _stream(query, format),
+        media_type=MEDIA_TYPES[format],
+        headers={
+            "Content-Disposition": f'attachment; filename="{table.value}.{extension}"'
+        },
+    )
@@ -0,0 +1,76 @@
+from enum import Enum
+
+from fastapi import APIRouter, HTTPException
+from fastapi.params import Query
+
+from src import graph
+from src import timing
+
+router = APIRouter(route_class=timing.TimedRoute)
+
+
+class centrality_sort_options(str, Enum):
+    betweenness = "betweenness"
+    degree = "degree"
+    conversations = "conversations"
+
+
+@router.get("/movies/{movie_id}/centrality", tags=["graph"])
+async def get_centrality(
+    movie_id: int,
+    sort: centrality_sort_options = centrality_sort_options.betweenness,
+    limit: int = Query(50, ge=1, le=250),
+):
+    """
+    This endpoint ranks the characters of a movie by how central they are
+    to its conversations. For each character it returns:
+    * `character_id`: the internal id of the character.
+    * `character`: The name of the character.
+    * `degree`: The number of other characters they have talked with.
+    * `conversations`: The number of conversations they are in.
+    * `betweenness`: The share, from 0 to 1, of the shortest chains of
+      conversations between two other characters that pass through them.
+
+    The `sort` query parameter picks the measure to rank by, highest first.
+    At most `limit` characters are returned.
+    """
+    g = await graph.get_graph_async()
+    if movie_id not in g.by_movie:
+        raise HTTPException(status_code=404, detail="movie not found.")
+    ranking = g.centrality(movie_id)
+    ranking.sort(key=lambda c: (-c[sort.value], c["character_id"]))
+    return ranking[:limit]
+
+
+@router.get("/movies/{movie_id}/communities", tags=["graph"])
+async def get_communities(movie_id: int):
+    """
+    This endpoint splits the characters of a movie into communities: groups
+    that mostly talk among themselves. Each community is a list of
+    characters, with their `character_id` and `character` name, and the
+    largest communities come first. Characters without any conversation
+    aren't in any community.
+    """
+    g = await graph.get_graph_async()
+    if movie_id not in g.by_movie:
+        raise HTTPException(status_code=404, detail="movie not found.")
+    return g.communities(movie_id)
+
+
+@router.get("/characters/{id}/path/{other_id}", tags=["graph"])
+async def get_path(id: int, other_id: int):
+    """
+    This endpoint returns the shortest chain of conversations from one
+    character to another: a list of characters, each with their
+    `character_id` and `character` name, starting with `id` and ending with
+    `other_id`, where each has talked with the next. Characters only talk
+    within their movie, so there is no path between characters of different
+    movies.
+    """
+    g = await graph.get_graph_async()
+    if id not in g.node or other_id not in g.node:
+        raise HTTPException(status_code=404, detail="character not found.")
+    path = g.shortest_path(id, other_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="no path between the characters.")
+    return path
@@ -1,15 +1,173 @@
 from fastapi import APIRouter, HTTPException
 from enum import Enum
 from collections import Counter
+from typing import List, Optional
+import functools
 from fastapi.params import Query 
+from pydantic import BaseModel
 from src import database as db
+from src import memory
+from src import ngrams
+from src import pagination
+from src import search
+from src import cache
+from src import timing
+from src import responses
+from src import batch
 import sqlalchemy
 from sqlalchemy import *
 
-router = APIRouter()
+router = APIRouter(route_class=timing.TimedRoute)
+
+# Declared before /lines/{id} so that "search" isn't parsed as a line id.
+@router.get("/lines/search", tags=["lines"])
+async def search_lines(
+    q: str,
+    limit: int = Query(50, ge=1, le=250),
+    offset: int = Query(0, ge=0),
+):
+    """
+    This endpoint searches the text of every line. Lines must contain every
+    word of `q`, and words in double quotes must appear together as a phrase,
+    e.g. `q=apples "no i like"`. Results are ranked by relevance (BM25) and
+    for each line it returns:
+    * `line_id`: the internal id of the line. Can be used to query the
+      `/lines/{line_id}` endpoint.
+    * `character`: The character who says the line.
+    * `movie`: The movie that contains the line.
+    * `conversation_id`: The internal id of the conversation that contains the line.
+    * `line_text`: The text of the line.
+    * `score`: How well the line matches, highest first.
+
+    The `limit` and `offset` query parameters are used for pagination.
+    """
+    hits = (await search.get_index_async()).search(q, offset + limit)[offset:]
+    scores = dict(hits)
+
+    corpus = await memory.get_corpus_async()
+    if corpus is not None:
+        return [
+            dict(line, score=scores[line["line_id"]])
+            for line in corpus.line_summaries(scores)
+        ]
+
+    query = select(
+        db.lines.c.line_id,
+        db.characters.c.name.label("character"),
+        db.movies.c.title.label("movie"),
+        db.lines.c.conversation_id,
+        db.lines.c.line_text,
+    ).select_from(
+        join(
+            join(
+                db.lines,
+                db.characters,
+                db.lines.c.character_id == db.characters.c.character_id,
+            ),
+            db.movies, db.lines.c.movie_id == db.movies.c.movie_id
+        )
+    ).where(
+        db.lines.c.line_id.in_(list(scores))
+    )
+    async with db.async_engine.connect() as conn:
+        rows = [
+            dict(i._asdict(), score=scores[i.line_id])
+            for i in await conn.execute(query)
+        ]
+    rows.sort(key=lambda r: (-r["score"], r["line_id"]))
+    return rows
+
+
+# The single-item queries are built once, with the id as a bound parameter,
+# so every request reuses the same compiled SQL and, with asyncpg, the same
+# server-side prepared statement and plan.
+_line_select = select(
+    db.lines.c.line_id,
+    db.lines.c.character_id,
+    db.characters.c.name.label("character"),
+    db.movies.c.movie_id,
+    db.movies.c.title.label("movie"),
+    db.lines.c.conversation_id,
+    db.lines.c.line_text.label("text"),
+).select_from(
+    join(
+        join(
+            db.lines,
+            db.characters,
+            db.lines.c.character_id == db.characters.c.character_id,
+        ),
+        db.movies, db.lines.c.movie_id == db.movies.c.movie_id
+    )
+)
+_line_query = _line_select.where(db.lines.c.line_id == sqlalchemy.bindparam("id"))
+_lines_query = _line_select.where(
+    db.lines.c.line_id.in_(sqlalchemy.bindparam("ids", expanding=True))
+)
+
+_c1 = db.characters.alias("c1")
+_c2 = db.characters.alias("c2")
+_conversation_query = select(
+    db.conversations.c.conversation_id.label("convo_id"),
+    _c1.c.name.label("character_1"),
+    _c2.c.name.label("character_2"),
+    db.movies.c.title.label("movie"),
+).select_from(
+    db.conversations
+    .join(db.movies, db.movies.c.movie_id == db.conversations.c.movie_id)
+    .join(_c1, _c1.c.character_id == db.conversations.c.character1_id)
+    .join(_c2, _c2.c.character_id == db.conversations.c.character2_id)
+).where(
+    db.conversations.c.conversation_id == sqlalchemy.bindparam("id")
+)
+
+_conversation_lines_query = select(
+    db.lines.c.line_id,
+    db.characters.c.name.label("character"),
+    db.lines.c.line_text
+).select_from(
+    join(
+        db.lines,
+        db.characters,
+        db.lines.c.character_id == db.characters.c.character_id
+    )
+).where(
+    db.lines.c.conversation_id == sqlalchemy.bindparam("id")
+)
+
+
+@router.get("/lines/batch", tags=["lines"])
+async def get_lines(ids: str):
+    """
+    This endpoint returns many lines at once. `ids` is a comma-separated list
+    of up to 250 line ids, e.g. `ids=1,2,3`. The result is an object keyed by
+    line id, whose values are what `/lines/{line_id}` returns for that line,
+    or `null` if there is no such line.
+    """
+    return await _get_lines(batch.parse(ids))
+
+
+@router.post("/lines/batch", tags=["lines"])
+async def post_lines(body: batch.BatchJson):
+    """
+    The same as `GET /lines/batch`, for lists of ids too long for a url: the
+    body is `{"ids": [1, 2, 3]}`.
+    """
+    return await _get_lines(batch.check(body.ids))
+
+
+async def _get_lines(ids):
+    corpus = await memory.get_corpus_async()
+    if corpus is not None:
+        return batch.respond(ids, batch.from_corpus(ids, corpus.get_line))
+
+    async with db.async_engine.connect() as conn:
+        rows = await conn.execute(_lines_query, {"ids": ids})
+        return batch.respond(ids, {row.line_id: row._asdict() for row in rows})
+
 
 @router.get("/lines/{id}", tags=["lines"])
-def get_line(id: int):
+@cache.cached("line", "id")
+async def get_line(id: int):
     """
     This endpoint returns a single line by its identifier. For each line
     it returns:
@@ -22,38 +180,18 @@ def get_line(id: int):
     * `conversation_id`: The internal id of the conversation that contains the line.
     * `text`: The text of the line.
     """
-    with db.engine.connect() as conn:
-        var = select(
-            db.lines.c.line_id,
-            db.lines.c.character_id,
-            db.characters.c.name,
-            db.movies.c.movie_id,
-            db.movies.c.title,
-            db.lines.c.line_text,
-            db.lines.c.conversation_id
-        ).select_from(
-            join(
-                join(db.lines, db.characters, db.lines.c.character_id == db.characters.c.character_id),
-                db.movies, db.lines.c.movie_id == db.movies.c.movie_id
-            )
-        ).where(
-            db.lines.c.line_id == id
-        )
-        var = conn.execute(var).fetchall()
-
-        if var:
-            line_dict = [row._asdict() for row in var]
-            result = {
-                "line_id": line_dict[0]["line_id"],
-                "character_id": line_dict[0]["character_id"],
-                "character": line_dict[0]["name"],
-                "movie_id": line_dict[0]["movie_id"],
-                "movie": line_dict[0]["title"],
-                "conversation_id": line_dict[0]["conversation_id"],
-                "text": line_dict[0]["line_text"],
-            }
-
-            return result
+    corpus = await memory.get_corpus_async()
+    if corpus is not None:
+        json = corpus.get_line(id)
+        if json is None:
+            raise HTTPException(status_code=404, detail="line not found.")
+        return json
+
+    async with db.async_engine.connect() as conn:
+        line = (await conn.execute(_line_query, {"id": id})).first()
+
+        if line is not None:
+            return line._asdict()
 
     raise HTTPException(status_code=404, detail="line not found.")
 
@@ -62,12 +200,77 @@ class line_sort_options(str, Enum):
     movie_title = "movie_title"
     line_text = "line_text"
 
-@router.get("/lines/", tags=["lines"])
-def list_lines(
+
+class LineSummaryJson(BaseModel):
+    line_id: int
+    character: Optional[str]
+    movie: Optional[str]
+    conversation_id: Optional[int]
+    line_text: Optional[str]
+
+
+_line_orders = {
+    line_sort_options.movie_title: [
+        (db.movies.c.title, False),
+        (db.lines.c.line_text, False),
+    ],
+    line_sort_options.line_text: [(db.lines.c.line_text, False)],
+}
+
+
+def _line_order(sort):
+    return _line_orders[sort] + [(db.lines.c.line_id, False)]
+
+
+@functools.lru_cache(maxsize=None)
+def _list_lines_query(sort, filtered: bool, after: bool):
+    """
+    The list_lines statement for one sort option, with or without the text
+    filter and a cursor. Each is built once; a request only binds `limit`,
+    `offset`, the character name `pattern` and the cursor values.
+    """
+    order = _line_order(sort)
+    query = select(
+        db.lines.c.line_id,
+        db.characters.c.name.label("character"),
+        db.movies.c.title.label("movie"),
+        db.lines.c.conversation_id,
+        db.lines.c.line_text,
+    ).select_from(
+        join(
+            join(
+                db.lines,
+                db.characters,
+                db.lines.c.character_id == db.characters.c.character_id,
+            ),
+            db.movies, db.lines.c.movie_id == db.movies.c.movie_id
+        )
+    ).limit(
+        sqlalchemy.bindparam("limit")
+    ).offset(
+        sqlalchemy.bindparam("offset")
+    ).order_by(*pagination.order_by(order))
+    if filtered:
+        query = query.where(ngrams.contains(db.characters.c.name))
+    if after:
+        query = query.where(pagination.after_template(order))
+    responses.check(query, LineSummaryJson)
+    return query
+
+
+# The templates without a cursor are built at import; see src/api/movies.py.
+for _sort in _line_orders:
+    for _filtered in (False, True):
+        _list_lines_query(_sort, _filtered, False)
+
+
+@router.get("/lines/", tags=["lines"], response_model=List[LineSummaryJson])
+async def list_lines(
     text: str="",
     limit: int = Query(50, ge=1, le=250),
     offset: int = Query(0, ge=0),
     sort: line_sort_options = line_sort_options.line_text,
+    cursor: Optional[str] = None,
     ):
     """
     This endpoint returns a list of lines. For each line it returns:
@@ -86,40 +289,47 @@ def list_lines(
     parameters are used for pagination. The `limit` query parameter specifies the
     maximum number of results to return. The `offset` query parameter specifies the
     number of results to skip before returning results.
+
+    To walk every line, pass the `X-Next-Cursor` header of a full page back as
+    the `cursor` query parameter. The next page is then found by seeking past
+    the last line instead of skipping rows; `offset` counts from the cursor.
+    Sorted by `line_text`, the seek uses an index, so deep pages are as fast
+    as the first one. Sorted by `movie_title`, the lines are ordered by
+    another table and every page still sorts the matching lines.
     """
-    if sort is line_sort_options.movie_title:
-        order_by = db.movies.c.title
-    elif sort is line_sort_options.line_text:
-        order_by = db.lines.c.line_text
+    cursor_fields = {
+        line_sort_options.movie_title: ("movie", "line_text", "line_id"),
+        line_sort_options.line_text: ("line_text", "line_id"),
+    }[sort]
+    after = pagination.parse(cursor, sort, _line_order(sort))
+
+    corpus = await memory.get_corpus_async()
+    if corpus is not None:
+        sol = corpus.list_lines(text, limit, offset, sort, after)
     else:
-        assert False
-
-    with db.engine.connect() as conn:
-        query = select(
-            db.lines.c.line_id,
-            db.characters.c.name.label("character"),
-            db.movies.c.title.label("movie"),
-            db.lines.c.conversation_id,
-            db.lines.c.line_text,
-        ).select_from(
-            join(
-                join(db.lines, db.characters, db.lines.c.character_id == db.characters.c.character_id),
-                db.movies, db.lines.c.movie_id == db.movies.c.movie_id
-            )
-        ).where(
-            db.characters.c.name.ilike(f"%{text}%")
-        ).limit(limit).offset(offset).order_by(order_by, db.lines.c.line_text)
-        
-        sol = conn.execute(query).fetchall()
-
-        if sol:
-            sol = [i._asdict() for i in sol]
-            return sol
-        
-    raise HTTPException(status_code=404, detail="lines not found.")
+        sol = await _list_lines(text, limit, offset, sort, after)
+    if not sol:
+        raise HTTPException(status_code=404, detail="lines not found.")
+
+    response = responses.JSONResponse(sol)
+    pagination.set_next_cursor(response, sort, sol, cursor_fields, limit)
+    return response
+
+
+async def _list_lines(text, limit, offset, sort, after) -> list:
+    params = {"limit": limit, "offset": offset}
+    if text != "":
+        params["pattern"] = ngrams.pattern(text)
+    if after is not None:
+        params.update(pagination.after_params(after))
+    query = _list_lines_query(sort, text != "", after is not None)
+
+    async with db.async_engine.connect() as conn:
+        return responses.rows(await conn.execute(query, params))
 
 @router.get("/conversations/{id}", tags=["conversations"])
-def get_conversation(id: int):
+@cache.cached("conversation", "id")
+async def get_conversation(id: int):
     """
     This endpoint returns a single conversation by its identifier. For each conversation it returns:
     * `conversation_id`: the internal id of the conversation.
@@ -132,32 +342,19 @@ def get_conversation(id: int):
        * `character`: the character who said the line.
        * `line_text`: the text of the line.
     """
-    with db.engine.connect() as conn:
-        query = f"""
-        SELECT convos.conversation_id convo_id, c1.name character_1, c2.name character_2, m.title movie
-        FROM conversations as convos
-        JOIN movies as m ON m.movie_id = convos.movie_id
-        JOIN characters as c1 ON c1.character_id = convos.character1_id
-        JOIN characters as c2 ON c2.character_id = convos.character2_id
-        WHERE {id} = convos.conversation_id
-        """
-
-        convo = conn.execute(sqlalchemy.text(query),).fetchone()._asdict()
-        if convo:
-            query = select(
-                db.lines.c.line_id,
-                db.characters.c.name.label("character"),
-                db.lines.c.line_text
-            ).select_from(
-                join(
-                    db.lines,
-                    db.characters,
-                    db.lines.c.character_id == db.characters.c.character_id
-                )
-            ).where(
-                db.lines.c.conversation_id == id
-            )
-            convo["lines"] = [l._asdict() for l in conn.execute(query).fetchall()]
+    corpus = await memory.get_corpus_async()
+    if corpus is not None:
+        json = corpus.get_conversation(id)
+        if json is None:
+            raise HTTPException(status_code=404, detail="conversation not found.")
+        return json
+
+    async with db.async_engine.connect() as conn:
+        convo = (await conn.execute(_conversation_query, {"id": id})).fetchone()
+        if convo is not None:
+            convo = convo._asdict()
+            rows = await conn.execute(_conversation_lines_query, {"id": id})
+            convo["lines"] = [l._asdict() for l in rows.fetchall()]
             return convo
 
-    raise HTTPException(status_code=404, detail="line not found.")
+    raise HTTPException(status_code=404, detail="conversation not found.")
@@ -1,14 +1,188 @@
 from fastapi import APIRouter, HTTPException
 from enum import Enum
+from typing import List, Optional
+import functools
 from src import database as db
+from src import memory
+from src import ngrams
+from src import counters
+from src import pagination
+from src import cache
+from src import timing
+from src import responses
+from src import batch
 import sqlalchemy
-from sqlalchemy import func, join, outerjoin, select, desc
 from fastapi.params import Query
+from pydantic import BaseModel
+
+router = APIRouter(route_class=timing.TimedRoute)
+
+# Declared before /movies/{movie_id} so "autocomplete" isn't parsed as an id.
+@router.get("/movies/autocomplete", tags=["movies"])
+async def autocomplete_movies(
+    prefix: str,
+    limit: int = Query(10, ge=1, le=50),
+):
+    """
+    This endpoint returns the movies whose titles start with `prefix`,
+    ignoring case, in alphabetical order. For each movie it returns:
+    * `movie_id`: the internal id of the movie.
+    * `movie_title`: The title of the movie.
+    At most `limit` movies are returned.
+    """
+    ids = (await ngrams.movie_titles_async()).complete(prefix, limit)
+
+    corpus = await memory.get_corpus_async()
+    if corpus is not None:
+        return [
+            {"movie_id": id, "movie_title": corpus.movies[id].title} for id in ids
+        ]
+
+    async with db.async_engine.connect() as conn:
+        rows = await conn.execute(
+            sqlalchemy.select(
+                db.movies.c.movie_id,
+                db.movies.c.title.label("movie_title"),
+            ).where(db.movies.c.movie_id.in_(ids))
+        )
+        by_id = {row.movie_id: row._asdict() for row in rows}
+    return [by_id[id] for id in ids if id in by_id]
+
+
+# Built once with a bound movie_id; see _line_query in src/api/lines.py.
+_movie_query = (
+    sqlalchemy.select(
+        db.movies.c.movie_id,
+        db.movies.c.title,
+    )
+    .where(db.movies.c.movie_id == sqlalchemy.bindparam("movie_id"))
+)
+
+_top_characters_query = (
+    sqlalchemy.select(
+        db.characters.c.character_id, 
+        db.characters.c.name, 
+        db.character_line_counts.c.num_lines,
+    )
+    .select_from(
+        db.characters.join(
+            db.character_line_counts,
+            db.characters.c.character_id == db.character_line_counts.c.character_id,
+        )
+    )
+    .where(db.characters.c.movie_id == sqlalchemy.bindparam("movie_id"))
+    .where(db.character_line_counts.c.num_lines > 0)
+    .order_by(
+        sqlalchemy.desc(db.character_line_counts.c.num_lines),
+        db.characters.c.character_id,
+    )
+    .limit(5)
+)
+
+# The same for many movies at once: each movie's characters are ranked as
+# in _top_characters_query and the first five of each kept.
+_movies_query = sqlalchemy.select(
+    db.movies.c.movie_id,
+    db.movies.c.title,
+).where(db.movies.c.movie_id.in_(sqlalchemy.bindparam("ids", expanding=True)))
+
+_ranked_characters = (
+    sqlalchemy.select(
+        db.characters.c.movie_id,
+        db.characters.c.character_id,
+        db.characters.c.name,
+        db.character_line_counts.c.num_lines,
+        sqlalchemy.func.row_number()
+        .over(
+            partition_by=db.characters.c.movie_id,
+            order_by=(
+                sqlalchemy.desc(db.character_line_counts.c.num_lines),
+                db.characters.c.character_id,
+            ),
+        )
+        .label("rank"),
+    )
+    .select_from(
+        db.characters.join(
+            db.character_line_counts,
+            db.characters.c.character_id == db.character_line_counts.c.character_id,
+        )
+    )
+    .where(db.characters.c.movie_id.in_(sqlalchemy.bindparam("ids", expanding=True)))
+    .where(db.character_line_counts.c.num_lines > 0)
+    .subquery()
+)
+
+_movies_top_characters_query = (
+    sqlalchemy.select(
+        _ranked_characters.c.movie_id,
+        _ranked_characters.c.character_id,
+        _ranked_characters.c.name,
+        _ranked_characters.c.num_lines,
+    )
+    .where(_ranked_characters.c.rank <= 5)
+    .order_by(_ranked_characters.c.movie_id, _ranked_characters.c.rank)
+)
+
+
+def _movie_json(movie, characters) -> dict:
+    return {
+        "movie_id": movie.movie_id,
+        "title": movie.title,
+        "top_characters": [
+            {
+                "character_id": i.character_id,
+                "character": i.name,
+                "num_lines": i.num_lines,
+            }
+            for i in characters
+        ],
+    }
+
+
+@router.get("/movies/batch", tags=["movies"])
+async def get_movies(ids: str):
+    """
+    This endpoint returns many movies at once. `ids` is a comma-separated
+    list of up to 250 movie ids, e.g. `ids=1,2,3`. The result is an object
+    keyed by movie id, whose values are what `/movies/{movie_id}` returns for
+    that movie, or `null` if there is no such movie.
+    """
+    return await _get_movies(batch.parse(ids))
+
+
+@router.post("/movies/batch", tags=["movies"])
+async def post_movies(body: batch.BatchJson):
+    """
+    The same as `GET /movies/batch`, for lists of ids too long for a url:
+    the body is `{"ids": [1, 2, 3]}`.
+    """
+    return await _get_movies(batch.check(body.ids))
+
+
+async def _get_movies(ids):
+    corpus = await memory.get_corpus_async()
+    if corpus is not None:
+        return batch.respond(ids, batch.from_corpus(ids, corpus.get_movie))
+
+    await counters.ensure_async()
+    async with db.async_engine.connect() as conn:
+        movies = (await conn.execute(_movies_query, {"ids": ids})).fetchall()
+        characters = {}
+        for i in await conn.execute(_movies_top_characters_query, {"ids": ids}):
+            characters.setdefault(i.movie_id, []).append(i)
+    return batch.respond(
+        ids,
+        {
+            movie.movie_id: _movie_json(movie, characters.get(movie.movie_id, ()))
+            for movie in movies
+        },
+    )
 
-router = APIRouter()
 
 @router.get("/movies/{movie_id}", tags=["movies"])
-def get_movie(movie_id: int):
+@cache.cached("movie", "movie_id")
+async def get_movie(movie_id: int):
     """
     This endpoint returns a single movie by its identifier. For each movie it returns:
     * `movie_id`: the internal id of the movie.
@@ -23,52 +197,22 @@ def get_movie(movie_id: int):
     * `num_lines`: The number of lines the character has in the movie.
 
     """
-    json = None
-    chars = []
+    corpus = await memory.get_corpus_async()
+    if corpus is not None:
+        json = corpus.get_movie(movie_id)
+        if json is None:
+            raise HTTPException(status_code=404, detail="movie not found.")
+        return json
 
-    with db.engine.connect() as conn:
-        sub_query = (
-            sqlalchemy.select(
-                db.movies.c.movie_id,
-                db.movies.c.title,
-            )
-            .where(db.movies.c.movie_id == movie_id)
-        )
-        sol = conn.execute(sub_query)
+    await counters.ensure_async()
+    async with db.async_engine.connect() as conn:
+        movie = (await conn.execute(_movie_query, {"movie_id": movie_id})).first()
+        res = await conn.execute(_top_characters_query, {"movie_id": movie_id})
+        chars = res.fetchall()
 
-        stmt = (
-        sqlalchemy.select(
-            db.characters.c.character_id, 
-            db.characters.c.name, 
-            func.count(db.lines.c.line_id).label("num_lines"),
-        )
-        .select_from(
-            db.characters.join(db.lines, db.characters.c.character_id == db.lines.c.character_id)
-        )
-        .where(db.characters.c.movie_id == movie_id)
-        .group_by(db.characters.c.character_id, db.characters.c.name)
-        .order_by(sqlalchemy.desc("num_lines"))
-        .limit(5)
-        )
-        res = conn.execute(stmt)
-        for i in res:
-            chars.append(
-                {
-                    "character_id": i.character_id,
-                    "character": i.name,
-                    "num_lines": i.num_lines,
-                }
-            )
-        for i in sol:
-            json = {
-                "movie_id": i.movie_id,
-                "title": i.title,
-                "top_characters": chars,
-            }
-
-    if json is None:
+    if movie is None:
         raise HTTPException(status_code=404, detail="movie not found.")
-    return json
+    return _movie_json(movie, chars)
 
 class movie_sort_options(str, Enum):
     movie_title = "movie_title"
@@ -76,12 +220,67 @@ class movie_sort_options(str, Enum):
     rating = "rating"
 
 
-@router.get("/movies/", tags=["movies"])
-def list_movies(
+class MovieSummaryJson(BaseModel):
+    movie_id: int
+    movie_title: Optional[str]
+    year: Optional[str]
+    imdb_rating: Optional[float]
+    imdb_votes: Optional[int]
+
+
+_movie_orders = {
+    movie_sort_options.movie_title: [(db.movies.c.title, False)],
+    movie_sort_options.year: [(db.movies.c.year, False)],
+    movie_sort_options.rating: [(db.movies.c.imdb_rating, True)],
+}
+
+
+def _movie_order(sort):
+    return _movie_orders[sort] + [(db.movies.c.movie_id, False)]
+
+
+@functools.lru_cache(maxsize=None)
+def _list_movies_query(sort, filtered: bool, after: bool):
+    """
+    The list_movies statement for one sort option, with or without the name
+    filter and a cursor. Each is built once; a request only binds `limit`,
+    `offset`, the name `pattern` and the cursor values.
+    """
+    order = _movie_order(sort)
+    query = (
+        sqlalchemy.select(
+            db.movies.c.movie_id,
+            db.movies.c.title.label("movie_title"),
+            db.movies.c.year,
+            db.movies.c.imdb_rating,
+            db.movies.c.imdb_votes,
+        )
+        .limit(sqlalchemy.bindparam("limit"))
+        .offset(sqlalchemy.bindparam("offset"))
+        .order_by(*pagination.order_by(order))
+    )
+    if filtered:
+        query = query.where(ngrams.contains(db.movies.c.title))
+    if after:
+        query = query.where(pagination.after_template(order))
+    responses.check(query, MovieSummaryJson)
+    return query
+
+
+# The templates without a cursor are built at import rather than by the
+# first request to need them.
+for _sort in movie_sort_options:
+    for _filtered in (False, True):
+        _list_movies_query(_sort, _filtered, False)
+
+
+@router.get("/movies/", tags=["movies"], response_model=List[MovieSummaryJson])
+async def list_movies(
     name: str = "",
     limit: int = Query(50, ge=1, le=250),
     offset: int = Query(0, ge=0),
     sort: movie_sort_options = movie_sort_options.movie_title,
+    cursor: Optional[str] = None,
 ):
     """
     This endpoint returns a list of movies. For each movie it returns:
@@ -104,43 +303,37 @@ def list_movies(
     parameters are used for pagination. The `limit` query parameter specifies the
     maximum number of results to return. The `offset` query parameter specifies the
     number of results to skip before returning results.
-    """
-    json=[]
 
-    order_by_column = {
-        movie_sort_options.movie_title: db.movies.c.title,
-        movie_sort_options.year: db.movies.c.year,
-        movie_sort_options.rating: sqlalchemy.desc(db.movies.c.imdb_rating),
+    For walking the whole list, pass the `X-Next-Cursor` header of a full
+    page back as the `cursor` query parameter to get the page after it. This
+    seeks straight to the next page instead of skipping `offset` rows, and
+    `offset` then counts from the cursor.
+    """
+    cursor_fields = {
+        movie_sort_options.movie_title: ("movie_title", "movie_id"),
+        movie_sort_options.year: ("year", "movie_id"),
+        movie_sort_options.rating: ("imdb_rating", "movie_id"),
     }[sort]
+    after = pagination.parse(cursor, sort, _movie_order(sort))
 
-    query = (
-        sqlalchemy.select(
-            db.movies.c.movie_id,
-            db.movies.c.title,
-            db.movies.c.year,
-            db.movies.c.imdb_rating,
-            db.movies.c.imdb_votes,
-        )
-        .limit(limit)
-        .offset(offset)
-        .order_by(order_by_column, db.movies.c.movie_id)
-    )
-    if name != "":
-        query = query.filter(db.movies.c.title.ilike(f"%{name}%"))
+    corpus = await memory.get_corpus_async()
+    if corpus is not None:
+        json = corpus.list_movies(name, limit, offset, sort, after)
+    else:
+        json = await _list_movies(name, limit, offset, sort, after)
 
-    conn = db.engine.connect()
-    sol = conn.execute(query)
-    for i in sol:
-        json.append(
-            {
-                "movie_id": i.movie_id,
-                "movie_title": i.title,
-                "year": i.year,
-                "imdb_rating": i.imdb_rating,
-                "imdb_votes": i.imdb_votes,
-            }
-        )
+    response = responses.JSONResponse(json)
+    pagination.set_next_cursor(response, sort, json, cursor_fields, limit)
+    return response
 
-    conn.close()
 
-    return json
\ No newline at end of file
+async def _list_movies(name, limit, offset, sort, after) -> List[dict]:
+    params = {"limit": limit, "offset": offset}
+    if name != "":
+        params["pattern"] = ngrams.pattern(name)
+    if after is not None:
+        params.update(pagination.after_params(after))
+    query = _list_movies_query(sort, name != "", after is not None)
+
+    async with db.async_engine.connect() as conn:
+        return responses.rows(await conn.execute(query, params))
\ No newline at end of file
@@ -1,9 +1,14 @@
 from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
 import os
 import pkg_resources
 import sys
+from src import cache
+from src import pool
+from src import database as db
+from src import timing
 
-router = APIRouter()
+router = APIRouter(route_class=timing.TimedRoute)
 
 # This file is purely for debugging purposes. You can ignore.
 
@@ -18,7 +23,7 @@ def calc_container(path):
 
 
 @router.get("/pyversion/")
-def version():
+async def version():
     return sys.version_info
 
 
@@ -44,3 +49,23 @@ def get_pkgsize():
 
     message = sorted(message, key=lambda d: d["size_in_mb"], reverse=True)
     return {"message": message}
+
+
+@router.get("/cache/")
+async def get_cache_stats():
+    return cache.stats()
+
+
+@router.get("/pool/")
+async def get_pool_stats():
+    # vars() so that asking doesn't create the engines.
+    engines = [vars(db).get("engine"), vars(db).get("async_engine")]
+    return pool.stats(*[e.pool for e in engines if e is not None])
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Per-route latency, phase and query count histograms for Prometheus."""
+    return PlainTextResponse(
+        timing.metrics.render(), media_type="text/plain; version=0.0.4"
+    )
@@ -1,5 +1,9 @@
 from fastapi import FastAPI
-from src.api import characters, movies, conversations, pkg_util, lines
+from src.api import characters, movies, conversations, pkg_util, lines, export
+from src.api import graph, stats
+from src import etags
+from src import timing
+from src import responses
 
 description = """
 Movie API returns dialog statistics on top hollywood movies from decades past.
@@ -9,12 +13,14 @@ Movie API returns dialog statistics on top hollywood movies from decades past.
 You can:
 * **list characters with sorting and filtering options.**
 * **retrieve a specific character by id**
+* **autocomplete character names**
 
 ## Movies
 
 You can:
 * **list movies with sorting and filtering options.**
 * **retrieve a specific movie by id**
+* **autocomplete movie titles**
 """
 tags_metadata = [
     {
@@ -32,7 +38,15 @@ tags_metadata = [
     {
         "name": "conversations",
         "description": "Access information on conversations in movies.",
-    }
+    },
+    {
+        "name": "graph",
+        "description": "Analyze who talks with whom.",
+    },
+    {
+        "name": "export",
+        "description": "Download whole tables as NDJSON or CSV.",
+    },
 ]
 
 app = FastAPI(
@@ -44,12 +58,20 @@ app = FastAPI(
         "email": "mtan22@calpoly.edu",
     },
     openapi_tags=tags_metadata,
+    default_response_class=responses.JSONResponse,
 )
+app.add_middleware(etags.ConditionalGetMiddleware)
+# Added last so that it's outermost and its total covers the other middleware.
+app.add_middleware(timing.TimingMiddleware)
 app.include_router(characters.router)
 app.include_router(movies.router)
 app.include_router(pkg_util.router)
 app.include_router(conversations.router)
 app.include_router(lines.router)
+app.include_router(export.router)
+app.include_router(graph.router)
+app.include_router(stats.router)
+
 
 @app.get("/")
 async def root():
@@ -0,0 +1,40 @@
+from fastapi import APIRouter, HTTPException
+
+from src import stats
+from src import timing
+
+router = APIRouter(route_class=timing.TimedRoute)
+
+
+@router.get("/movies/{movie_id}/stats", tags=["movies"])
+async def get_movie_stats(movie_id: int):
+    """
+    This endpoint returns statistics on the dialogue of a movie:
+    * `movie_id`: the internal id of the movie.
+    * `title`: The title of the movie.
+    * `lines` and `words`: The number of lines and of words spoken.
+    * `lines_per_character`: How many lines each speaking character has, as
+      `count` (characters), `mean`, `median`, `p90` and `max`.
+    * `gender_share`: For each gender of speaker (`F`, `M` or `unknown`),
+      their share of the `lines` and of the `words`, from 0 to 1.
+    * `conversation_length`: The number of lines of each conversation, with
+      the same summary plus a `histogram` of conversations per length.
+    * `words_per_line`: The number of words of each line, summarized the same
+      way.
+    """
+    columns = await stats.get_columns_async()
+    json = columns.movie_stats(movie_id)
+    if json is None:
+        raise HTTPException(status_code=404, detail="movie not found.")
+    return json
+
+
+@router.get("/stats", tags=["movies"])
+async def get_stats():
+    """
+    This endpoint returns the statistics of `/movies/{movie_id}/stats` for
+    the dialogue of every movie together, with `movies`, the number of
+    movies, in place of the movie's id and title.
+    """
+    columns = await stats.get_columns_async()
+    return columns.corpus_stats()
@@ -0,0 +1,53 @@
+"""
+Shared parts of the batch lookup endpoints.
+
+``/movies/batch``, ``/characters/batch`` and ``/lines/batch`` resolve many
+ids at once, either from ``?ids=1,2,3`` or, for longer lists, from a POSTed
+``{"ids": [1, 2, 3]}``. Each answers with one ``IN`` query per table instead
+of one request per id, and returns an object keyed by id whose values have
+the same shape as the matching detail endpoint, or ``null`` for ids that
+don't exist.
+"""
+from typing import Callable, Dict, List, Optional
+
+from fastapi import HTTPException
+from pydantic import BaseModel
+
+from src import responses
+
+# The most ids one request may ask for.
+LIMIT = 250
+
+
+class BatchJson(BaseModel):
+    ids: List[int]
+
+
+def parse(ids: str) -> List[int]:
+    """The ids of an ``ids`` query parameter, deduplicated and in order."""
+    try:
+        parsed = [int(id) for id in ids.split(",") if id.strip()]
+    except ValueError:
+        raise HTTPException(
+            status_code=400, detail="ids must be comma-separated integers."
+        )
+    return check(parsed)
+
+
+def check(ids: List[int]) -> List[int]:
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > LIMIT:
+        raise HTTPException(
+            status_code=400, detail=f"at most {LIMIT} ids can be looked up at once."
+        )
+    return ids
+
+
+def respond(ids: List[int], found: Dict[int, dict]) -> responses.JSONResponse:
+    return responses.JSONResponse({str(id): found.get(id) for id in ids})
+
+
+def from_corpus(
+    ids: List[int], get: Callable[[int], Optional[dict]]
+) -> Dict[int, dict]:
+    return {id: json for id in ids if (json := get(id)) is not None}
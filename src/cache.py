@@ -0,0 +1,269 @@
+"""
+Response cache for the single-item read endpoints.
+
+``get_movie``, ``get_character``, ``get_line`` and ``get_conversation`` only
+depend on what's in the database, and traffic piles up on a few popular ids,
+so their responses are cached by id. Entries expire after a TTL and the
+in-process backend also evicts the least recently used entry once it holds
+``RESPONSE_CACHE_SIZE`` of them. Writes don't wait for the TTL: the movies,
+characters, conversations and lines a new conversation touches are
+invalidated by ``versions.refresh``, in the worker that wrote it right after
+the commit and in every other one before it serves its next read.
+
+Configuration comes from the environment:
+
+* ``RESPONSE_CACHE_SIZE``: entries kept per worker (default 1024, 0 disables
+  caching).
+* ``RESPONSE_CACHE_TTL``: seconds an entry stays fresh (default 300).
+* ``RESPONSE_CACHE_URL``: a ``redis://`` url to share one cache between all
+  workers instead. Needs the ``redis`` package. Without it each worker has its
+  own cache.
+
+A shared cache keeps each response under the ``src.versions`` data version it
+was computed at rather than relying on invalidation: a worker that read the
+old data could otherwise store it after the writer had deleted the key. Once
+a worker has caught up with a write it reads entries of the new version,
+which makes every shared entry a miss after a write; the old ones expire.
+
+Only successful responses are cached; 404s are computed every time.
+"""
+import asyncio
+import functools
+import json
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Iterable, Optional
+
+SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "1024"))
+TTL = float(os.environ.get("RESPONSE_CACHE_TTL", "300"))
+URL = os.environ.get("RESPONSE_CACHE_URL")
+
+
+class LocalCache:
+    """A thread-safe LRU cache whose entries also expire after ``ttl`` seconds."""
+
+    shared = False
+
+    def __init__(self, size: int = SIZE, ttl: float = TTL, clock=time.monotonic):
+        self.size = size
+        self.ttl = ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= self.clock():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any):
+        with self.lock:
+            self.entries[key] = (self.clock() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, keys: Iterable[str]):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class RedisCache:
+    """Keeps responses in Redis, as JSON, so every worker shares them."""
+
+    prefix = "movie-api:"
+    shared = True
+
+    def __init__(self, url: str, ttl: float = TTL):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError(
+                "RESPONSE_CACHE_URL needs the redis package: pip install redis"
+            ) from e
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self.client.get(self.prefix + key)
+        return None if value is None else json.loads(value)
+
+    def set(self, key: str, value: Any):
+        self.client.set(self.prefix + key, json.dumps(value), px=int(self.ttl * 1000))
+
+    def delete(self, keys: Iterable[str]):
+        keys = [self.prefix + key for key in keys]
+        if keys:
+            self.client.delete(*keys)
+
+    def clear(self):
+        keys = list(self.client.scan_iter(self.prefix + "*"))
+        if keys:
+            self.client.delete(*keys)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+hits: Counter = Counter()
+misses: Counter = Counter()
+invalidations: Counter = Counter()
+
+# Bumped by every invalidation. A response computed while it changed may
+# predate the write, so it isn't stored. This only covers this worker's own
+# cache; a shared one is keyed by data version instead.
+_generation = 0
+
+
+def enabled() -> bool:
+    return _backend is not None or URL is not None or SIZE > 0
+
+
+def backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = RedisCache(URL) if URL else LocalCache()
+    return _backend
+
+
+def set_backend(cache):
+    """Swaps in another backend, e.g. a shared one, and resets the counters."""
+    global _backend
+    _backend = cache
+    hits.clear()
+    misses.clear()
+    invalidations.clear()
+
+
+def key(namespace: str, id) -> str:
+    return f"{namespace}:{id}"
+
+
+def versioned(k: str, epoch: str, version: int) -> str:
+    """The key of ``k`` in a shared cache, at data version ``version``."""
+    return f"{epoch}.{version}:{k}"
+
+
+def cached(namespace: str, param: str):
+    """
+    Caches a route's response under ``namespace`` and the value of its
+    ``param`` argument. Goes below the ``@router.get`` decorator; FastAPI
+    still sees the signature of the wrapped function, sync or async.
+    """
+
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not enabled():
+                    return await func(*args, **kwargs)
+                k = key(namespace, kwargs[param])
+                cache = backend()
+                if cache.shared:
+                    from src import versions
+
+                    k = versioned(k, *await versions.latest_async())
+                value = await call(cache.get, k)
+                if value is not None:
+                    hits[namespace] += 1
+                    return value
+                misses[namespace] += 1
+                generation = _generation
+                value = await func(*args, **kwargs)
+                if generation == _generation:
+                    await call(cache.set, k, value)
+                return value
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled():
+                return func(*args, **kwargs)
+            k = key(namespace, kwargs[param])
+            cache = backend()
+            if cache.shared:
+                from src import versions
+
+                k = versioned(k, *versions.latest())
+            value = cache.get(k)
+            if value is not None:
+                hits[namespace] += 1
+                return value
+            misses[namespace] += 1
+            generation = _generation
+            value = func(*args, **kwargs)
+            if generation == _generation:
+                cache.set(k, value)
+            return value
+
+        return wrapper
+
+    return decorator
+
+
+async def call(method, *args):
+    """
+    Calls a backend method from async code. Only the in-process cache is
+    called directly; anything that may do I/O runs in a thread.
+    """
+    if isinstance(getattr(method, "__self__", None), LocalCache):
+        return method(*args)
+    return await asyncio.to_thread(method, *args)
+
+
+def invalidate(namespace: str, ids: Iterable):
+    global _generation
+    keys = {key(namespace, id) for id in ids}
+    if not keys:
+        return
+    _generation += 1
+    invalidations[namespace] += len(keys)
+    if enabled() and not backend().shared:
+        backend().delete(keys)
+
+
+def stats() -> Dict[str, Any]:
+    """Hit and miss counts per route since this worker started."""
+    namespaces = sorted(set(hits) | set(misses) | set(invalidations))
+    cache = backend() if enabled() else None
+    json = {
+        "backend": type(cache).__name__ if cache is not None else None,
+        "routes": {
+            ns: {
+                "hits": hits[ns],
+                "misses": misses[ns],
+                "hit_rate": hits[ns] / (hits[ns] + misses[ns])
+                if hits[ns] + misses[ns]
+                else 0.0,
+                "invalidations": invalidations[ns],
+            }
+            for ns in namespaces
+        },
+    }
+    if isinstance(cache, LocalCache):
+        json["entries"] = len(cache)
+        json["evictions"] = cache.evictions
+    return json
@@ -0,0 +1,163 @@
+"""
+Materialized per-character and per-conversation line counts.
+
+``character_line_counts`` and ``conversation_line_counts`` hold the same
+aggregates the old CSV loader kept in ``Character.num_lines`` and
+``Conversation.num_lines``. ``character_pair_lines`` holds, for each pair of
+characters who share a conversation, the number of lines in their
+conversations, once under each character. They are backfilled from ``lines``
+by the loader or the first time they are needed, and then kept up to date by
+``add_conversation``, so the read endpoints never have to ``GROUP BY`` the
+lines table.
+"""
+import asyncio
+import threading
+from collections import Counter
+from typing import Iterable, Tuple
+
+import sqlalchemy
+
+from src import database as db
+
+_ready = False
+_ready_lock = threading.Lock()
+
+
+def _backfill(conn, table, key):
+    # A line without a character or conversation counts towards neither.
+    counts = (
+        sqlalchemy.select(key, sqlalchemy.func.count())
+        .where(key.is_not(None))
+        .group_by(key)
+    )
+    conn.execute(
+        db.upsert(conn, table)
+        .from_select([table.c[key.name], table.c.num_lines], counts)
+        .on_conflict_do_nothing()
+    )
+
+
+def _backfill_pairs(conn):
+    convos = db.conversations
+    table = db.character_pair_lines
+    # Each conversation counts towards both (c1, c2) and (c2, c1).
+    sides = sqlalchemy.union_all(
+        sqlalchemy.select(
+            convos.c.conversation_id,
+            convos.c.character1_id.label("character_id"),
+            convos.c.character2_id.label("other_id"),
+        ),
+        sqlalchemy.select(
+            convos.c.conversation_id,
+            convos.c.character2_id.label("character_id"),
+            convos.c.character1_id.label("other_id"),
+        ),
+    ).subquery()
+    counts = (
+        sqlalchemy.select(
+            sides.c.character_id, sides.c.other_id, sqlalchemy.func.count()
+        )
+        .select_from(
+            sides.join(db.lines, db.lines.c.conversation_id == sides.c.conversation_id)
+        )
+        .where(sides.c.character_id != sides.c.other_id)
+        .group_by(sides.c.character_id, sides.c.other_id)
+    )
+    conn.execute(
+        db.upsert(conn, table)
+        .from_select(
+            [table.c.character_id, table.c.other_id, table.c.num_lines], counts
+        )
+        .on_conflict_do_nothing()
+    )
+
+
+tables = [
+    db.character_line_counts,
+    db.conversation_line_counts,
+    db.character_pair_lines,
+]
+
+
+def backfill(conn):
+    """Creates the count tables and fills any that are empty from ``lines``."""
+    db.metadata_obj.create_all(conn, tables=tables)
+    backfills = {
+        db.character_line_counts: lambda: _backfill(
+            conn, db.character_line_counts, db.lines.c.character_id
+        ),
+        db.conversation_line_counts: lambda: _backfill(
+            conn, db.conversation_line_counts, db.lines.c.conversation_id
+        ),
+        db.character_pair_lines: lambda: _backfill_pairs(conn),
+    }
+    for table, fill in backfills.items():
+        if conn.execute(sqlalchemy.select(table).limit(1)).first() is None:
+            fill()
+
+
+def ensure():
+    """Creates and backfills the count tables once per process."""
+    global _ready
+    if _ready:
+        return
+    with _ready_lock:
+        if _ready:
+            return
+        with db.engine.begin() as conn:
+            backfill(conn)
+        _ready = True
+
+
+async def ensure_async():
+    """``ensure`` for async handlers, off the event loop the one time it works."""
+    if not _ready:
+        await asyncio.to_thread(ensure)
+
+
+def _increment(conn, table, keys: Tuple[str, ...], counts: Counter):
+    if not counts:
+        return
+    stmt = db.upsert(conn, table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c[key] for key in keys],
+        set_={"num_lines": table.c.num_lines + stmt.excluded.num_lines},
+    )
+    conn.execute(
+        stmt,
+        [dict(zip(keys, k), num_lines=n) for k, n in counts.items()],
+    )
+
+
+def record_lines(conn, lines: Iterable[dict], conversations: Iterable[dict]):
+    """
+    Adds freshly inserted ``lines`` rows, and the ``conversations`` rows they
+    belong to, to the counts. Runs on the caller's connection so the counts
+    commit or roll back with the lines themselves; ``ensure`` must have been
+    called before that transaction began.
+    """
+    lines = list(lines)
+    pairs = {
+        c["conversation_id"]: (c["character1_id"], c["character2_id"])
+        for c in conversations
+        if c["character1_id"] != c["character2_id"]
+    }
+    pair_counts = Counter()
+    for line in lines:
+        pair = pairs.get(line["conversation_id"])
+        if pair is not None:
+            pair_counts[pair] += 1
+            pair_counts[pair[::-1]] += 1
+    _increment(
+        conn,
+        db.character_line_counts,
+        ("character_id",),
+        Counter((line["character_id"],) for line in lines),
+    )
+    _increment(
+        conn,
+        db.conversation_line_counts,
+        ("conversation_id",),
+        Counter((line["conversation_id"],) for line in lines),
+    )
+    _increment(conn, db.character_pair_lines, ("character_id", "other_id"), pair_counts)
@@ -2,13 +2,24 @@ import csv
 from src.datatypes import Character, Movie, Conversation, Line
 import os
 import io
+import threading
 from supabase import Client, create_client
 import dotenv
 from sqlalchemy import create_engine
 import sqlalchemy
+import sqlalchemy.dialects.postgresql
+import sqlalchemy.dialects.sqlite
+from sqlalchemy.ext.asyncio import create_async_engine
+from src import pool
+
 
 def database_connection_url():
     dotenv.load_dotenv()
+    # Overrides the Postgres settings, e.g. sqlite:///movies.db for a local
+    # stand-in built with ``python -m src.loader load --sqlite movies.db``.
+    url = os.environ.get("DATABASE_URL")
+    if url:
+        return url
     DB_USER: str = os.environ.get("POSTGRES_USER")
     DB_PASSWD = os.environ.get("POSTGRES_PASSWORD")
     DB_SERVER: str = os.environ.get("POSTGRES_SERVER")
@@ -16,19 +27,212 @@ def database_connection_url():
     DB_NAME: str = os.environ.get("POSTGRES_DB")
     return f"postgresql://{DB_USER}:{DB_PASSWD}@{DB_SERVER}:{DB_PORT}/{DB_NAME}"
 
-engine = sqlalchemy.create_engine(database_connection_url())
-
-conn = engine.connect()
 
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """Creates the engine on first use. Connections are only opened later."""
+    if "engine" not in globals():
+        with _engine_lock:
+            if "engine" not in globals():
+                globals()["engine"] = sqlalchemy.create_engine(
+                    database_connection_url(), **pool.engine_options()
+                )
+    return globals()["engine"]
+
+
+def async_database_url() -> sqlalchemy.engine.URL:
+    """The database url with the driver swapped for its asyncio counterpart."""
+    url = sqlalchemy.engine.make_url(database_connection_url())
+    driver = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}.get(
+        url.get_backend_name()
+    )
+    if driver is None:
+        return url
+    url = url.set(drivername=f"{url.get_backend_name()}+{driver}")
+    if driver == "asyncpg":
+        # asyncpg prepares every statement on the server and keeps up to this
+        # many per connection, so a repeated query skips parsing and planning.
+        # PgBouncer in transaction mode can't keep prepared statements.
+        size = os.environ.get("DB_STATEMENT_CACHE_SIZE", "500")
+        if os.environ.get("DB_POOL", "").lower() == "null":
+            size = "0"
+        url = url.update_query_dict({"prepared_statement_cache_size": size})
+    return url
+
+
+def get_async_engine():
+    """
+    The engine the request handlers use. The sync engine stays for one-off
+    work: backfills, index builds, id reservation and the bulk loader.
+    """
+    if "async_engine" not in globals():
+        with _engine_lock:
+            if "async_engine" not in globals():
+                globals()["async_engine"] = create_async_engine(
+                    async_database_url(), **pool.engine_options(asyncio=True)
+                )
+    return globals()["async_engine"]
+
+
+def __getattr__(name):
+    # ``db.engine`` and ``db.async_engine`` are resolved here the first time
+    # they're used, so importing the app neither needs nor touches a
+    # database. After that they're ordinary module attributes.
+    if name == "engine":
+        return get_engine()
+    if name == "async_engine":
+        return get_async_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# The tables are declared rather than reflected so that startup doesn't pay
+# for catalog round trips. They match the schema src.loader creates.
 metadata_obj = sqlalchemy.MetaData()
 
-conversations = sqlalchemy.Table("conversations", metadata_obj, autoload_with=engine)
-
-lines = sqlalchemy.Table("lines", metadata_obj, autoload_with=engine)
-
-movies = sqlalchemy.Table("movies", metadata_obj, autoload_with=engine)
+movies = sqlalchemy.Table(
+    "movies",
+    metadata_obj,
+    sqlalchemy.Column("movie_id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("title", sqlalchemy.Text),
+    sqlalchemy.Column("year", sqlalchemy.Text),
+    sqlalchemy.Column("imdb_rating", sqlalchemy.Float),
+    sqlalchemy.Column("imdb_votes", sqlalchemy.Integer),
+    sqlalchemy.Column("raw_script_url", sqlalchemy.Text),
+)
+
+characters = sqlalchemy.Table(
+    "characters",
+    metadata_obj,
+    sqlalchemy.Column("character_id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("name", sqlalchemy.Text),
+    sqlalchemy.Column("movie_id", sqlalchemy.Integer, index=True),
+    sqlalchemy.Column("gender", sqlalchemy.Text),
+    sqlalchemy.Column("age", sqlalchemy.Integer),
+)
+
+conversations = sqlalchemy.Table(
+    "conversations",
+    metadata_obj,
+    sqlalchemy.Column("conversation_id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("character1_id", sqlalchemy.Integer, index=True),
+    sqlalchemy.Column("character2_id", sqlalchemy.Integer, index=True),
+    sqlalchemy.Column("movie_id", sqlalchemy.Integer, index=True),
+)
+
+lines = sqlalchemy.Table(
+    "lines",
+    metadata_obj,
+    sqlalchemy.Column("line_id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("character_id", sqlalchemy.Integer, index=True),
+    sqlalchemy.Column("movie_id", sqlalchemy.Integer, index=True),
+    sqlalchemy.Column("conversation_id", sqlalchemy.Integer, index=True),
+    sqlalchemy.Column("line_sort", sqlalchemy.Integer),
+    sqlalchemy.Column("line_text", sqlalchemy.Text),
+)
+
+# Materialized line counts, maintained by src.counters so that sorting by
+# number of lines doesn't have to aggregate the whole lines table.
+character_line_counts = sqlalchemy.Table(
+    "character_line_counts",
+    metadata_obj,
+    sqlalchemy.Column("character_id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("num_lines", sqlalchemy.Integer, nullable=False, index=True),
+)
+
+conversation_line_counts = sqlalchemy.Table(
+    "conversation_line_counts",
+    metadata_obj,
+    sqlalchemy.Column("conversation_id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("num_lines", sqlalchemy.Integer, nullable=False),
+)
+
+# Lines two characters share, stored under each of them, so that a
+# character's top conversations are an index range scan. See src.counters.
+character_pair_lines = sqlalchemy.Table(
+    "character_pair_lines",
+    metadata_obj,
+    sqlalchemy.Column("character_id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("other_id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("num_lines", sqlalchemy.Integer, nullable=False),
+)
+
+# The next unreserved id of each table, handed out in blocks by src.ids.
+id_allocations = sqlalchemy.Table(
+    "id_allocations",
+    metadata_obj,
+    sqlalchemy.Column("name", sqlalchemy.Text, primary_key=True),
+    sqlalchemy.Column("next_id", sqlalchemy.BigInteger, nullable=False),
+)
+
+# The data version shared by every worker, bumped by each transaction that
+# adds conversations, and the version each conversation was added at. See
+# src.versions.
+data_versions = sqlalchemy.Table(
+    "data_versions",
+    metadata_obj,
+    sqlalchemy.Column("name", sqlalchemy.Text, primary_key=True),
+    sqlalchemy.Column("epoch", sqlalchemy.Text, nullable=False),
+    sqlalchemy.Column("version", sqlalchemy.BigInteger, nullable=False),
+)
+
+conversation_versions = sqlalchemy.Table(
+    "conversation_versions",
+    metadata_obj,
+    sqlalchemy.Column("version", sqlalchemy.BigInteger, primary_key=True),
+    sqlalchemy.Column("conversation_id", sqlalchemy.Integer, primary_key=True),
+)
+
+
+def _key(column, descending=False):
+    # The sort key of src.pagination.sort_key, which an index must repeat
+    # exactly for a query to use it.
+    zero = "''" if column.type.python_type is str else "0"
+    key = sqlalchemy.func.coalesce(column, sqlalchemy.literal_column(zero))
+    return -key if descending else key
+
+
+# Serve the list endpoints' sorts and their cursor pagination.
+sqlalchemy.Index("ix_movies_title_key", _key(movies.c.title), movies.c.movie_id)
+sqlalchemy.Index("ix_movies_year_key", _key(movies.c.year), movies.c.movie_id)
+sqlalchemy.Index(
+    "ix_movies_rating_key", _key(movies.c.imdb_rating, True), movies.c.movie_id
+)
+sqlalchemy.Index(
+    "ix_characters_name_key", _key(characters.c.name), characters.c.character_id
+)
+sqlalchemy.Index(
+    "ix_character_line_counts_key",
+    -character_line_counts.c.num_lines,
+    character_line_counts.c.character_id,
+)
+sqlalchemy.Index("ix_lines_line_text_key", _key(lines.c.line_text), lines.c.line_id)
+
+# Serve the ``name`` filters' ILIKE '%...%' on Postgres (see src.ngrams).
+# SQLite has no trigram index, so there the filters scan.
+sqlalchemy.event.listen(
+    metadata_obj,
+    "before_create",
+    sqlalchemy.DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(
+        dialect="postgresql"
+    ),
+)
+for _table, _column in ((movies, "title"), (characters, "name")):
+    sqlalchemy.Index(
+        f"ix_{_table.name}_{_column}_trgm",
+        _table.c[_column],
+        postgresql_using="gin",
+        postgresql_ops={_column: "gin_trgm_ops"},
+    ).ddl_if(dialect="postgresql")
+
+
+def upsert(conn, table):
+    """An INSERT supporting ``on_conflict_do_*`` for the connection's dialect."""
+    if conn.dialect.name == "sqlite":
+        return sqlalchemy.dialects.sqlite.insert(table)
+    return sqlalchemy.dialects.postgresql.insert(table)
 
-characters = sqlalchemy.Table("characters", metadata_obj, autoload_with=engine)
 
 # # TODO: Below is purely an example of reading and then writing a csv from supabase.
 # # You should delete this code for your working example.
@@ -123,7 +327,7 @@ characters = sqlalchemy.Table("characters", metadata_obj, autoload_with=engine)
 # def upload_new_lines():
 #     output = io.StringIO()
 #     csv_writer = csv.DictWriter(
-#         output, fieldnames=["line_id", "character_id", "movie_id", 
+#         output, fieldnames=["line_id", "character_id", "movie_id",
 #         "conversation_id", "line_sort", "line_text"]
 #     )
 #     csv_writer.writeheader()
@@ -1,8 +1,16 @@
+"""
+Records of the in-memory corpus.
+
+The corpus holds one of these per row, so they declare ``__slots__``: an
+instance then has no ``__dict__`` and is only its object header and one
+pointer per field.
+"""
 from dataclasses import dataclass
 
 
 @dataclass
 class Character:
+    __slots__ = ("id", "name", "movie_id", "gender", "age", "num_lines")
     id: int
     name: str
     movie_id: int
@@ -13,6 +21,7 @@ class Character:
 
 @dataclass
 class Movie:
+    __slots__ = ("id", "title", "year", "imdb_rating", "imdb_votes", "raw_script_url")
     id: int
     title: str
     year: int
@@ -23,6 +32,7 @@ class Movie:
 
 @dataclass
 class Conversation:
+    __slots__ = ("id", "c1_id", "c2_id", "movie_id", "num_lines")
     id: int
     c1_id: int
     c2_id: int
@@ -32,6 +42,7 @@ class Conversation:
 
 @dataclass
 class Line:
+    __slots__ = ("id", "c_id", "movie_id", "conv_id", "line_sort", "line_text")
     id: int
     c_id: int
     movie_id: int
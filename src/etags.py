@@ -0,0 +1,84 @@
+"""
+Conditional GETs for the read endpoints.
+
+Every response depends only on the data, so the data version of
+``src.versions``, which every worker shares and each transaction adding
+conversations bumps, is enough to tag them. ``ConditionalGetMiddleware``
+sends that version as a strong ``ETag`` with every successful GET under
+``/movies``, ``/characters``, ``/lines``, ``/conversations`` and ``/stats``. A
+request whose ``If-None-Match`` carries the current version gets a ``304``
+before routing, so nothing is queried and nothing is serialized.
+
+The version comes from ``versions.latest_async``, which a background thread
+keeps up to date, so tagging a response costs no query. By the time a
+version is handed out the worker's cache and in-process data have caught up
+with it, so a tag never runs ahead of the data it's sent with. Another
+worker's write shows up within ``DATA_VERSION_POLL_INTERVAL``.
+
+``Cache-Control`` (``HTTP_CACHE_CONTROL``, by default ``public, max-age=0,
+must-revalidate``) lets a CDN such as Vercel's edge keep the responses but
+makes it revalidate each time, which the ETag turns into a cheap 304.
+"""
+import os
+
+from src import versions
+
+CACHE_CONTROL = os.environ.get(
+    "HTTP_CACHE_CONTROL", "public, max-age=0, must-revalidate"
+)
+
+PREFIXES = ("/movies/", "/characters/", "/lines/", "/conversations/", "/stats")
+
+
+def version(epoch: str, number: int) -> str:
+    return f"{epoch}.{number}"
+
+
+def etag(version: str) -> str:
+    return f'"{version}"'
+
+
+def matches(if_none_match: str, tag: str) -> bool:
+    """Weak comparison, which RFC 9110 prescribes for If-None-Match."""
+    if if_none_match.strip() == "*":
+        return True
+    return any(
+        candidate.strip().removeprefix("W/") == tag
+        for candidate in if_none_match.split(",")
+    )
+
+
+class ConditionalGetMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(PREFIXES):
+            await self.app(scope, receive, send)
+            return
+        # Read before the handler runs: if a write lands in between, the
+        # response is tagged with the older version and simply revalidates.
+        # The batch POSTs are reads too, so every method catches up.
+        tag = etag(version(*await versions.latest_async()))
+        if scope["method"] != "GET":
+            await self.app(scope, receive, send)
+            return
+
+        headers = [
+            (b"etag", tag.encode()),
+            (b"cache-control", CACHE_CONTROL.encode()),
+        ]
+        for name, value in scope["headers"]:
+            if name == b"if-none-match" and matches(value.decode("latin-1"), tag):
+                await send(
+                    {"type": "http.response.start", "status": 304, "headers": headers}
+                )
+                await send({"type": "http.response.body", "body": b""})
+                return
+
+        async def send_tagged(message):
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                message = dict(message, headers=list(message["headers"]) + headers)
+            await send(message)
+
+        await self.app(scope, receive, send_tagged)
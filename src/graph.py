@@ -0,0 +1,295 @@
+"""
+The character interaction graph.
+
+Characters are nodes and two characters are joined by an edge weighted with
+the number of conversations they have had. The graph is kept in process in
+compressed sparse row form: the neighbours of node ``u`` are
+``targets[offsets[u]:offsets[u + 1]]``, with their conversation counts in
+``weights`` at the same positions. It is built the first time it's needed,
+from the in-memory corpus or from one pass over ``characters`` and one
+grouped pass over ``conversations``, like the indexes of ``src.search``.
+
+Conversations added after the build, in any worker, go into a small overlay
+of extra edge weights instead of rebuilding the arrays; ``src.versions``
+applies them.
+
+Characters only ever talk within their own movie, so rankings and
+communities are computed on one movie's subgraph, which is at most a few
+dozen nodes, and a path search never leaves the movie it starts in.
+"""
+import asyncio
+import threading
+from array import array
+from collections import Counter, defaultdict, deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Rounds of label propagation before giving up on convergence.
+MAX_ROUNDS = 20
+
+
+class Graph:
+    def __init__(
+        self,
+        characters: Iterable[Tuple[int, Optional[str], Optional[int]]],
+        edges: Iterable[Tuple[int, int, int]],
+    ):
+        """
+        ``characters`` are ``(character_id, name, movie_id)`` and ``edges``
+        ``(character1_id, character2_id, conversations)``, in either
+        direction and possibly repeated.
+        """
+        self.lock = threading.Lock()
+        self.ids = array("q")
+        self.names: List[Optional[str]] = []
+        self.node: Dict[int, int] = {}
+        self.by_movie: Dict[Optional[int], List[int]] = defaultdict(list)
+        for id, name, movie_id in sorted(characters, key=lambda c: c[0]):
+            self._add_node(id, name, movie_id)
+
+        pairs: Counter = Counter()
+        for a, b, count in edges:
+            if a != b and a in self.node and b in self.node:
+                pairs[(min(a, b), max(a, b))] += count
+
+        n = len(self.ids)
+        degree = [0] * n
+        for a, b in pairs:
+            degree[self.node[a]] += 1
+            degree[self.node[b]] += 1
+        self.offsets = array("q", [0]) * (n + 1)
+        for u in range(n):
+            self.offsets[u + 1] = self.offsets[u] + degree[u]
+        self.targets = array("i", [0]) * self.offsets[n]
+        self.weights = array("i", [0]) * self.offsets[n]
+        fill = list(self.offsets[:n])
+        for (a, b), count in sorted(pairs.items()):
+            u, v = self.node[a], self.node[b]
+            for x, y in ((u, v), (v, u)):
+                self.targets[fill[x]] = y
+                self.weights[fill[x]] = count
+                fill[x] += 1
+
+        # Conversations added since the build, by node and neighbour.
+        self.extra: Dict[int, Counter] = defaultdict(Counter)
+        # The data version the graph reflects; see src.versions.
+        self.version = 0
+
+    def _add_node(self, id: int, name: Optional[str], movie_id: Optional[int]) -> int:
+        u = len(self.ids)
+        self.ids.append(id)
+        self.names.append(name)
+        self.node[id] = u
+        self.by_movie[movie_id].append(u)
+        return u
+
+    def add_conversation(self, a: int, b: int):
+        """Records one more conversation between characters ``a`` and ``b``."""
+        with self.lock:
+            if a == b or a not in self.node or b not in self.node:
+                return
+            u, v = self.node[a], self.node[b]
+            self.extra[u][v] += 1
+            self.extra[v][u] += 1
+
+    def apply(self, conversation_rows: List[dict], line_rows: List[dict]):
+        """Adds the rows ``versions.changes`` returns."""
+        for row in conversation_rows:
+            self.add_conversation(row["character1_id"], row["character2_id"])
+
+    def adjacent(self, u: int) -> Dict[int, int]:
+        """The neighbours of node ``u`` and the conversations with each."""
+        if u + 1 < len(self.offsets):
+            start, end = self.offsets[u], self.offsets[u + 1]
+            neighbours = dict(zip(self.targets[start:end], self.weights[start:end]))
+        else:
+            neighbours = {}
+        extra = self.extra.get(u)
+        if extra:
+            for v, count in list(extra.items()):
+                neighbours[v] = neighbours.get(v, 0) + count
+        return neighbours
+
+    def character(self, u: int) -> dict:
+        return {"character_id": self.ids[u], "character": self.names[u]}
+
+    def _subgraph(self, movie_id: int) -> Dict[int, Dict[int, int]]:
+        return {u: self.adjacent(u) for u in self.by_movie.get(movie_id, ())}
+
+    def centrality(self, movie_id: int) -> List[dict]:
+        """
+        Every character of the movie with their number of conversation
+        partners (``degree``), of conversations, and normalized betweenness
+        centrality: the share of shortest paths between other characters of
+        the movie that go through them.
+        """
+        adjacency = self._subgraph(movie_id)
+        betweenness = _betweenness(adjacency)
+        return [
+            dict(
+                self.character(u),
+                degree=len(neighbours),
+                conversations=sum(neighbours.values()),
+                betweenness=betweenness[u],
+            )
+            for u, neighbours in adjacency.items()
+        ]
+
+    def shortest_path(self, a: int, b: int) -> Optional[List[dict]]:
+        """
+        The characters on a path from ``a`` to ``b`` with the fewest hops,
+        both included, preferring lower ids among equally short paths. None if
+        they never interact, even indirectly.
+        """
+        source, target = self.node[a], self.node[b]
+        previous = {source: None}
+        queue = deque([source])
+        while queue and target not in previous:
+            u = queue.popleft()
+            for v in sorted(self.adjacent(u)):
+                if v not in previous:
+                    previous[v] = u
+                    queue.append(v)
+        if target not in previous:
+            return None
+        path = []
+        u = target
+        while u is not None:
+            path.append(self.character(u))
+            u = previous[u]
+        return path[::-1]
+
+    def communities(self, movie_id: int) -> List[List[dict]]:
+        """
+        Groups of characters of the movie that mostly talk among themselves,
+        found by weighted label propagation: each character repeatedly joins
+        the group it has the most conversations with. Characters without any
+        conversation are left out. Largest groups first.
+        """
+        adjacency = {u: n for u, n in self._subgraph(movie_id).items() if n}
+        label = {u: u for u in adjacency}
+        for _ in range(MAX_ROUNDS):
+            changed = False
+            for u in sorted(adjacency):
+                totals: Counter = Counter()
+                for v, count in adjacency[u].items():
+                    if v in label:
+                        totals[label[v]] += count
+                best = min(
+                    totals, key=lambda candidate: (-totals[candidate], candidate)
+                )
+                if best != label[u]:
+                    label[u] = best
+                    changed = True
+            if not changed:
+                break
+
+        groups: Dict[int, List[int]] = defaultdict(list)
+        for u in sorted(adjacency):
+            groups[label[u]].append(u)
+        ordered = sorted(groups.values(), key=lambda g: (-len(g), self.ids[g[0]]))
+        return [[self.character(u) for u in group] for group in ordered]
+
+
+def _betweenness(adjacency: Dict[int, Dict[int, int]]) -> Dict[int, float]:
+    """Brandes' algorithm on an unweighted, undirected graph, normalized."""
+    centrality = dict.fromkeys(adjacency, 0.0)
+    for s in adjacency:
+        stack = []
+        predecessors: Dict[int, List[int]] = defaultdict(list)
+        paths = dict.fromkeys(adjacency, 0)
+        paths[s] = 1
+        distance = {s: 0}
+        queue = deque([s])
+        while queue:
+            v = queue.popleft()
+            stack.append(v)
+            for w in adjacency[v]:
+                if w not in adjacency:
+                    continue
+                if w not in distance:
+                    distance[w] = distance[v] + 1
+                    queue.append(w)
+                if distance[w] == distance[v] + 1:
+                    paths[w] += paths[v]
+                    predecessors[w].append(v)
+        dependency = dict.fromkeys(adjacency, 0.0)
+        while stack:
+            w = stack.pop()
+            for v in predecessors[w]:
+                dependency[v] += paths[v] / paths[w] * (1 + dependency[w])
+            if w != s:
+                centrality[w] += dependency[w]
+    n = len(adjacency)
+    # Each pair was counted from both ends.
+    scale = 1 / ((n - 1) * (n - 2)) if n > 2 else 0.0
+    return {u: c * scale for u, c in centrality.items()}
+
+
+def build_graph() -> Graph:
+    from src import memory
+    from src import versions
+
+    corpus = memory.get_corpus()
+    if corpus is not None:
+        version, graph = versions.build_from(
+            corpus,
+            lambda: Graph(
+                ((c.id, c.name, c.movie_id) for c in corpus.characters.values()),
+                ((c.c1_id, c.c2_id, 1) for c in corpus.conversations.values()),
+            ),
+        )
+        graph.version = version
+        return graph
+
+    import sqlalchemy
+    from src import database as db
+
+    conversations = db.conversations.c
+
+    def load():
+        with db.engine.connect() as conn:
+            characters = conn.execute(
+                sqlalchemy.select(
+                    db.characters.c.character_id,
+                    db.characters.c.name,
+                    db.characters.c.movie_id,
+                )
+            ).all()
+            edges = conn.execute(
+                sqlalchemy.select(
+                    conversations.character1_id,
+                    conversations.character2_id,
+                    sqlalchemy.func.count(),
+                ).group_by(conversations.character1_id, conversations.character2_id)
+            ).all()
+        return Graph(characters, edges)
+
+    version, graph = versions.build(load)
+    graph.version = version
+    return graph
+
+
+_graph: Optional[Graph] = None
+_graph_lock = threading.Lock()
+
+
+def get_graph() -> Graph:
+    """Returns the shared graph, building it on first use."""
+    global _graph
+    if _graph is None:
+        with _graph_lock:
+            if _graph is None:
+                _graph = build_graph()
+    return _graph
+
+
+async def get_graph_async() -> Graph:
+    """``get_graph`` for async handlers; the build runs in a thread."""
+    if _graph is not None:
+        return _graph
+    return await asyncio.to_thread(get_graph)
+
+
+def loaded_graph() -> Optional[Graph]:
+    """The shared graph if it has been built, without building it."""
+    return _graph
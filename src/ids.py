@@ -0,0 +1,110 @@
+"""
+Block-reserved id allocation for new conversations and lines.
+
+``add_conversation`` used to pick ids with ``SELECT max(id) + 1`` inside its
+transaction, which scans an aggregate on every write and hands the same id to
+concurrent requests. Instead, each worker reserves a block of ids (1000 by
+default, ``ID_BLOCK_SIZE``) by bumping a counter row in ``id_allocations`` in
+a short transaction of its own, and then hands ids out of that block from
+memory. The ``max()`` scan only runs once per table, to seed the counter.
+
+Ids stay unique across workers, but they are not contiguous: a block that a
+worker doesn't use up before it exits leaves a gap.
+"""
+import os
+import threading
+
+import sqlalchemy
+
+from src import database as db
+
+BLOCK_SIZE = int(os.environ.get("ID_BLOCK_SIZE", "1000"))
+
+_table_ready = False
+_table_lock = threading.Lock()
+
+
+def _ensure_table():
+    """Creates ``id_allocations`` once per process if the loader didn't."""
+    global _table_ready
+    if _table_ready:
+        return
+    with _table_lock:
+        if not _table_ready:
+            db.metadata_obj.create_all(db.engine, tables=[db.id_allocations])
+            _table_ready = True
+
+
+class IdAllocator:
+    def __init__(self, name: str, column, block_size: int = BLOCK_SIZE):
+        self.name = name
+        self.column = column
+        self.block_size = block_size
+        self.lock = threading.Lock()
+        self.next = 0
+        self.end = 0
+
+    def _reserve(self, size: int) -> int:
+        """Reserves ``size`` ids in the database and returns the first."""
+        _ensure_table()
+        allocations = db.id_allocations
+        with db.engine.begin() as conn:
+            seeded = conn.execute(
+                sqlalchemy.select(allocations.c.next_id).where(
+                    allocations.c.name == self.name
+                )
+            ).first()
+            if seeded is None:
+                # The WHERE keeps SQLite from parsing ON CONFLICT as a join.
+                first_free = sqlalchemy.select(
+                    sqlalchemy.literal(self.name),
+                    sqlalchemy.func.coalesce(sqlalchemy.func.max(self.column), -1) + 1,
+                ).where(sqlalchemy.true())
+                conn.execute(
+                    db.upsert(conn, allocations)
+                    .from_select(
+                        [allocations.c.name, allocations.c.next_id], first_free
+                    )
+                    .on_conflict_do_nothing()
+                )
+            end = conn.execute(
+                allocations.update()
+                .where(allocations.c.name == self.name)
+                .values(next_id=allocations.c.next_id + size)
+                .returning(allocations.c.next_id)
+            ).scalar_one()
+        return end - size
+
+    def allocate(self, count: int = 1) -> int:
+        """
+        Returns the first of ``count`` consecutive new ids. A request that
+        doesn't fit in what's left of the current block starts a new one.
+        """
+        with self.lock:
+            if self.next + count > self.end:
+                size = max(self.block_size, count)
+                self.next = self._reserve(size)
+                self.end = self.next + size
+            first = self.next
+            self.next += count
+            return first
+
+
+_lock = threading.Lock()
+_allocators = {}
+
+
+def _get(name: str, column) -> IdAllocator:
+    if name not in _allocators:
+        with _lock:
+            if name not in _allocators:
+                _allocators[name] = IdAllocator(name, column)
+    return _allocators[name]
+
+
+def conversation_ids(count: int = 1) -> int:
+    return _get("conversations", db.conversations.c.conversation_id).allocate(count)
+
+
+def line_ids(count: int = 1) -> int:
+    return _get("lines", db.lines.c.line_id).allocate(count)
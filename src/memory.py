@@ -0,0 +1,1010 @@
+"""
+In-memory read backend.
+
+The whole corpus is small enough to hold in RAM, so when the environment
+variable ``MOVIE_API_BACKEND`` is set to ``memory`` the read endpoints are
+answered from a ``Corpus`` that is loaded from the database once instead of
+querying Postgres on every request. The default (``postgres``) keeps the
+original SQL code paths. ``MOVIE_API_SNAPSHOT`` names a ``src.snapshot``
+file to load the corpus from instead of the database.
+
+Every ``Corpus`` query method returns exactly what the matching handler in
+``src/api`` returns, or ``None`` where the handler would answer 404.
+
+Loaded from a snapshot, the corpus doesn't hold a record per conversation
+and line: ``Rows`` makes them from the mapped columns when they're read and
+``Groups`` finds them by character or conversation in arrays the snapshot
+saved, so the workers of a server share those pages instead of each building
+its own copy. Only movies and characters, which are few, are materialized.
+
+Each worker loads its own corpus, so conversations are added to it by
+``src.versions.refresh``, whichever worker wrote them.
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+from collections import defaultdict
+from collections.abc import Mapping
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.datatypes import Character, Movie, Conversation, Line
+from src.ngrams import NgramIndex
+
+
+def _asc(value):
+    # NULL sorts as an empty string, as in src.pagination.sort_key. Only
+    # text and ids are sorted ascending.
+    return "" if value is None else value
+
+
+def _desc(value):
+    # ... and descending sorts are on numbers, with NULL as zero.
+    return -(value or 0)
+
+
+class SortedIndex:
+    """
+    A list of ids kept in ORDER BY order, so that a page of results is a slice
+    instead of a sort. ``values(id)`` returns the sort tuple of a row and
+    ``descending`` says which of its entries sort highest first. Sort tuples
+    must be unique, which is why every one of them ends with the id itself.
+    """
+
+    def __init__(
+        self, values: Callable, descending: Tuple[bool, ...], ids, order=None
+    ):
+        """
+        ``order`` is ``ids`` already sorted, e.g. as saved in a snapshot. A
+        snapshot's array isn't copied: ids inserted later are kept apart in
+        ``added``, in order, each with the position in the array it goes
+        before.
+        """
+        self.values = values
+        self.descending = descending
+        self.added: List[int] = []
+        self.added_at: List[int] = []
+        if order is not None and len(order) == len(ids):
+            self.ids = order
+        else:
+            self.ids = sorted(ids, key=self.key)
+
+    def __len__(self) -> int:
+        return len(self.ids) + len(self.added)
+
+    def tolist(self) -> List[int]:
+        if isinstance(self.ids, list):
+            return self.ids
+        ids = self.ids.tolist()
+        for at, id in reversed(list(zip(self.added_at, self.added))):
+            ids.insert(at, id)
+        return ids
+
+    def key_of(self, values) -> tuple:
+        return tuple(
+            _desc(v) if d else _asc(v) for v, d in zip(values, self.descending)
+        )
+
+    def key(self, id: int) -> tuple:
+        return self.key_of(self.values(id))
+
+    def _bisect(self, k, right=False, ids=None) -> int:
+        ids = self.ids if ids is None else ids
+        lo, hi = 0, len(ids)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_key = self.key(int(ids[mid]))
+            if mid_key < k or (right and mid_key == k):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def insert(self, id: int):
+        k = self.key(id)
+        if isinstance(self.ids, list):
+            self.ids.insert(self._bisect(k), id)
+            return
+        pos = self._bisect(k, ids=self.added)
+        self.added.insert(pos, id)
+        self.added_at.insert(pos, self._bisect(k))
+
+    def remove(self, id: int):
+        """Must be called before the fields the key depends on are changed."""
+        self.ids = self.tolist()
+        self.added, self.added_at = [], []
+        pos = self._bisect(self.key(id))
+        if pos < len(self.ids) and self.ids[pos] == id:
+            del self.ids[pos]
+
+    def page(
+        self, offset: int, limit: int, predicate=None, after=None, mask=None
+    ) -> List[int]:
+        """
+        Skips ``offset`` matching ids, starting just past the sort tuple
+        ``after`` when a cursor is given, and returns the next ``limit``.
+        ``mask`` is ``predicate`` over an array of the snapshot's ids at once;
+        it's used for those and ``predicate`` for the ids added since.
+        """
+        start = added = 0
+        if after is not None:
+            k = self.key_of(after)
+            start = self._bisect(k, True)
+            added = self._bisect(k, True, self.added)
+        if predicate is None and not self.added:
+            page = self.ids[start + offset : start + offset + limit]
+            return page if isinstance(page, list) else page.tolist()
+        page = []
+        for chunk in self._chunks(start, added, offset + limit, predicate, mask):
+            if offset >= len(chunk):
+                offset -= len(chunk)
+                continue
+            page += chunk[offset : offset + limit - len(page)]
+            offset = 0
+            if len(page) == limit:
+                break
+        return page
+
+    def _chunks(self, start, added, size, predicate, mask):
+        """
+        The ids from position ``start`` of ``ids`` and ``added`` of ``added``
+        on that ``predicate`` or ``mask`` accept, in order, a growing chunk
+        of ``ids`` at a time.
+        """
+        end = len(self.ids)
+        size = max(size, 64)
+        while start < end or added < len(self.added):
+            stop = min(start + size, end)
+            chunk = self.ids[start:stop]
+            if isinstance(chunk, list):
+                yield [id for id in chunk if predicate is None or predicate(id)]
+                start = stop
+                size *= 2
+                continue
+            if mask is not None:
+                keep = mask(chunk)
+            else:
+                keep = np.array(
+                    [predicate is None or predicate(id) for id in chunk.tolist()],
+                    dtype=bool,
+                )
+            at = (np.flatnonzero(keep) + start).tolist()
+            chunk = chunk[keep].tolist()
+            # The ids added before position ``stop``, or after the last id,
+            # go in between, each ahead of the id at its position.
+            first = added
+            while added < len(self.added) and (
+                self.added_at[added] < stop or stop == end
+            ):
+                added += 1
+            if added > first:
+                merged = heapq.merge(
+                    (
+                        (self.added_at[i], 0, self.added[i])
+                        for i in range(first, added)
+                        if predicate is None or predicate(self.added[i])
+                    ),
+                    zip(at, itertools.repeat(1), chunk),
+                    key=lambda entry: entry[:2],
+                )
+                chunk = [id for _, _, id in merged]
+            yield chunk
+            start = stop
+            size *= 2
+
+    def page_within(
+        self, subset, offset: int, limit: int, predicate=None, after=None
+    ) -> List[int]:
+        """
+        Like ``page`` but only over the ids in ``subset``. A small subset is
+        sorted directly instead of being found by walking the whole index.
+        """
+        if len(subset) * 8 >= len(self):
+            return self.page(
+                offset,
+                limit,
+                lambda id: id in subset and (predicate is None or predicate(id)),
+                after,
+            )
+        start = None if after is None else self.key_of(after)
+        ids = sorted(
+            (
+                id
+                for id in subset
+                if (predicate is None or predicate(id))
+                and (start is None or self.key(id) > start)
+            ),
+            key=self.key,
+        )
+        return ids[offset : offset + limit]
+
+
+class Rows(Mapping):
+    """
+    Records by id, made from the columns of a snapshot table when they're
+    read. ``ids`` are the sorted ids of the table's rows and ``make`` makes
+    a record from the values of a row in ``columns``, which are
+    ``src.snapshot`` columns or work like them. Records added later are held
+    in ``added``.
+    """
+
+    def __init__(self, ids: np.ndarray, make: Callable[..., Any], columns: list):
+        self.ids = ids
+        self.make = make
+        self.columns = columns
+        self.added: Dict[int, Any] = {}
+
+    def row(self, id) -> int:
+        """The row of ``id`` in the snapshot, or -1."""
+        if id is None:
+            return -1
+        i = int(self.ids.searchsorted(id))
+        return i if i < len(self.ids) and self.ids[i] == id else -1
+
+    def _take(self, rows: np.ndarray) -> list:
+        values = [column.take(rows) for column in self.columns]
+        return [self.make(*row) for row in zip(*values)]
+
+    def get(self, id, default=None):
+        record = self.added.get(id)
+        if record is not None:
+            return record
+        i = self.row(id)
+        if i < 0:
+            return default
+        return self.make(*(column[i] for column in self.columns))
+
+    def many(self, ids: Iterable) -> list:
+        """The records of those of ``ids`` there are, in order, made together."""
+        ids = [id for id in ids if id is not None]
+        wanted = np.array([id for id in ids if id not in self.added], np.int64)
+        rows = self.ids.searchsorted(wanted)
+        found = rows < len(self.ids)
+        found[found] = self.ids[rows[found]] == wanted[found]
+        made = dict(zip(wanted[found].tolist(), self._take(rows[found])))
+        made.update(self.added)
+        return [made[id] for id in ids if id in made]
+
+    def __getitem__(self, id):
+        record = self.get(id)
+        if record is None:
+            raise KeyError(id)
+        return record
+
+    def __setitem__(self, id, record):
+        self.added[id] = record
+
+    def __contains__(self, id) -> bool:
+        return id in self.added or self.row(id) >= 0
+
+    def __iter__(self):
+        return itertools.chain(map(int, self.ids), self.added)
+
+    def __len__(self) -> int:
+        return len(self.ids) + len(self.added)
+
+    def values(self):
+        """Every record, in row order and then as added."""
+        made = (
+            record
+            for start in range(0, len(self.ids), 4096)
+            for record in self._take(np.arange(start, min(start + 4096, len(self.ids))))
+        )
+        return itertools.chain(made, self.added.values())
+
+
+class Groups:
+    """
+    Ids grouped by the id of a row they refer to, e.g. line ids by
+    conversation. ``keys`` and ``ids`` are the pairs as a snapshot saved
+    them, sorted by key and then id; ids appended later are kept in lists.
+    """
+
+    def __init__(self, keys: Optional[np.ndarray] = None, ids=None):
+        self.keys = np.zeros(0, np.int64) if keys is None else keys
+        self.ids = np.zeros(0, np.int64) if ids is None else ids
+        self.added: Dict[int, List[int]] = defaultdict(list)
+
+    def _bounds(self, key) -> Tuple[int, int]:
+        if key is None or not len(self.keys):
+            return 0, 0
+        return (
+            int(self.keys.searchsorted(key, "left")),
+            int(self.keys.searchsorted(key, "right")),
+        )
+
+    def get(self, key, default=()):
+        start, end = self._bounds(key)
+        added = self.added.get(key)
+        if start == end and not added:
+            return default
+        return self.ids[start:end].tolist() + (added or [])
+
+    def __getitem__(self, key) -> List[int]:
+        return self.get(key, [])
+
+    def count(self, key) -> int:
+        start, end = self._bounds(key)
+        return end - start + len(self.added.get(key, ()))
+
+    def counts(self, keys: np.ndarray) -> list:
+        """``count`` of each of ``keys``."""
+        counts = self.keys.searchsorted(keys, "right") - self.keys.searchsorted(
+            keys, "left"
+        )
+        counts = counts.tolist()
+        if self.added:
+            for i, key in enumerate(keys.tolist()):
+                counts[i] += len(self.added.get(key, ()))
+        return counts
+
+    def append(self, key, id: int):
+        self.added[key].append(id)
+
+
+class Counts:
+    """
+    A column for ``Rows``: the ``count`` in ``groups`` of each value of the
+    column ``keys``, e.g. the number of lines of each conversation.
+    """
+
+    def __init__(self, keys, groups: Groups):
+        self.keys = keys
+        self.groups = groups
+
+    def __getitem__(self, i: int) -> int:
+        return self.groups.count(self.keys[i])
+
+    def take(self, rows: np.ndarray) -> list:
+        return self.groups.counts(np.array(self.keys.take(rows), np.int64))
+
+
+class Corpus:
+    """
+    Movies, characters, conversations and lines keyed by id, plus the
+    secondary indexes the endpoints need. ``Character.num_lines`` and
+    ``Conversation.num_lines`` are maintained as lines are added.
+    """
+
+    # For lines read from a snapshot, by row: whether list_lines shows the
+    # line and the id of its speaker, or -1. Walking a sorted index then
+    # looks rows up instead of making a Line per id.
+    listed_rows: Optional[np.ndarray] = None
+    speaker_rows: Optional[np.ndarray] = None
+
+    def __init__(
+        self,
+        movies: Iterable[Movie],
+        characters: Iterable[Character],
+        conversations: Iterable[Conversation],
+        lines: Iterable[Line],
+        orders: Optional[Dict[str, Sequence[int]]] = None,
+        groups: Optional[Dict[str, Groups]] = None,
+    ):
+        """
+        ``orders`` are the ids of the sorted indexes, as from ``orders()``.
+        ``conversations`` and ``lines`` may be the ``Rows`` of a snapshot,
+        which then gives the ``groups`` of their ids as well.
+        """
+        self.lock = threading.Lock()
+        # The data version the corpus reflects; see src.versions.
+        self.version = 0
+        self.movies: Dict[int, Movie] = {m.id: m for m in movies}
+        self.characters: Dict[int, Character] = {}
+        self.conversations: Mapping = {}
+        self.lines: Mapping = {}
+
+        groups = groups or {}
+        self.characters_by_movie: Dict[int, List[int]] = defaultdict(list)
+        self.conversations_by_character = groups.get(
+            "conversations.character_id", Groups()
+        )
+        self.lines_by_character = groups.get("lines.character_id", Groups())
+        self.lines_by_conversation = groups.get("lines.conversation_id", Groups())
+
+        for char in characters:
+            char.num_lines = 0
+            char.movie_id = self._shared(self.movies, char.movie_id)
+            self.characters[char.id] = char
+            self.characters_by_movie[char.movie_id].append(char.id)
+        self.character_names = NgramIndex(
+            (c.id, c.name) for c in self.characters.values()
+        )
+        self.movie_titles = NgramIndex((m.id, m.title) for m in self.movies.values())
+        if isinstance(lines, Rows):
+            self.conversations = conversations
+            self.lines = lines
+            for char in self.characters.values():
+                char.num_lines = self.lines_by_character.count(char.id)
+        else:
+            for conv in conversations:
+                self._add_conversation(conv)
+            for line in lines:
+                self._add_line(line)
+
+        asc, desc = False, True
+        orders = orders or {}
+
+        def index(name, values, descending, ids):
+            return SortedIndex(values, descending, ids, orders.get(name))
+
+        self.movie_order = {
+            "movie_title": index(
+                "movies.movie_title", self._movie_title, (asc, asc), self.movies
+            ),
+            "year": index("movies.year", self._movie_year, (asc, asc), self.movies),
+            "rating": index(
+                "movies.rating", self._movie_rating, (desc, asc), self.movies
+            ),
+        }
+        self.character_order = {
+            "character": index(
+                "characters.character",
+                self._character_name,
+                (asc, asc),
+                self.characters,
+            ),
+            "movie": index(
+                "characters.movie", self._character_movie, (asc, asc), self.characters
+            ),
+            "number_of_lines": index(
+                "characters.number_of_lines",
+                self._character_lines,
+                (desc, asc),
+                self.characters,
+            ),
+        }
+        self.line_order = {
+            "line_text": index(
+                "lines.line_text", self._line_text, (asc, asc), self.lines
+            ),
+            "movie_title": index(
+                "lines.movie_title", self._line_movie, (asc, asc, asc), self.lines
+            ),
+        }
+
+    def orders(self) -> Dict[str, List[int]]:
+        """The ids of each sorted index, by ``<table>.<sort>``."""
+        indexes = {
+            "movies": self.movie_order,
+            "characters": self.character_order,
+            "lines": self.line_order,
+        }
+        return {
+            f"{table}.{sort}": index.tolist()
+            for table, order in indexes.items()
+            for sort, index in order.items()
+        }
+
+    # Sort tuples. Each one mirrors the ORDER BY of the SQL it replaces and
+    # is what a pagination cursor for that sort holds.
+
+    def _movie_title(self, id):
+        return self.movies[id].title, id
+
+    def _movie_year(self, id):
+        return self.movies[id].year, id
+
+    def _movie_rating(self, id):
+        return self.movies[id].imdb_rating, id
+
+    def _character_name(self, id):
+        return self.characters[id].name, id
+
+    def _character_movie(self, id):
+        movie = self.movies.get(self.characters[id].movie_id)
+        return (movie.title if movie else None), id
+
+    def _character_lines(self, id):
+        return self.characters[id].num_lines, id
+
+    def _line_text(self, id):
+        return self.lines[id].line_text, id
+
+    def _line_movie(self, id):
+        line = self.lines[id]
+        movie = self.movies.get(line.movie_id)
+        return (movie.title if movie else None), line.line_text, id
+
+    # Writes
+
+    @staticmethod
+    def _shared(records: dict, id):
+        """
+        ``id``, or the equal int object that keys ``records``. Records that
+        refer to the same row then share one object instead of holding a copy
+        each, which is 32 bytes per reference on a large corpus.
+        """
+        record = records.get(id)
+        return id if record is None else record.id
+
+    def _add_conversation(self, conv: Conversation):
+        conv.num_lines = 0
+        conv.c1_id = self._shared(self.characters, conv.c1_id)
+        conv.c2_id = self._shared(self.characters, conv.c2_id)
+        conv.movie_id = self._shared(self.movies, conv.movie_id)
+        self.conversations[conv.id] = conv
+        self.conversations_by_character.append(conv.c1_id, conv.id)
+        if conv.c2_id != conv.c1_id:
+            self.conversations_by_character.append(conv.c2_id, conv.id)
+
+    def _add_line(self, line: Line):
+        char = self.characters.get(line.c_id)
+        if char:
+            char.num_lines += 1
+            line.c_id = char.id
+        conv = self.conversations.get(line.conv_id)
+        if conv:
+            conv.num_lines += 1
+            line.conv_id = conv.id
+        line.movie_id = self._shared(self.movies, line.movie_id)
+        self.lines[line.id] = line
+        self.lines_by_character.append(line.c_id, line.id)
+        self.lines_by_conversation.append(line.conv_id, line.id)
+
+    def add_conversation(self, conversation: Conversation, lines: List[Line]):
+        """
+        Applies a conversation that has just been committed to the database.
+        A corpus loaded after the commit already holds it, so it is skipped.
+        """
+        with self.lock:
+            if conversation.id in self.conversations:
+                return
+            changed = {line.c_id for line in lines if line.c_id in self.characters}
+            lines_order = self.character_order["number_of_lines"]
+            for c_id in changed:
+                lines_order.remove(c_id)
+            self._add_conversation(conversation)
+            for line in lines:
+                self._add_line(line)
+                for index in self.line_order.values():
+                    index.insert(line.id)
+            for c_id in changed:
+                lines_order.insert(c_id)
+
+    def apply(self, conversation_rows: List[dict], line_rows: List[dict]):
+        """Adds the rows ``versions.changes`` returns."""
+        lines_by_conversation = defaultdict(list)
+        for row in line_rows:
+            lines_by_conversation[row["conversation_id"]].append(
+                Line(
+                    row["line_id"],
+                    row["character_id"],
+                    row["movie_id"],
+                    row["conversation_id"],
+                    row["line_sort"],
+                    row["line_text"],
+                )
+            )
+        for row in conversation_rows:
+            self.add_conversation(
+                Conversation(
+                    row["conversation_id"],
+                    row["character1_id"],
+                    row["character2_id"],
+                    row["movie_id"],
+                    0,
+                ),
+                lines_by_conversation[row["conversation_id"]],
+            )
+
+    # Reads
+
+    def _listed_character(self, id) -> bool:
+        # list_characters inner joins movies and lines.
+        char = self.characters[id]
+        return char.num_lines > 0 and char.movie_id in self.movies
+
+    def _listed_line(self, id) -> bool:
+        # list_lines and get_line inner join characters and movies.
+        if self.listed_rows is not None:
+            row = self.lines.row(id)
+            if row >= 0:
+                return bool(self.listed_rows[row])
+        line = self.lines[id]
+        return line.c_id in self.characters and line.movie_id in self.movies
+
+    def _listed_lines(self, speakers=None):
+        """
+        ``_listed_line`` as a mask over an array of the snapshot's line ids,
+        also requiring one of ``speakers`` when given. None without a snapshot.
+        """
+        if self.listed_rows is None:
+            return None
+        if speakers is not None:
+            speakers = np.fromiter(speakers, np.int64, len(speakers))
+
+        def mask(ids):
+            rows = self.lines.ids.searchsorted(ids)
+            listed = self.listed_rows[rows]
+            if speakers is not None:
+                listed &= np.isin(self.speaker_rows[rows], speakers)
+            return listed
+
+        return mask
+
+    def _speaker(self, line_id):
+        if self.speaker_rows is not None:
+            row = self.lines.row(line_id)
+            if row >= 0:
+                return int(self.speaker_rows[row])
+        return self.lines[line_id].c_id
+
+    def top_characters(self, movie_id: int, limit: int = 5) -> List[Character]:
+        chars = [
+            self.characters[c_id]
+            for c_id in self.characters_by_movie.get(movie_id, ())
+            if self.characters[c_id].num_lines > 0
+        ]
+        chars.sort(key=lambda c: (-c.num_lines, c.id))
+        return chars[:limit]
+
+    def get_movie(self, movie_id: int) -> Optional[dict]:
+        movie = self.movies.get(movie_id)
+        if movie is None:
+            return None
+        return {
+            "movie_id": movie.id,
+            "title": movie.title,
+            "top_characters": [
+                {
+                    "character_id": c.id,
+                    "character": c.name,
+                    "num_lines": c.num_lines,
+                }
+                for c in self.top_characters(movie_id)
+            ],
+        }
+
+    def list_movies(
+        self, name: str, limit: int, offset: int, sort: str, after=None
+    ) -> list:
+        index = self.movie_order[sort]
+        if name == "":
+            ids = index.page(offset, limit, None, after)
+        else:
+            matches = self.movie_titles.search(name)
+            ids = index.page_within(matches, offset, limit, None, after)
+        json = []
+        for id in ids:
+            movie = self.movies[id]
+            json.append(
+                {
+                    "movie_id": movie.id,
+                    "movie_title": movie.title,
+                    "year": movie.year,
+                    "imdb_rating": movie.imdb_rating,
+                    "imdb_votes": movie.imdb_votes,
+                }
+            )
+        return json
+
+    def top_conversations(self, character_id: int) -> List[dict]:
+        together: Dict[int, int] = defaultdict(int)
+        conv_ids = self.conversations_by_character.get(character_id, ())
+        for conv in _many(self.conversations, conv_ids):
+            other = conv.c2_id if conv.c1_id == character_id else conv.c1_id
+            if other != character_id and conv.num_lines:
+                together[other] += conv.num_lines
+        json = []
+        for other, count in sorted(together.items(), key=lambda t: (-t[1], t[0])):
+            char = self.characters.get(other)
+            if char is None:
+                continue
+            json.append(
+                {
+                    "character_id": char.id,
+                    "character": char.name,
+                    "gender": char.gender,
+                    "number_of_lines_together": count,
+                }
+            )
+        return json
+
+    def get_character(self, character_id: int) -> Optional[dict]:
+        char = self.characters.get(character_id)
+        if char is None:
+            return None
+        # get_character outer joins movies.
+        movie = self.movies.get(char.movie_id)
+        return {
+            "character_id": char.id,
+            "character": char.name,
+            "movie": movie.title if movie else None,
+            "gender": char.gender,
+            "top_conversations": self.top_conversations(character_id),
+        }
+
+    def list_characters(
+        self, name: str, limit: int, offset: int, sort: str, after=None
+    ) -> list:
+        index = self.character_order[sort]
+        if name == "":
+            ids = index.page(offset, limit, self._listed_character, after)
+        else:
+            matches = self.character_names.search(name)
+            ids = index.page_within(
+                matches, offset, limit, self._listed_character, after
+            )
+        json = []
+        for id in ids:
+            char = self.characters[id]
+            json.append(
+                {
+                    "character_id": char.id,
+                    "character": char.name,
+                    "movie": self.movies[char.movie_id].title,
+                    "number_of_lines": char.num_lines,
+                }
+            )
+        return json
+
+    def get_line(self, line_id: int) -> Optional[dict]:
+        line = self.lines.get(line_id)
+        if line is None or not self._listed_line(line_id):
+            return None
+        movie = self.movies[line.movie_id]
+        return {
+            "line_id": line.id,
+            "character_id": line.c_id,
+            "character": self.characters[line.c_id].name,
+            "movie_id": movie.id,
+            "movie": movie.title,
+            "conversation_id": line.conv_id,
+            "text": line.line_text,
+        }
+
+    def list_lines(
+        self, text: str, limit: int, offset: int, sort: str, after=None
+    ) -> list:
+        index = self.line_order[sort]
+        if text == "":
+            ids = index.page(
+                offset, limit, self._listed_line, after, self._listed_lines()
+            )
+        else:
+            speakers = self.character_names.search(text)
+            candidates = sum(self.characters[c].num_lines for c in speakers)
+            if candidates * 8 < len(index):
+                subset = [id for c in speakers for id in self.lines_by_character[c]]
+                ids = index.page_within(subset, offset, limit, self._listed_line, after)
+            else:
+                ids = index.page(
+                    offset,
+                    limit,
+                    lambda id: self._speaker(id) in speakers
+                    and self._listed_line(id),
+                    after,
+                    self._listed_lines(speakers),
+                )
+        return [self._line_summary(line) for line in _many(self.lines, ids)]
+
+    def line_summaries(self, line_ids: Iterable[int]) -> List[dict]:
+        """``line_summary`` of each id that list_lines would show, in order."""
+        ids = [id for id in line_ids if id in self.lines and self._listed_line(id)]
+        return [self._line_summary(line) for line in _many(self.lines, ids)]
+
+    def line_summary(self, line_id: int) -> dict:
+        """A line as it appears in list results."""
+        return self._line_summary(self.lines[line_id])
+
+    def _line_summary(self, line: Line) -> dict:
+        return {
+            "line_id": line.id,
+            "character": self.characters[line.c_id].name,
+            "movie": self.movies[line.movie_id].title,
+            "conversation_id": line.conv_id,
+            "line_text": line.line_text,
+        }
+
+    def get_conversation(self, conversation_id: int) -> Optional[dict]:
+        conv = self.conversations.get(conversation_id)
+        if (
+            conv is None
+            or conv.movie_id not in self.movies
+            or conv.c1_id not in self.characters
+            or conv.c2_id not in self.characters
+        ):
+            return None
+        lines = sorted(
+            _many(self.lines, self.lines_by_conversation[conversation_id]),
+            key=lambda line: (line.line_sort, line.id),
+        )
+        return {
+            "convo_id": conv.id,
+            "character_1": self.characters[conv.c1_id].name,
+            "character_2": self.characters[conv.c2_id].name,
+            "movie": self.movies[conv.movie_id].title,
+            "lines": [
+                {
+                    "line_id": line.id,
+                    "character": self.characters[line.c_id].name,
+                    "line_text": line.line_text,
+                }
+                for line in lines
+                if line.c_id in self.characters
+            ],
+        }
+
+
+def _many(records: Mapping, ids: Iterable) -> list:
+    """The records of ``ids``, all of which are present."""
+    if isinstance(records, Rows):
+        return records.many(ids)
+    return [records[id] for id in ids]
+
+
+def corpus_from_rows(
+    movies, characters, conversations, lines, orders=None, groups=None
+) -> Corpus:
+    """
+    A corpus from rows of the four tables, with their columns as attributes.
+    ``conversations`` and ``lines`` may be ``Rows`` instead.
+    """
+    if not isinstance(conversations, Rows):
+        conversations = [
+            Conversation(
+                r.conversation_id, r.character1_id, r.character2_id, r.movie_id, 0
+            )
+            for r in conversations
+        ]
+    if not isinstance(lines, Rows):
+        lines = [
+            Line(
+                r.line_id,
+                r.character_id,
+                r.movie_id,
+                r.conversation_id,
+                r.line_sort,
+                r.line_text,
+            )
+            for r in lines
+        ]
+    return Corpus(
+        [
+            Movie(
+                r.movie_id,
+                r.title,
+                r.year,
+                r.imdb_rating,
+                r.imdb_votes,
+                r.raw_script_url,
+            )
+            for r in movies
+        ],
+        [
+            Character(r.character_id, r.name, r.movie_id, r.gender, r.age, 0)
+            for r in characters
+        ],
+        conversations,
+        lines,
+        orders,
+        groups,
+    )
+
+
+def load_from_database(engine) -> Corpus:
+    from src import database as db
+    from src import versions
+    import sqlalchemy
+
+    def load():
+        with engine.connect() as conn:
+            return corpus_from_rows(
+                *(
+                    conn.execute(sqlalchemy.select(table))
+                    for table in (db.movies, db.characters, db.conversations, db.lines)
+                )
+            )
+
+    version, corpus = versions.build(load, engine)
+    corpus.version = version
+    return corpus
+
+
+def _refers_to(column, records: Optional[dict]) -> np.ndarray:
+    """
+    Whether each value of a snapshot column is not NULL and, unless
+    ``records`` is None, one of their ids.
+    """
+    found = np.ones(len(column), bool) if column.valid is None else column.valid == 1
+    if records is not None:
+        found &= np.isin(column.values, np.fromiter(records, np.int64, len(records)))
+    return found
+
+
+def load_from_snapshot(snapshot, engine=None) -> Corpus:
+    """
+    A corpus that reads its conversations and lines from a ``src.snapshot``
+    file, with the sorted indexes and groups as the snapshot saved them.
+    With an ``engine``, the conversations committed after the data version
+    the snapshot was written at, and their lines, are then read from the
+    database's log of them.
+    """
+    groups = {name: Groups(keys, ids) for name, (keys, ids) in snapshot.groups.items()}
+
+    conversations = snapshot["conversations"]
+    conversation_ids = conversations["conversation_id"]
+    conversation_columns = [
+        conversations[name]
+        for name in ("conversation_id", "character1_id", "character2_id", "movie_id")
+    ] + [Counts(conversation_ids, groups["lines.conversation_id"])]
+    lines = snapshot["lines"]
+
+    corpus = corpus_from_rows(
+        snapshot["movies"].rows(),
+        snapshot["characters"].rows(),
+        Rows(conversation_ids.values, Conversation, conversation_columns),
+        Rows(lines["line_id"].values, Line, list(lines.columns.values())),
+        orders=snapshot.orders,
+        groups=groups,
+    )
+    speakers = lines["character_id"]
+    movies = lines["movie_id"]
+    corpus.listed_rows = _refers_to(speakers, corpus.characters) & _refers_to(
+        movies, corpus.movies
+    )
+    corpus.speaker_rows = np.where(_refers_to(speakers, None), speakers.values, -1)
+    corpus.version = snapshot.data_version
+    if engine is None:
+        return corpus
+
+    from src import versions
+
+    versions.ensure(engine)
+    with engine.connect() as conn:
+        epoch, _ = versions.state(conn)
+        if epoch != snapshot.data_epoch:
+            raise ValueError(
+                f"{snapshot.path} was written from another database."
+            )
+        latest, conversation_rows, line_rows = versions.changes(conn, corpus.version)
+    corpus.apply(conversation_rows, line_rows)
+    corpus.version = latest
+    return corpus
+
+
+_corpus: Optional[Corpus] = None
+_corpus_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    return os.environ.get("MOVIE_API_BACKEND", "postgres") == "memory"
+
+
+def get_corpus() -> Optional[Corpus]:
+    """
+    Returns the shared corpus when the memory backend is enabled, loading it
+    on first use, and None otherwise.
+    """
+    global _corpus
+    if not enabled():
+        return None
+    if _corpus is None:
+        with _corpus_lock:
+            if _corpus is None:
+                from src import database as db
+
+                path = os.environ.get("MOVIE_API_SNAPSHOT")
+                if path:
+                    from src import snapshot
+
+                    _corpus = load_from_snapshot(snapshot.read(path), db.engine)
+                else:
+                    _corpus = load_from_database(db.engine)
+    return _corpus
+
+
+async def get_corpus_async() -> Optional[Corpus]:
+    """``get_corpus`` for async handlers: the first load runs in a thread."""
+    if _corpus is not None or not enabled():
+        return _corpus
+    return await asyncio.to_thread(get_corpus)
+
+
+def loaded_corpus() -> Optional[Corpus]:
+    """The shared corpus if it has been loaded, without loading it."""
+    return _corpus
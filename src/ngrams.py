@@ -0,0 +1,133 @@
+"""
+Substring and prefix search over character names and movie titles.
+
+An ``NgramIndex`` maps every 1-, 2- and 3-character slice of the lowercased
+text to the ids containing it, so a substring query only has to verify the
+few ids that share all of its trigrams. A sorted copy of the texts answers
+prefix completion with a bisect. The memory corpus keeps one per column for
+its ``name`` filters, and autocomplete builds one on first use.
+
+The SQL backend filters in the database instead, with ``contains``: an ids
+list from the index could run to every row of a large table, more than a
+statement can bind. On Postgres the ILIKE is served by the ``pg_trgm`` GIN
+indexes in ``src.database``; SQLite has no such index and scans.
+"""
+import asyncio
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import sqlalchemy
+
+N = 3
+
+
+class NgramIndex:
+    def __init__(self, items: Iterable[Tuple[int, Optional[str]]]):
+        self.texts: Dict[int, str] = {}
+        self.grams: Dict[str, Set[int]] = defaultdict(set)
+        for id, text in items:
+            if text is None:
+                continue
+            text = text.lower()
+            self.texts[id] = text
+            for n in range(1, N + 1):
+                for i in range(len(text) - n + 1):
+                    self.grams[text[i : i + n]].add(id)
+        self.prefixes = sorted((text, id) for id, text in self.texts.items())
+
+    def search(self, needle: str) -> Set[int]:
+        """Ids whose text contains ``needle``, ignoring case, like ILIKE."""
+        needle = needle.lower()
+        n = min(len(needle), N)
+        if n == 0:
+            return set(self.texts)
+        postings = [
+            self.grams.get(needle[i : i + n], set()) for i in range(len(needle) - n + 1)
+        ]
+        postings.sort(key=len)
+        candidates = postings[0].intersection(*postings[1:])
+        if len(needle) <= N:
+            return candidates
+        return {id for id in candidates if needle in self.texts[id]}
+
+    def complete(self, prefix: str, limit: int) -> List[int]:
+        """Up to ``limit`` ids whose text starts with ``prefix``, alphabetically."""
+        prefix = prefix.lower()
+        ids = []
+        i = bisect_left(self.prefixes, (prefix,))
+        while i < len(self.prefixes) and len(ids) < limit:
+            text, id = self.prefixes[i]
+            if not text.startswith(prefix):
+                break
+            ids.append(id)
+            i += 1
+        return ids
+
+
+_indexes: Dict[str, NgramIndex] = {}
+_lock = threading.Lock()
+
+
+def _build(name: str) -> NgramIndex:
+    from src import memory
+
+    corpus = memory.get_corpus()
+    if corpus is not None:
+        return getattr(corpus, name)
+
+    from src import database as db
+
+    id_column, text_column = {
+        "character_names": (db.characters.c.character_id, db.characters.c.name),
+        "movie_titles": (db.movies.c.movie_id, db.movies.c.title),
+    }[name]
+    with db.engine.connect() as conn:
+        return NgramIndex(conn.execute(sqlalchemy.select(id_column, text_column)))
+
+
+def _get(name: str) -> NgramIndex:
+    if name not in _indexes:
+        with _lock:
+            if name not in _indexes:
+                _indexes[name] = _build(name)
+    return _indexes[name]
+
+
+def character_names() -> NgramIndex:
+    return _get("character_names")
+
+
+def movie_titles() -> NgramIndex:
+    return _get("movie_titles")
+
+
+async def _get_async(name: str) -> NgramIndex:
+    if name in _indexes:
+        return _indexes[name]
+    return await asyncio.to_thread(_get, name)
+
+
+async def character_names_async() -> NgramIndex:
+    """``character_names`` for async handlers; a first build runs in a thread."""
+    return await _get_async("character_names")
+
+
+async def movie_titles_async() -> NgramIndex:
+    return await _get_async("movie_titles")
+
+
+def contains(column):
+    """
+    ``column ILIKE :pattern``, for a template that binds ``pattern`` to a
+    ``pattern(needle)``.
+    """
+    return column.ilike(sqlalchemy.bindparam("pattern"), escape="\\")
+
+
+def pattern(needle: str) -> str:
+    """The ILIKE pattern matching text that contains ``needle`` literally."""
+    for special in ("\\", "%", "_"):
+        needle = needle.replace(special, "\\" + special)
+    return f"%{needle}%"
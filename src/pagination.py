@@ -0,0 +1,150 @@
+"""
+Keyset (cursor) pagination for the list endpoints.
+
+A cursor is the sort tuple of the last row of a page, e.g. ``(title,
+movie_id)``, packed into an opaque url-safe string together with the sort
+option it belongs to. The next page is then "rows strictly after that tuple",
+which an index can seek to directly instead of reading and discarding
+``offset`` rows.
+
+Lists sort by the keys of ``sort_key`` rather than by the raw columns: NULLs
+sort as an empty string or zero, explicitly and the same on Postgres and
+SQLite, so that the cursor condition is always one row-value comparison.
+"""
+import base64
+import json
+import math
+from typing import List, Optional, Sequence, Tuple
+
+import sqlalchemy
+from fastapi import HTTPException, Response
+
+CURSOR_HEADER = "X-Next-Cursor"
+
+
+def _sort_name(sort) -> str:
+    # Sort options arrive either as Enum members or as plain strings.
+    return getattr(sort, "value", sort)
+
+
+def encode_cursor(sort: str, values: Sequence) -> str:
+    raw = json.dumps([_sort_name(sort), list(values)], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+# The range of a 64-bit integer column, which is all a bound parameter can hold.
+_INT_MIN, _INT_MAX = -(2**63), 2**63 - 1
+
+
+def _valid(value, column) -> bool:
+    if value is None:
+        return column.nullable
+    python_type = column.type.python_type
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, int):
+        return python_type in (int, float) and _INT_MIN <= value <= _INT_MAX
+    if python_type is float:
+        return isinstance(value, float) and math.isfinite(value)
+    return isinstance(value, python_type)
+
+
+def decode_cursor(cursor: str, sort: str, order) -> List:
+    """
+    The sort tuple in ``cursor``, checked against ``order``, the ``(column,
+    descending)`` pairs of the sort, so that a forged cursor is a 400.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_sort, values = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="invalid cursor.")
+    if cursor_sort != _sort_name(sort):
+        raise HTTPException(status_code=400, detail="cursor is for a different sort.")
+    if (
+        not isinstance(values, list)
+        or len(values) != len(order)
+        or not all(_valid(v, column) for v, (column, _) in zip(values, order))
+    ):
+        raise HTTPException(status_code=400, detail="invalid cursor.")
+    return values
+
+
+def parse(cursor: Optional[str], sort: str, order) -> Optional[List]:
+    return None if cursor is None else decode_cursor(cursor, sort, order)
+
+
+def set_next_cursor(
+    response: Response, sort: str, page: List[dict], fields: Tuple[str, ...], limit: int
+):
+    """
+    Sends the cursor for the page after ``page`` in the ``X-Next-Cursor``
+    header. ``fields`` are the keys of the sort tuple in each result. No
+    header is sent once a short page shows the end has been reached.
+    """
+    if len(page) == limit:
+        last = page[-1]
+        response.headers[CURSOR_HEADER] = encode_cursor(sort, [last[f] for f in fields])
+
+
+def sort_key(column, descending: bool, value=None):
+    """
+    The expression a list sorts ``column`` by: ascending and never NULL, so
+    that a cursor is a single row-value comparison. NULL counts as an empty
+    string or as zero on every database, and a descending sort, which is
+    only ever on a number, is on the negated value. ``value`` gives the same
+    key for a cursor value instead of the column. ``src.database`` declares
+    the matching indexes.
+    """
+    key = column if value is None else value
+    if column.nullable:
+        zero = "''" if column.type.python_type is str else "0"
+        key = sqlalchemy.func.coalesce(key, sqlalchemy.literal_column(zero))
+    return -key if descending else key
+
+
+def order_by(order: Sequence[Tuple[sqlalchemy.ColumnElement, bool]]) -> list:
+    """ORDER BY clauses for a list of ``(column, descending)`` pairs."""
+    return [sort_key(column, d) for column, d in order]
+
+
+def after(order: Sequence[Tuple[sqlalchemy.ColumnElement, bool]], values: Sequence):
+    """
+    Returns a WHERE clause selecting the rows that come strictly after
+    ``values`` in ``order``, a list of ``(column, descending)`` pairs.
+    """
+    keys = order_by(order)
+    bounds = [
+        sort_key(
+            column,
+            d,
+            v
+            if isinstance(v, sqlalchemy.BindParameter)
+            else sqlalchemy.literal(v, column.type),
+        )
+        for (column, d), v in zip(order, values)
+    ]
+    # The row-value comparison is the whole condition. The bound on the first
+    # key repeats part of it for SQLite, which only seeks an index on
+    # expressions through a plain comparison.
+    return sqlalchemy.and_(
+        keys[0] >= bounds[0], sqlalchemy.tuple_(*keys) > sqlalchemy.tuple_(*bounds)
+    )
+
+
+def after_template(order: Sequence[Tuple[sqlalchemy.ColumnElement, bool]]):
+    """
+    ``after`` for cached statement templates: the cursor values are bound
+    parameters ``after_0``, ``after_1``, ... filled in by ``after_params``.
+    """
+    return after(
+        order,
+        [
+            sqlalchemy.bindparam(f"after_{i}", type_=column.type)
+            for i, (column, _) in enumerate(order)
+        ],
+    )
+
+
+def after_params(values: Sequence) -> dict:
+    return {f"after_{i}": v for i, v in enumerate(values)}
@@ -0,0 +1,143 @@
+"""
+Connection pool configuration and checkout metrics.
+
+The engine's pool is configured from the environment:
+
+* ``DB_POOL``: ``queue`` (default) keeps a pool of connections per worker.
+  ``null`` opens a connection per checkout and closes it on return, for
+  serverless deployments where an external pooler such as PgBouncer (or
+  Supabase's pooler port) does the pooling and idle instances shouldn't hold
+  Postgres connections.
+* ``DB_POOL_SIZE`` (default 5) and ``DB_MAX_OVERFLOW`` (default 10):
+  connections kept open, and extra ones allowed under load.
+* ``DB_POOL_TIMEOUT``: seconds a checkout waits for a free connection before
+  failing (default 30).
+* ``DB_POOL_RECYCLE``: replace connections older than this many seconds
+  (default -1, never), for servers or poolers that drop idle connections.
+* ``DB_POOL_PRE_PING``: ``true`` tests each connection on checkout.
+
+The settings apply to the sync and the async engine alike; each has its own
+pool. Every checkout is timed, including waiting for a free connection and, for a
+new one, connecting. ``stats()`` reports the distribution so the pool can be
+sized against real concurrency.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Dict
+
+import sqlalchemy
+import sqlalchemy.pool
+
+from src import timing
+
+# Upper bounds, in seconds, of the checkout wait histogram.
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, float("inf"))
+
+
+def _flag(name: str) -> bool:
+    return os.environ.get(name, "").lower() in ("1", "true", "yes", "on")
+
+
+class CheckoutStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.counts = [0] * len(BUCKETS)
+
+    def record(self, seconds: float):
+        with self.lock:
+            self.checkouts += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            self.counts[bisect_left(BUCKETS, seconds)] += 1
+
+    def record_timeout(self):
+        with self.lock:
+            self.timeouts += 1
+
+
+checkout_stats = CheckoutStats()
+
+
+class _TimedCheckout:
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except sqlalchemy.exc.TimeoutError:
+            checkout_stats.record_timeout()
+            raise
+        seconds = time.perf_counter() - start
+        checkout_stats.record(seconds)
+        timing.record("pool", seconds)
+        return connection
+
+
+class TimedQueuePool(_TimedCheckout, sqlalchemy.pool.QueuePool):
+    pass
+
+
+class TimedNullPool(_TimedCheckout, sqlalchemy.pool.NullPool):
+    pass
+
+
+class TimedAsyncQueuePool(_TimedCheckout, sqlalchemy.pool.AsyncAdaptedQueuePool):
+    pass
+
+
+def engine_options(asyncio: bool = False) -> Dict[str, Any]:
+    """
+    Keyword arguments for ``create_engine``, or with ``asyncio`` for
+    ``create_async_engine``, from the environment.
+    """
+    options: Dict[str, Any] = {
+        "pool_pre_ping": _flag("DB_POOL_PRE_PING"),
+        "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE", "-1")),
+    }
+    if os.environ.get("DB_POOL", "queue").lower() == "null":
+        options["poolclass"] = TimedNullPool
+    else:
+        options["poolclass"] = TimedAsyncQueuePool if asyncio else TimedQueuePool
+        options["pool_size"] = int(os.environ.get("DB_POOL_SIZE", "5"))
+        options["max_overflow"] = int(os.environ.get("DB_MAX_OVERFLOW", "10"))
+        options["pool_timeout"] = float(os.environ.get("DB_POOL_TIMEOUT", "30"))
+    return options
+
+
+def stats(*pools) -> Dict[str, Any]:
+    """Checkout wait metrics since this worker started, and each pool's state."""
+    s = checkout_stats
+    with s.lock:
+        json = {
+            "checkouts": s.checkouts,
+            "timeouts": s.timeouts,
+            "wait_seconds_total": s.wait_total,
+            "wait_seconds_max": s.wait_max,
+            "wait_seconds_avg": s.wait_total / s.checkouts if s.checkouts else 0.0,
+            # Cumulative, like a Prometheus histogram.
+            "wait_seconds_buckets": {
+                str(bound): sum(s.counts[: i + 1]) for i, bound in enumerate(BUCKETS)
+            },
+        }
+    json["pools"] = [_pool_state(pool) for pool in pools if pool is not None]
+    return json
+
+
+def _pool_state(pool) -> Dict[str, Any]:
+    if not isinstance(pool, sqlalchemy.pool.QueuePool):
+        return {"class": type(pool).__name__}
+    return {
+        "class": type(pool).__name__,
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": pool.overflow(),
+    }
@@ -0,0 +1,61 @@
+"""
+Fast JSON responses.
+
+Returning dicts from a route makes FastAPI walk the whole result with
+``jsonable_encoder``, validate it against the ``response_model`` if there is
+one, and only then encode it. The list endpoints instead turn their rows
+straight into dicts keyed by the query's column labels with ``rows`` and
+return a ``JSONResponse``, which FastAPI sends as is. Their ``response_model``
+still documents the shape in the OpenAPI schema, and ``check`` compares it
+with the query's columns once, when the query is built, instead of
+validating every response.
+
+``JSONResponse`` encodes with orjson when it is installed and with the
+standard library otherwise. It is also the app's default response class, so
+the routes that still return dicts at least get the faster encoder.
+"""
+from typing import Any, List, Type
+
+import pydantic
+import sqlalchemy
+from starlette.responses import JSONResponse as _JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+if orjson is not None:
+
+    def dumps(content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+else:
+    import json
+
+    def dumps(content: Any) -> bytes:
+        return json.dumps(
+            content, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+        ).encode("utf-8")
+
+
+class JSONResponse(_JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def rows(result) -> List[dict]:
+    """Every row of ``result`` as a dict keyed by its column labels."""
+    keys = list(result.keys())
+    return [dict(zip(keys, row)) for row in result]
+
+
+def check(query: sqlalchemy.Select, model: Type[pydantic.BaseModel]):
+    """Raises unless ``query`` selects exactly the fields of ``model``, in order."""
+    columns = [column.name for column in query.selected_columns]
+    fields = list(model.__fields__)
+    if columns != fields:
+        raise ValueError(
+            f"{model.__name__} has fields {fields} but the query selects {columns}"
+        )
@@ -0,0 +1,194 @@
+"""
+Full-text search over ``lines.line_text``.
+
+A leading-wildcard ILIKE can't use an index, so ``/lines/search`` is served
+from an inverted index built in-process the first time it's needed, either
+from the in-memory corpus or from one pass over the ``lines`` table. Lines
+added later, in any worker, are added to it by ``src.versions``. Each token
+maps to a sorted array of documents and a parallel array of term
+frequencies. Results are ranked with BM25, and quoted phrases are checked
+against the text of the lines that contain all of their tokens.
+"""
+import asyncio
+import heapq
+import math
+import re
+import threading
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+_token_re = re.compile(r"[a-z0-9]+(?:'[a-z0-9]+)*")
+_phrase_re = re.compile(r'"([^"]*)"')
+
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    return _token_re.findall(text.lower()) if text else []
+
+
+def parse_query(query: str) -> Tuple[List[str], List[List[str]]]:
+    """
+    Splits a query into its plain terms and its quoted phrases, e.g.
+    ``big "green apples"`` is ``(["big", "green", "apples"], [["green",
+    "apples"]])``. Every term, including those of phrases, must match.
+    """
+    phrases = [tokenize(p) for p in _phrase_re.findall(query)]
+    phrases = [p for p in phrases if len(p) > 1]
+    return tokenize(query), phrases
+
+
+def _contains_phrase(tokens: List[str], phrase: List[str]) -> bool:
+    n = len(phrase)
+    return any(tokens[i : i + n] == phrase for i in range(len(tokens) - n + 1))
+
+
+class LineIndex:
+    """Inverted index from tokens to the lines that contain them."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.line_ids = array("q")
+        self.lengths = array("I")
+        self.texts: List[Optional[str]] = []
+        self.postings: Dict[str, Tuple[array, array]] = {}
+        self.total_length = 0
+        # The data version the index reflects; see src.versions.
+        self.version = 0
+
+    def add(self, line_id: int, text: Optional[str]):
+        """Documents are numbered in insertion order, so postings stay sorted."""
+        tokens = tokenize(text)
+        with self.lock:
+            doc = len(self.line_ids)
+            self.line_ids.append(line_id)
+            self.lengths.append(len(tokens))
+            self.texts.append(text)
+            self.total_length += len(tokens)
+            for token, tf in Counter(tokens).items():
+                posting = self.postings.get(token)
+                if posting is None:
+                    posting = self.postings[token] = (array("I"), array("I"))
+                posting[0].append(doc)
+                posting[1].append(tf)
+
+    def apply(self, conversation_rows: List[dict], line_rows: List[dict]):
+        """Adds the rows ``versions.changes`` returns."""
+        for row in line_rows:
+            self.add(row["line_id"], row["line_text"])
+
+    def _tf(self, token: str, doc: int) -> int:
+        docs, tfs = self.postings[token]
+        pos = bisect_left(docs, doc)
+        if pos < len(docs) and docs[pos] == doc:
+            return tfs[pos]
+        return 0
+
+    def search(
+        self, query: str, limit: Optional[int] = None
+    ) -> List[Tuple[int, float]]:
+        """Returns ``(line_id, score)`` for the best ``limit`` matches, best first."""
+        terms, phrases = parse_query(query)
+        terms = list(dict.fromkeys(terms))
+        if not terms or any(t not in self.postings for t in terms):
+            return []
+
+        n = len(self.line_ids)
+        avg_length = self.total_length / n if n else 0.0
+        idf = {}
+        for t in terms:
+            df = len(self.postings[t][0])
+            idf[t] = math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+        # Walk the rarest term's postings and probe the others.
+        terms.sort(key=lambda t: len(self.postings[t][0]))
+        rarest_docs, rarest_tfs = self.postings[terms[0]]
+        results = []
+        for doc, tf in zip(rarest_docs, rarest_tfs):
+            tfs = [tf]
+            for t in terms[1:]:
+                tfs.append(self._tf(t, doc))
+                if not tfs[-1]:
+                    break
+            else:
+                if phrases:
+                    tokens = tokenize(self.texts[doc])
+                    if not all(_contains_phrase(tokens, p) for p in phrases):
+                        continue
+                norm = K1 * (1 - B + B * self.lengths[doc] / avg_length)
+                score = sum(
+                    idf[t] * f * (K1 + 1) / (f + norm) for t, f in zip(terms, tfs)
+                )
+                results.append((self.line_ids[doc], score))
+
+        if limit is None:
+            return sorted(results, key=lambda r: (-r[1], r[0]))
+        return heapq.nsmallest(limit, results, key=lambda r: (-r[1], r[0]))
+
+
+def build_index() -> LineIndex:
+    from src import memory
+    from src import versions
+
+    corpus = memory.get_corpus()
+    if corpus is not None:
+
+        def index_corpus():
+            index = LineIndex()
+            for line in corpus.lines.values():
+                index.add(line.id, line.line_text)
+            return index
+
+        version, index = versions.build_from(corpus, index_corpus)
+        index.version = version
+        return index
+
+    import sqlalchemy
+    from src import database as db
+
+    def load():
+        index = LineIndex()
+        with db.engine.connect() as conn:
+            rows = conn.execution_options(
+                stream_results=True, yield_per=10000
+            ).execute(
+                sqlalchemy.select(db.lines.c.line_id, db.lines.c.line_text).order_by(
+                    db.lines.c.line_id
+                )
+            )
+            for row in rows:
+                index.add(row.line_id, row.line_text)
+        return index
+
+    version, index = versions.build(load)
+    index.version = version
+    return index
+
+
+_index: Optional[LineIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> LineIndex:
+    """Returns the shared index, building it on first use."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = build_index()
+    return _index
+
+
+async def get_index_async() -> LineIndex:
+    """``get_index`` for async handlers; the build runs in a thread."""
+    if _index is not None:
+        return _index
+    return await asyncio.to_thread(get_index)
+
+
+def loaded_index() -> Optional[LineIndex]:
+    """The shared index if it has been built, without building it."""
+    return _index
@@ -0,0 +1,383 @@
+"""
+Columnar, memory-mapped snapshots of the corpus.
+
+    python -m src.snapshot write corpus.snapshot
+    python -m src.snapshot write corpus.snapshot --sqlite movies.db
+    python -m src.snapshot info corpus.snapshot
+
+A snapshot holds the ``movies``, ``characters``, ``conversations`` and
+``lines`` tables in one file, column by column and in primary key order.
+Integer and float columns are fixed-width little-endian arrays; text columns
+are an array of ``rows + 1`` byte offsets into a heap of UTF-8 text, so row
+``i`` is ``heap[offsets[i]:offsets[i + 1]]``. A column with NULLs also has a
+byte per row that is 1 where the row has a value. The ids of each sorted
+index of the memory corpus are saved as well, in order, so that workers
+don't sort them again, as are the ids of lines and conversations grouped by
+the character or conversation they belong to (``memory.Groups``). So is the
+``src.versions`` data version the tables were read at, with its epoch, so
+that a worker loading the snapshot only reads the conversations committed
+after it.
+
+The file starts with ``MAGIC``, the format version and the length of a JSON
+header that gives the row count of each table and the type and position of
+each array, counted from the first 8-byte boundary after the header. Every
+array starts on an 8-byte boundary.
+
+``read`` maps the file read-only and hands out NumPy views of it without
+copying, so the worker processes of one server share the same page cache
+pages, and opening a snapshot costs the same however big it is. With
+``MOVIE_API_SNAPSHOT`` set to its path, the memory backend serves
+conversations and lines straight from the snapshot instead of querying every
+table and sorting every index (see ``memory.load_from_snapshot``).
+
+``write`` renames the finished file over the old one, so workers that
+already have the old snapshot mapped keep reading it unchanged.
+"""
+import argparse
+import collections
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import sqlalchemy
+
+from src import database as db
+from src import versions
+
+MAGIC = b"MOVSNAP\0"
+VERSION = 3
+
+# Magic, version and header length.
+_prefix = struct.Struct("<8sII")
+
+_dtypes = {"int": np.dtype("<i8"), "float": np.dtype("<f8")}
+
+# Tables in the order they are written.
+tables = [db.movies, db.characters, db.conversations, db.lines]
+
+# The groups of ``memory.Groups``: for each, the table, the column holding the
+# key and the column holding the id of every pair.
+groups = {
+    "lines.character_id": [("lines", "character_id", "line_id")],
+    "lines.conversation_id": [("lines", "conversation_id", "line_id")],
+    "conversations.character_id": [
+        ("conversations", "character1_id", "conversation_id"),
+        ("conversations", "character2_id", "conversation_id"),
+    ],
+}
+
+
+def _kind(column: sqlalchemy.Column) -> str:
+    python_type = column.type.python_type
+    if python_type is int:
+        return "int"
+    if python_type is float:
+        return "float"
+    return "text"
+
+
+def _align(n: int) -> int:
+    return (n + 7) & ~7
+
+
+class Column:
+    """
+    One column of a snapshot table. ``values`` is the fixed-width array, or
+    for text the offsets into ``heap``; ``valid`` is None when the column has
+    no NULLs.
+    """
+
+    def __init__(
+        self,
+        kind: str,
+        values: np.ndarray,
+        valid: Optional[np.ndarray] = None,
+        heap: Optional[memoryview] = None,
+    ):
+        self.kind = kind
+        self.values = values
+        self.valid = valid
+        self.heap = heap
+
+    def __len__(self) -> int:
+        return len(self.values) - 1 if self.kind == "text" else len(self.values)
+
+    def __getitem__(self, i: int):
+        if self.valid is not None and not self.valid[i]:
+            return None
+        if self.kind == "text":
+            return str(self.heap[self.values[i] : self.values[i + 1]], "utf-8")
+        return self.values[i].item()
+
+    def take(self, rows: np.ndarray) -> list:
+        """The values of ``rows`` as Python objects, with None for NULL."""
+        if self.kind == "text":
+            heap = self.heap
+            starts = self.values[rows].tolist()
+            ends = self.values[rows + 1].tolist()
+            values = [str(heap[start:end], "utf-8") for start, end in zip(starts, ends)]
+        else:
+            values = self.values[rows].tolist()
+        if self.valid is not None:
+            for i in np.flatnonzero(self.valid[rows] == 0).tolist():
+                values[i] = None
+        return values
+
+    def tolist(self) -> list:
+        """Every value of the column as Python objects, with None for NULL."""
+        if self.kind == "text":
+            heap = self.heap
+            bounds = self.values.tolist()
+            values = [
+                str(heap[start:end], "utf-8") for start, end in zip(bounds, bounds[1:])
+            ]
+        else:
+            values = self.values.tolist()
+        if self.valid is not None:
+            for i in np.flatnonzero(self.valid == 0).tolist():
+                values[i] = None
+        return values
+
+
+class Table:
+    def __init__(self, name: str, row_count: int, columns: Dict[str, Column]):
+        self.name = name
+        self.row_count = row_count
+        self.columns = columns
+
+    def __len__(self) -> int:
+        return self.row_count
+
+    def __getitem__(self, column: str) -> Column:
+        return self.columns[column]
+
+    def rows(self) -> Iterator[tuple]:
+        """The rows as named tuples, with the columns as attributes."""
+        row = collections.namedtuple(self.name, self.columns)
+        return map(row._make, zip(*(c.tolist() for c in self.columns.values())))
+
+
+class Snapshot:
+    def __init__(
+        self,
+        path: str,
+        buffer,
+        tables: Dict[str, Table],
+        orders: Dict[str, np.ndarray],
+        groups: Dict[str, Tuple[np.ndarray, np.ndarray]],
+        data_epoch: str = "",
+        data_version: int = 0,
+    ):
+        """
+        ``orders`` are the ids of each sorted index of the memory corpus,
+        ``groups`` the keys and ids of each of its groups, and ``data_epoch``
+        and ``data_version`` the state of ``src.versions`` the tables were
+        read at.
+        """
+        self.path = path
+        self.buffer = buffer
+        self.tables = tables
+        self.orders = orders
+        self.groups = groups
+        self.data_epoch = data_epoch
+        self.data_version = data_version
+
+    def __getitem__(self, table: str) -> Table:
+        return self.tables[table]
+
+
+def read(path: str) -> Snapshot:
+    """Maps a snapshot file. Nothing but the header is read until it's used."""
+    with open(path, "rb") as file:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, header_length = _prefix.unpack_from(buffer)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a corpus snapshot.")
+    if version != VERSION:
+        raise ValueError(f"{path} is snapshot version {version}, not {VERSION}.")
+    header = json.loads(bytes(buffer[_prefix.size : _prefix.size + header_length]))
+    base = _align(_prefix.size + header_length)
+
+    view = memoryview(buffer)
+    snapshot_tables = {}
+    for name, table in header["tables"].items():
+        rows = table["rows"]
+        columns = {}
+        for column_name, c in table["columns"].items():
+            valid = None
+            if c.get("valid") is not None:
+                valid = np.frombuffer(buffer, np.uint8, rows, base + c["valid"])
+            if c["kind"] == "text":
+                offsets = np.frombuffer(
+                    buffer, _dtypes["int"], rows + 1, base + c["values"]
+                )
+                heap = view[base + c["heap"] : base + c["heap"] + c["heap_length"]]
+                columns[column_name] = Column("text", offsets, valid, heap)
+            else:
+                values = np.frombuffer(
+                    buffer, _dtypes[c["kind"]], rows, base + c["values"]
+                )
+                columns[column_name] = Column(c["kind"], values, valid)
+        snapshot_tables[name] = Table(name, rows, columns)
+    orders = {
+        name: np.frombuffer(buffer, _dtypes["int"], o["rows"], base + o["values"])
+        for name, o in header["orders"].items()
+    }
+    snapshot_groups = {
+        name: tuple(
+            np.frombuffer(buffer, _dtypes["int"], g["rows"], base + g[array])
+            for array in ("keys", "ids")
+        )
+        for name, g in header["groups"].items()
+    }
+    data = header["data"]
+    return Snapshot(
+        path,
+        buffer,
+        snapshot_tables,
+        orders,
+        snapshot_groups,
+        data["epoch"],
+        data["version"],
+    )
+
+
+def _encode(kind: str, values: list):
+    """The arrays of a column: its values (or offsets), heap and validity."""
+    nulls = [v is None for v in values]
+    valid = None
+    if any(nulls):
+        valid = np.logical_not(nulls).astype(np.uint8)
+    if kind == "text":
+        encoded = [b"" if v is None else v.encode("utf-8") for v in values]
+        offsets = np.zeros(len(values) + 1, _dtypes["int"])
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        return offsets, b"".join(encoded), valid
+    filled = [0 if v is None else v for v in values]
+    return np.array(filled, _dtypes[kind]), None, valid
+
+
+def write(engine, path: str, out=sys.stdout):
+    """Writes every table of ``engine`` to a snapshot at ``path``."""
+    start = time.perf_counter()
+    header: Dict[str, dict] = {"tables": {}, "orders": {}, "groups": {}}
+    sections: List[bytes] = []
+    position = 0
+
+    def add(data) -> int:
+        nonlocal position
+        offset = position
+        data = bytes(data)
+        sections.append(data + b"\0" * (_align(len(data)) - len(data)))
+        position += _align(len(data))
+        return offset
+
+    def fetch():
+        with engine.connect() as conn:
+            return versions.state(conn)[0], [
+                conn.execute(
+                    sqlalchemy.select(table).order_by(*table.primary_key.columns)
+                ).all()
+                for table in tables
+            ]
+
+    data_version, (epoch, fetched) = versions.build(fetch, engine)
+    header["data"] = {"epoch": epoch, "version": data_version}
+    for table, rows in zip(tables, fetched):
+        columns = {}
+        for i, column in enumerate(table.columns):
+            kind = _kind(column)
+            values, heap, valid = _encode(kind, [row[i] for row in rows])
+            columns[column.name] = {
+                "kind": kind,
+                "values": add(values.tobytes()),
+                "valid": None if valid is None else add(valid.tobytes()),
+            }
+            if heap is not None:
+                columns[column.name]["heap"] = add(heap)
+                columns[column.name]["heap_length"] = len(heap)
+        header["tables"][table.name] = {"rows": len(rows), "columns": columns}
+        print(f"{table.name}: {len(rows)} rows", file=out)
+
+    # The corpus sorts its indexes once here instead of in every worker.
+    from src import memory
+
+    for name, ids in memory.corpus_from_rows(*fetched).orders().items():
+        header["orders"][name] = {
+            "rows": len(ids),
+            "values": add(np.array(ids, _dtypes["int"]).tobytes()),
+        }
+
+    fetched_tables = {table.name: rows for table, rows in zip(tables, fetched)}
+    for name, sources in groups.items():
+        pairs = sorted(
+            {
+                (getattr(row, key), getattr(row, id))
+                for table, key, id in sources
+                for row in fetched_tables[table]
+                if getattr(row, key) is not None
+            }
+        )
+        keys = np.array([key for key, _ in pairs], _dtypes["int"])
+        ids = np.array([id for _, id in pairs], _dtypes["int"])
+        header["groups"][name] = {
+            "rows": len(pairs),
+            "keys": add(keys.tobytes()),
+            "ids": add(ids.tobytes()),
+        }
+
+    encoded = json.dumps(header).encode("utf-8")
+    base = _align(_prefix.size + len(encoded))
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as file:
+        file.write(_prefix.pack(MAGIC, VERSION, len(encoded)))
+        file.write(encoded)
+        file.write(b"\0" * (base - _prefix.size - len(encoded)))
+        for section in sections:
+            file.write(section)
+    os.replace(temporary, path)
+    size = os.path.getsize(path)
+    print(
+        f"wrote {path}: {size / 1e6:.1f} MB in {time.perf_counter() - start:.2f}s",
+        file=out,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m src.snapshot")
+    commands = parser.add_subparsers(dest="command", required=True)
+    write_parser = commands.add_parser(
+        "write", help="write the database's tables to a snapshot file"
+    )
+    write_parser.add_argument("path")
+    source = write_parser.add_mutually_exclusive_group()
+    source.add_argument(
+        "--url", help="SQLAlchemy database url (default: the app's database)"
+    )
+    source.add_argument("--sqlite", help="path of a local SQLite file")
+    info_parser = commands.add_parser("info", help="describe a snapshot file")
+    info_parser.add_argument("path")
+    args = parser.parse_args(argv)
+
+    if args.command == "info":
+        snapshot = read(args.path)
+        print(f"data version {snapshot.data_version} ({snapshot.data_epoch})")
+        for table in snapshot.tables.values():
+            kinds = ", ".join(f"{n} {c.kind}" for n, c in table.columns.items())
+            print(f"{table.name}: {len(table)} rows ({kinds})")
+        return
+
+    if args.sqlite:
+        url = f"sqlite:///{args.sqlite}"
+    else:
+        url = args.url or db.database_connection_url()
+    write(sqlalchemy.create_engine(url), args.path)
+
+
+if __name__ == "__main__":
+    main()
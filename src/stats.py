@@ -0,0 +1,289 @@
+"""
+Dialogue statistics from columnar NumPy arrays.
+
+The columns hold one entry per line: its movie, speaker, conversation, the
+speaker's gender and its number of words, sorted by movie so that a movie's
+lines are one contiguous slice. They are built the first time they're
+needed, from the in-memory corpus or from one pass over ``lines`` and
+``characters``, like the indexes of ``src.search``. Every statistic is then
+a vectorized group-by (``np.unique``, ``np.bincount``) over the whole
+columns or one movie's slice, with no SQL per request.
+
+Lines added later, in any worker, are buffered by ``src.versions`` and
+merged into the columns by the next request that reads them.
+"""
+import asyncio
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Upper bounds of the conversation length histogram, in lines.
+LENGTH_BINS = (1, 2, 3, 4, 5, 10, 20)
+
+UNKNOWN_GENDER = "unknown"
+
+
+def word_count(text: Optional[str]) -> int:
+    return len(text.split()) if text else 0
+
+
+def _gender(value: Optional[str]) -> str:
+    value = (value or "").strip().upper()
+    return value if value and value != "?" else UNKNOWN_GENDER
+
+
+def _summary(values: np.ndarray) -> dict:
+    if not len(values):
+        return {"count": 0, "mean": 0.0, "median": 0.0, "p90": 0.0, "max": 0}
+    return {
+        "count": int(len(values)),
+        "mean": round(float(values.mean()), 3),
+        "median": float(np.median(values)),
+        "p90": float(np.percentile(values, 90)),
+        "max": int(values.max()),
+    }
+
+
+def _histogram(lengths: np.ndarray) -> Dict[str, int]:
+    edges = np.array(LENGTH_BINS)
+    counts = np.bincount(
+        np.searchsorted(edges, lengths, side="left"), minlength=len(edges) + 1
+    )
+    labels = []
+    low = 1
+    for high in LENGTH_BINS:
+        labels.append(str(high) if high == low else f"{low}-{high}")
+        low = high + 1
+    labels.append(f"{low}+")
+    return {label: int(count) for label, count in zip(labels, counts)}
+
+
+class Columns:
+    def __init__(
+        self,
+        titles: Dict[int, Optional[str]],
+        genders: Dict[int, Optional[str]],
+        lines,
+    ):
+        """
+        ``titles`` and ``genders`` map movie and character ids to their title
+        and gender; ``lines`` are ``(character_id, movie_id, conversation_id,
+        line_text)``.
+        """
+        self.lock = threading.Lock()
+        self.titles = titles
+        self.genders = {id: _gender(g) for id, g in genders.items()}
+        self.gender_labels: List[str] = sorted(set(self.genders.values()))
+        if UNKNOWN_GENDER not in self.gender_labels:
+            self.gender_labels.append(UNKNOWN_GENDER)
+        self.pending: List[tuple] = []
+        self._set(self._encode(lines))
+        # The data version the columns reflect; see src.versions.
+        self.version = 0
+
+    def _encode(self, lines) -> Dict[str, np.ndarray]:
+        code = {label: i for i, label in enumerate(self.gender_labels)}
+        unknown = code[UNKNOWN_GENDER]
+        # Missing ids become -1, which no row uses.
+        rows = [
+            (
+                -1 if character_id is None else character_id,
+                -1 if movie_id is None else movie_id,
+                -1 if conversation_id is None else conversation_id,
+                code.get(self.genders.get(character_id), unknown),
+                word_count(text),
+            )
+            for character_id, movie_id, conversation_id, text in lines
+        ]
+        table = np.array(rows, dtype=np.int64).reshape(-1, 5)
+        return {
+            "character": table[:, 0],
+            "movie": table[:, 1],
+            "conversation": table[:, 2],
+            "gender": table[:, 3].astype(np.int8),
+            "words": table[:, 4].astype(np.int32),
+        }
+
+    def _set(self, columns: Dict[str, np.ndarray]):
+        order = np.argsort(columns["movie"], kind="stable")
+        self.character = columns["character"][order]
+        self.movie = columns["movie"][order]
+        self.conversation = columns["conversation"][order]
+        self.gender = columns["gender"][order]
+        self.words = columns["words"][order]
+        self.movie_ids, self.starts = np.unique(self.movie, return_index=True)
+
+    def add_lines(self, lines):
+        """Buffers ``(character_id, movie_id, conversation_id, line_text)``."""
+        with self.lock:
+            self.pending.extend(lines)
+
+    def apply(self, conversation_rows: List[dict], line_rows: List[dict]):
+        """Adds the rows ``versions.changes`` returns."""
+        self.add_lines(
+            (
+                row["character_id"],
+                row["movie_id"],
+                row["conversation_id"],
+                row["line_text"],
+            )
+            for row in line_rows
+        )
+
+    def _flush(self):
+        """Merges the buffered lines into the columns. Needs ``lock``."""
+        if not self.pending:
+            return
+        new = self._encode(self.pending)
+        self.pending = []
+        self._set(
+            {
+                "character": np.concatenate([self.character, new["character"]]),
+                "movie": np.concatenate([self.movie, new["movie"]]),
+                "conversation": np.concatenate(
+                    [self.conversation, new["conversation"]]
+                ),
+                "gender": np.concatenate([self.gender, new["gender"]]),
+                "words": np.concatenate([self.words, new["words"]]),
+            }
+        )
+
+    def _slice(self, movie_id: int) -> slice:
+        i = np.searchsorted(self.movie_ids, movie_id)
+        if i == len(self.movie_ids) or self.movie_ids[i] != movie_id:
+            return slice(0, 0)
+        end = self.starts[i + 1] if i + 1 < len(self.starts) else len(self.movie)
+        return slice(int(self.starts[i]), int(end))
+
+    def _stats(self, s: slice) -> dict:
+        character = self.character[s]
+        gender = self.gender[s]
+        words = self.words[s]
+        _, lines_per_character = np.unique(character, return_counts=True)
+        conversation = self.conversation[s]
+        _, conversation_lengths = np.unique(
+            conversation[conversation >= 0], return_counts=True
+        )
+
+        n = len(self.gender_labels)
+        line_share = np.bincount(gender, minlength=n) / max(len(gender), 1)
+        word_share = np.bincount(gender, weights=words, minlength=n) / max(
+            int(words.sum()), 1
+        )
+        return {
+            "lines": int(len(character)),
+            "words": int(words.sum()),
+            "lines_per_character": _summary(lines_per_character),
+            "gender_share": {
+                label: {
+                    "lines": round(float(line_share[i]), 4),
+                    "words": round(float(word_share[i]), 4),
+                }
+                for i, label in enumerate(self.gender_labels)
+            },
+            "conversation_length": dict(
+                _summary(conversation_lengths),
+                histogram=_histogram(conversation_lengths),
+            ),
+            "words_per_line": _summary(words),
+        }
+
+    def movie_stats(self, movie_id: int) -> Optional[dict]:
+        """Statistics of one movie's dialogue, or None if it doesn't exist."""
+        if movie_id not in self.titles:
+            return None
+        with self.lock:
+            self._flush()
+            return dict(
+                {"movie_id": movie_id, "title": self.titles[movie_id]},
+                **self._stats(self._slice(movie_id)),
+            )
+
+    def corpus_stats(self) -> dict:
+        """Statistics of the dialogue of every movie together."""
+        with self.lock:
+            self._flush()
+            return dict(
+                {"movies": len(self.titles)}, **self._stats(slice(0, len(self.movie)))
+            )
+
+
+def build_columns() -> Columns:
+    from src import memory
+    from src import versions
+
+    corpus = memory.get_corpus()
+    if corpus is not None:
+        version, columns = versions.build_from(
+            corpus,
+            lambda: Columns(
+                {m.id: m.title for m in corpus.movies.values()},
+                {c.id: c.gender for c in corpus.characters.values()},
+                (
+                    (line.c_id, line.movie_id, line.conv_id, line.line_text)
+                    for line in corpus.lines.values()
+                ),
+            ),
+        )
+        columns.version = version
+        return columns
+
+    import sqlalchemy
+    from src import database as db
+
+    def load():
+        with db.engine.connect() as conn:
+            titles = dict(
+                conn.execute(
+                    sqlalchemy.select(db.movies.c.movie_id, db.movies.c.title)
+                ).all()
+            )
+            genders = dict(
+                conn.execute(
+                    sqlalchemy.select(
+                        db.characters.c.character_id, db.characters.c.gender
+                    )
+                ).all()
+            )
+            rows = conn.execution_options(
+                stream_results=True, yield_per=10000
+            ).execute(
+                sqlalchemy.select(
+                    db.lines.c.character_id,
+                    db.lines.c.movie_id,
+                    db.lines.c.conversation_id,
+                    db.lines.c.line_text,
+                )
+            )
+            return Columns(titles, genders, rows)
+
+    version, columns = versions.build(load)
+    columns.version = version
+    return columns
+
+
+_columns: Optional[Columns] = None
+_columns_lock = threading.Lock()
+
+
+def get_columns() -> Columns:
+    """Returns the shared columns, building them on first use."""
+    global _columns
+    if _columns is None:
+        with _columns_lock:
+            if _columns is None:
+                _columns = build_columns()
+    return _columns
+
+
+async def get_columns_async() -> Columns:
+    """``get_columns`` for async handlers; the build runs in a thread."""
+    if _columns is not None:
+        return _columns
+    return await asyncio.to_thread(get_columns)
+
+
+def loaded_columns() -> Optional[Columns]:
+    """The shared columns if they have been built, without building them."""
+    return _columns
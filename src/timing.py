@@ -0,0 +1,311 @@
+"""
+Per-request phase timings, SQL instrumentation and Prometheus metrics.
+
+Every request is split into phases:
+
+* ``pool``: waiting for a database connection (see ``src.pool``).
+* ``db``: executing SQL, from the cursor's point of view.
+* ``app``: the rest of the route function, mostly turning rows into dicts.
+* ``serialize``: the rest of the request, which is mostly validating the
+  return value and encoding it as JSON.
+
+Pool and database time outside the route function, e.g. in middleware, only
+counts towards ``pool`` and ``db``, so the phases add up to the total.
+
+``TimingMiddleware`` sends them, with the number of queries, as a
+``Server-Timing`` header, which browsers' dev tools show next to the request,
+and adds them to per-route histograms that ``/metrics`` exposes in the
+Prometheus text format. Routes are only timed if their router uses
+``TimedRoute``.
+
+Any statement slower than ``SLOW_QUERY_MS`` (default 500, 0 disables it) is
+logged at WARNING on the ``src.timing`` logger with its parameters.
+"""
+import contextvars
+import functools
+import inspect
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, Optional, Tuple
+
+import sqlalchemy
+from fastapi.routing import APIRoute
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "500"))
+
+PHASES = ("pool", "db", "app", "serialize")
+
+# Upper bounds, in seconds, of the histograms.
+BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    float("inf"),
+)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, float("inf"))
+
+
+class Timings:
+    """What one request has spent so far."""
+
+    def __init__(self):
+        self.route: Optional[str] = None
+        self.phases: Dict[str, float] = defaultdict(float)
+        self.queries = 0
+        # The part of ``waited()`` spent inside the route function.
+        self.handler_waited = 0.0
+
+    def waited(self) -> float:
+        """Time spent so far on getting connections and executing SQL."""
+        return self.phases.get("pool", 0.0) + self.phases.get("db", 0.0)
+
+
+_current: contextvars.ContextVar[Optional[Timings]] = contextvars.ContextVar(
+    "timings", default=None
+)
+
+
+def record(phase: str, seconds: float):
+    """Adds ``seconds`` to ``phase`` of the current request, if there is one."""
+    timings = _current.get()
+    if timings is not None:
+        timings.phases[phase] += seconds
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._timing_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - context._timing_start
+    timings = _current.get()
+    if timings is not None:
+        timings.phases["db"] += seconds
+        timings.queries += 1
+    if SLOW_QUERY_MS and seconds * 1000 >= SLOW_QUERY_MS:
+        logger.warning(
+            "slow query (%.1f ms): %s; parameters: %.1000r",
+            seconds * 1000,
+            " ".join(statement.split()),
+            parameters,
+        )
+
+
+# Registered on the class so it covers every engine, including the sync
+# engine underneath the AsyncEngine.
+sqlalchemy.event.listen(
+    sqlalchemy.engine.Engine, "before_cursor_execute", _before_cursor_execute
+)
+sqlalchemy.event.listen(
+    sqlalchemy.engine.Engine, "after_cursor_execute", _after_cursor_execute
+)
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        # Keyed by (method, route), and for phases also by phase.
+        self.durations: Dict[Tuple[str, str], _Histogram] = {}
+        self.phases: Dict[Tuple[str, str, str], _Histogram] = {}
+        self.queries: Dict[Tuple[str, str], _Histogram] = {}
+        self.responses: Dict[Tuple[str, str, str], int] = defaultdict(int)
+
+    def observe(self, method: str, status: int, total: float, timings: Timings):
+        key = (method, timings.route or "unmatched")
+        with self.lock:
+            self.durations.setdefault(key, _Histogram(BUCKETS)).observe(total)
+            for phase, seconds in timings.phases.items():
+                self.phases.setdefault(key + (phase,), _Histogram(BUCKETS)).observe(
+                    seconds
+                )
+            self.queries.setdefault(key, _Histogram(QUERY_BUCKETS)).observe(
+                timings.queries
+            )
+            self.responses[key + (str(status),)] += 1
+
+    def render(self) -> str:
+        """The metrics in the Prometheus text exposition format."""
+        out = []
+        with self.lock:
+            _render_histograms(
+                out,
+                "movie_api_request_duration_seconds",
+                "Time until the response headers were sent.",
+                ("method", "route"),
+                self.durations,
+            )
+            _render_histograms(
+                out,
+                "movie_api_request_phase_seconds",
+                "Time spent per request in each phase.",
+                ("method", "route", "phase"),
+                self.phases,
+            )
+            _render_histograms(
+                out,
+                "movie_api_request_queries",
+                "SQL statements executed per request.",
+                ("method", "route"),
+                self.queries,
+            )
+            out.append("# HELP movie_api_responses_total Responses sent.")
+            out.append("# TYPE movie_api_responses_total counter")
+            for key, count in sorted(self.responses.items()):
+                labels = _labels(("method", "route", "status"), key)
+                out.append(f"movie_api_responses_total{{{labels}}} {count}")
+        return "\n".join(out) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values) -> str:
+    return ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+
+
+def _bound(bound: float) -> str:
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+
+def _render_histograms(out, name, help, label_names, histograms):
+    out.append(f"# HELP {name} {help}")
+    out.append(f"# TYPE {name} histogram")
+    for key, histogram in sorted(histograms.items()):
+        labels = _labels(label_names, key)
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            out.append(f'{name}_bucket{{{labels},le="{_bound(bound)}"}} {cumulative}')
+        out.append(f"{name}_sum{{{labels}}} {histogram.sum!r}")
+        out.append(f"{name}_count{{{labels}}} {cumulative}")
+
+
+metrics = Metrics()
+
+
+def server_timing(timings: Timings, total: float) -> str:
+    entries = [
+        f"{phase};dur={timings.phases[phase] * 1000:.3f}"
+        for phase in PHASES
+        if phase in timings.phases
+    ]
+    entries.append(f'queries;desc="{timings.queries}"')
+    entries.append(f"total;dur={total * 1000:.3f}")
+    return ", ".join(entries)
+
+
+class TimedRoute(APIRoute):
+    """
+    An APIRoute that times its route function and labels the request with
+    the route's path template, e.g. ``/movies/{movie_id}``.
+    """
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        route = path
+
+        if getattr(endpoint, "_timed", False):
+            # include_router copies routes, passing the already timed function.
+            timed = endpoint
+        elif inspect.iscoroutinefunction(endpoint):
+
+            @functools.wraps(endpoint)
+            async def timed(*args, **kw):
+                timings = _current.get()
+                if timings is None:
+                    return await endpoint(*args, **kw)
+                timings.route = route
+                start = time.perf_counter()
+                waited = timings.waited()
+                try:
+                    return await endpoint(*args, **kw)
+                finally:
+                    timings.phases["handler"] += time.perf_counter() - start
+                    timings.handler_waited += timings.waited() - waited
+
+        else:
+
+            @functools.wraps(endpoint)
+            def timed(*args, **kw):
+                timings = _current.get()
+                if timings is None:
+                    return endpoint(*args, **kw)
+                timings.route = route
+                start = time.perf_counter()
+                waited = timings.waited()
+                try:
+                    return endpoint(*args, **kw)
+                finally:
+                    timings.phases["handler"] += time.perf_counter() - start
+                    timings.handler_waited += timings.waited() - waited
+
+        timed._timed = True
+        super().__init__(path, timed, **kwargs)
+
+
+class TimingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = Timings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+
+        async def send_timed(message):
+            if message["type"] == "http.response.start":
+                total = time.perf_counter() - start
+                phases = timings.phases
+                handler = phases.pop("handler", None)
+                if handler is not None:
+                    inside = timings.handler_waited
+                    outside = timings.waited() - inside
+                    phases["app"] = max(0.0, handler - inside)
+                    phases["serialize"] = max(0.0, total - handler - outside)
+                header = server_timing(timings, total)
+                message = dict(
+                    message,
+                    headers=list(message.get("headers", []))
+                    + [(b"server-timing", header.encode())],
+                )
+                metrics.observe(scope["method"], message["status"], total, timings)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            _current.reset(token)
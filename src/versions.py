@@ -0,0 +1,358 @@
+"""
+The data version every worker shares.
+
+Each worker process keeps its own response cache and, once they're used, its
+own in-process copies of the data. A write lands in one worker, so the others
+need a way to notice it. That is one row in ``data_versions``: every
+transaction that adds conversations bumps its version and logs the ids it
+added, under the new version, in ``conversation_versions``. Postgres holds the
+row's lock until the transaction commits (SQLite locks the whole database),
+so versions commit in order. A worker that has seen version ``v`` therefore
+finds every conversation committed after an older version in the log.
+
+``refresh`` brings this worker up to date: it drops the cached responses that
+the conversations added since it last looked change, by this worker or any
+other, and applies them to each copy of the data registered with ``track``.
+
+Reads don't query the version themselves. Once ``latest`` is first
+called, a background thread checks it every ``DATA_VERSION_POLL_INTERVAL``
+seconds (default 0.2) and refreshes when it has moved, and ``latest``
+hands out the version it last checked. ``src.etags`` tags responses with it,
+so another worker's write changes this worker's ETags within one interval,
+and the worker that wrote it changes its own at once. If the thread falls
+behind, e.g. while the process was frozen, the request checks the version
+itself.
+
+The version row has a random epoch, set when the row is created, which is
+part of every ETag: a rebuilt database starts counting again, but never hands
+out the tags of the old one.
+"""
+import asyncio
+import logging
+import os
+import secrets
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import sqlalchemy
+
+from src import cache
+from src import database as db
+from src import graph
+from src import memory
+from src import search
+from src import stats
+
+logger = logging.getLogger(__name__)
+
+NAME = "data"
+
+POLL_INTERVAL = float(os.environ.get("DATA_VERSION_POLL_INTERVAL", "0.2"))
+# How old the last check may get before a request checks for itself.
+STALE_AFTER = max(1.0, 10 * POLL_INTERVAL)
+
+_ready = set()
+_ready_lock = threading.Lock()
+
+_state = sqlalchemy.select(
+    db.data_versions.c.epoch, db.data_versions.c.version
+).where(db.data_versions.c.name == NAME)
+
+
+def seed(conn):
+    """Adds the version row with a new epoch, unless it's there already."""
+    conn.execute(
+        db.upsert(conn, db.data_versions)
+        .values(name=NAME, epoch=secrets.token_hex(4), version=0)
+        .on_conflict_do_nothing()
+    )
+
+
+def ensure(engine=None):
+    """Creates and seeds the version tables once per engine, if not yet done."""
+    engine = engine or db.engine
+    if engine in _ready:
+        return
+    with _ready_lock:
+        if engine in _ready:
+            return
+        with engine.begin() as conn:
+            db.metadata_obj.create_all(
+                conn, tables=[db.data_versions, db.conversation_versions]
+            )
+            seed(conn)
+        _ready.add(engine)
+
+
+async def ensure_async():
+    """``ensure`` for async handlers, off the event loop the one time it works."""
+    if db.engine not in _ready:
+        await asyncio.to_thread(ensure)
+
+
+def _row(row) -> Tuple[str, int]:
+    return (row.epoch, row.version) if row is not None else ("", 0)
+
+
+def state(conn) -> Tuple[str, int]:
+    """The epoch and the current version."""
+    return _row(conn.execute(_state).first())
+
+
+def current(engine=None) -> int:
+    ensure(engine)
+    with (engine or db.engine).connect() as conn:
+        return state(conn)[1]
+
+
+def record(conn, conversation_ids) -> int:
+    """
+    Bumps the version and logs ``conversation_ids`` under it, on the caller's
+    connection so that both commit with the conversations themselves. Holds
+    the version row until then, so it should come last in the transaction.
+    ``ensure`` must have been called before that transaction began.
+    """
+    table = db.data_versions
+    stmt = db.upsert(conn, table).values(
+        name=NAME, epoch=secrets.token_hex(4), version=1
+    )
+    version = conn.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[table.c.name], set_={"version": table.c.version + 1}
+        ).returning(table.c.version)
+    ).scalar_one()
+    conn.execute(
+        db.conversation_versions.insert(),
+        [{"version": version, "conversation_id": id} for id in conversation_ids],
+    )
+    return version
+
+
+def changes(conn, since: int) -> Tuple[int, List[dict], List[dict]]:
+    """
+    The last version logged and the ``conversations`` and ``lines`` rows of
+    the conversations added after version ``since``, as dicts that also hold
+    the ``version`` they were added at.
+    """
+    log = db.conversation_versions.c
+    added = dict(
+        conn.execute(
+            sqlalchemy.select(log.conversation_id, log.version)
+            .where(log.version > since)
+            .order_by(log.version, log.conversation_id)
+        ).all()
+    )
+    conversation_rows: List[dict] = []
+    line_rows: List[dict] = []
+    ids = list(added)
+    for i in range(0, len(ids), 1000):
+        chunk = ids[i : i + 1000]
+        rows = conn.execute(
+            sqlalchemy.select(db.conversations).where(
+                db.conversations.c.conversation_id.in_(chunk)
+            )
+        )
+        conversation_rows += [
+            dict(row._mapping, version=added[row.conversation_id]) for row in rows
+        ]
+        rows = conn.execute(
+            sqlalchemy.select(db.lines)
+            .where(db.lines.c.conversation_id.in_(chunk))
+            .order_by(db.lines.c.line_id)
+        )
+        line_rows += [
+            dict(row._mapping, version=added[row.conversation_id]) for row in rows
+        ]
+    conversation_rows.sort(key=lambda row: (row["version"], row["conversation_id"]))
+    return max(added.values(), default=since), conversation_rows, line_rows
+
+
+def build(make: Callable, engine=None):
+    """
+    Calls ``make()``, which reads the data, again until no conversations are
+    committed while it runs. Returns the version its result reflects and the
+    result.
+    """
+    while True:
+        before = current(engine)
+        result = make()
+        if current(engine) == before:
+            return before, result
+
+
+_refresh_lock = threading.Lock()
+
+
+def build_from(copy, make: Callable):
+    """
+    Calls ``make()``, which reads the tracked ``copy``, while ``refresh``
+    can't change it. Returns the version of ``copy`` and the result.
+    """
+    with _refresh_lock:
+        return copy.version, make()
+
+
+# Functions returning an in-process copy of the data, or None if it hasn't
+# been built.
+_tracked: List[Callable] = [
+    memory.loaded_corpus,
+    search.loaded_index,
+    graph.loaded_graph,
+    stats.loaded_columns,
+]
+# The version up to which this worker has dropped changed cached responses.
+_seen: Optional[int] = None
+
+
+def track(loaded: Callable):
+    """
+    Keeps the copy of the data that ``loaded()`` returns up to date. The copy
+    has the ``version`` it reflects and an ``apply(conversations, lines)``
+    method that adds rows as ``changes`` returns them.
+    """
+    _tracked.append(loaded)
+
+
+def _copies() -> list:
+    return [copy for copy in (loaded() for loaded in _tracked) if copy is not None]
+
+
+def behind(version: int) -> bool:
+    """Whether this worker hasn't caught up with ``version`` yet."""
+    return _seen is None or _seen < version or any(
+        copy.version < version for copy in _copies()
+    )
+
+
+def _invalidate(conversation_rows: List[dict], line_rows: List[dict]):
+    # New lines change the top characters of their movie and the top
+    # conversations of the characters involved.
+    cache.invalidate(
+        "movie",
+        {row["movie_id"] for row in conversation_rows}
+        | {row["movie_id"] for row in line_rows},
+    )
+    cache.invalidate(
+        "character",
+        {row["character1_id"] for row in conversation_rows}
+        | {row["character2_id"] for row in conversation_rows}
+        | {row["character_id"] for row in line_rows},
+    )
+    cache.invalidate(
+        "conversation", {row["conversation_id"] for row in conversation_rows}
+    )
+    cache.invalidate("line", {row["line_id"] for row in line_rows})
+
+
+def refresh(version: Optional[int] = None):
+    """
+    Catches this worker up with the conversations committed since it last
+    looked, or up to at least ``version`` if the caller has just read it.
+    A version it reads itself, as after this worker's own writes, is handed
+    out by ``latest`` straight away.
+    """
+    global _seen
+    checked = None
+    with _refresh_lock:
+        with db.engine.connect() as conn:
+            if version is None:
+                checked = state(conn)
+                version = checked[1]
+            if _seen is None:
+                # Nothing was cached before the first look.
+                _seen = version
+            copies = [copy for copy in _copies() if copy.version < version]
+            since = min([_seen] + [copy.version for copy in copies])
+            if since >= version:
+                _publish(checked)
+                return
+            latest, conversation_rows, line_rows = changes(conn, since)
+
+        for copy in copies:
+            copy.apply(
+                [row for row in conversation_rows if row["version"] > copy.version],
+                [row for row in line_rows if row["version"] > copy.version],
+            )
+            copy.version = max(copy.version, latest)
+        _invalidate(
+            [row for row in conversation_rows if row["version"] > _seen],
+            [row for row in line_rows if row["version"] > _seen],
+        )
+        _seen = max(_seen, latest)
+    _publish(checked)
+
+
+# The epoch and version ``latest`` hands out, by engine, with when they
+# were checked. Only engines it has been asked about are polled.
+_latest: Dict[Any, Tuple[float, Tuple[str, int]]] = {}
+_latest_lock = threading.Lock()
+_poller: Optional[threading.Thread] = None
+
+
+def _publish(checked: Optional[Tuple[str, int]]):
+    """Hands out ``checked``, once this worker has caught up with it."""
+    engine = db.engine
+    if checked is None or engine not in _latest:
+        return
+    with _latest_lock:
+        _, (epoch, version) = _latest.get(engine, (0.0, ("", -1)))
+        if checked[0] != epoch or checked[1] >= version:
+            _latest[engine] = (time.monotonic(), checked)
+
+
+def check() -> Tuple[str, int]:
+    """Reads the epoch and version and catches this worker up with them."""
+    ensure()
+    with db.engine.connect() as conn:
+        checked = state(conn)
+    with _latest_lock:
+        _latest.setdefault(db.engine, (0.0, ("", -1)))
+    if behind(checked[1]):
+        refresh(checked[1])
+    _publish(checked)
+    return checked
+
+
+def _poll():
+    while True:
+        time.sleep(POLL_INTERVAL)
+        if db.engine not in _latest:
+            continue
+        try:
+            check()
+        except Exception:
+            logger.warning("checking the data version failed", exc_info=True)
+
+
+def _start_polling():
+    global _poller
+    if _poller is not None:
+        return
+    with _latest_lock:
+        if _poller is None:
+            _poller = threading.Thread(
+                target=_poll, name="data-version-poll", daemon=True
+            )
+            _poller.start()
+
+
+def _checked() -> Optional[Tuple[str, int]]:
+    _start_polling()
+    entry = _latest.get(db.engine)
+    if entry is None or time.monotonic() - entry[0] > STALE_AFTER:
+        return None
+    return entry[1]
+
+
+def latest() -> Tuple[str, int]:
+    """
+    The epoch and version this worker last checked and has caught up with,
+    without a query unless the background check has fallen behind.
+    """
+    return _checked() or check()
+
+
+async def latest_async() -> Tuple[str, int]:
+    """``latest`` for async code, checking in a thread if it has to."""
+    return _checked() or await asyncio.to_thread(check)
@@ -0,0 +1,23 @@
+from fastapi.testclient import TestClient
+
+from src.api.server import app
+
+
+def test_batch_matches_detail_endpoints():
+    client = TestClient(app)
+    for path, ids in [("/movies/", [269, 0, 999999]), ("/characters/", [0, 2, 999999])]:
+        response = client.get(f"{path}batch?ids={','.join(map(str, ids))}")
+        assert response.status_code == 200
+        json = response.json()
+        assert list(json) == [str(id) for id in ids]
+        assert json["999999"] is None
+        for id in ids[:2]:
+            assert json[str(id)] == client.get(f"{path}{id}").json()
+        assert client.post(f"{path}batch", json={"ids": ids}).json() == json
+
+
+def test_batch_rejects_bad_ids():
+    client = TestClient(app)
+    assert client.get("/lines/batch?ids=1,x").status_code == 400
+    too_many = ",".join(str(id) for id in range(251))
+    assert client.get(f"/lines/batch?ids={too_many}").status_code == 400
@@ -0,0 +1,83 @@
+import sqlalchemy
+
+from bench import corpus_memory, dataset, endpoints
+from src import database as db
+
+
+def test_scaled_copies_shift_ids_and_labels():
+    rows = {
+        "movies": [{"movie_id": 4, "title": "alien"}],
+        "characters": [{"character_id": 9, "name": "RIPLEY", "movie_id": 4}],
+        "conversations": [
+            {
+                "conversation_id": 2,
+                "character1_id": 9,
+                "character2_id": 9,
+                "movie_id": 4,
+            }
+        ],
+        "lines": [],
+    }
+    rows["lines"] = list(dataset.synthetic_lines(rows["conversations"]))
+    copies = {table: list(r) for table, r in dataset.scaled(rows, 3).items()}
+
+    assert [m["movie_id"] for m in copies["movies"]] == [4, 9, 14]
+    assert [m["title"] for m in copies["movies"]] == ["alien", "alien #1", "alien #2"]
+    assert copies["characters"][2] == {
+        "character_id": 29,
+        "name": "RIPLEY #2",
+        "movie_id": 14,
+    }
+    assert copies["conversations"][1]["character2_id"] == 19
+    line_ids = [line["line_id"] for line in copies["lines"]]
+    assert len(line_ids) == 3 * len(rows["lines"]) == len(set(line_ids))
+    assert {line["conversation_id"] for line in copies["lines"]} == {2, 5, 8}
+
+
+def test_summary_percentiles():
+    summary = endpoints.summarize([i / 1000 for i in range(1, 101)], 2, 0.5)
+    assert summary["requests"] == 100
+    assert summary["throughput"] == 200.0
+    assert summary["latency_ms"]["p50"] == 50.0
+    assert summary["latency_ms"]["p95"] == 95.0
+    assert summary["latency_ms"]["p99"] == 99.0
+    assert summary["errors"] == 2
+
+
+def test_slotted_records_are_smaller(tmp_path):
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'db.sqlite'}")
+    db.metadata_obj.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(db.movies.insert(), {"movie_id": 1000, "title": "alien"})
+        conn.execute(
+            db.characters.insert(),
+            [{"character_id": 1000 + i, "movie_id": 1000} for i in range(2)],
+        )
+        conn.execute(
+            db.conversations.insert(),
+            {
+                "conversation_id": 1000,
+                "character1_id": 1000,
+                "character2_id": 1001,
+                "movie_id": 1000,
+            },
+        )
+        conn.execute(
+            db.lines.insert(),
+            [
+                {
+                    "line_id": 1000 + i,
+                    "character_id": 1000 + i % 2,
+                    "movie_id": 1000,
+                    "conversation_id": 1000,
+                    "line_sort": i,
+                    "line_text": "hi",
+                }
+                for i in range(200)
+            ],
+        )
+    before = corpus_memory.measure(engine, corpus_memory.LAYOUTS["before"])
+    after = corpus_memory.measure(engine, corpus_memory.LAYOUTS["after"])
+    assert before["lines"]["rows"] == after["lines"]["rows"] == 200
+    for table in before:
+        assert after[table]["bytes_per_row"] < before[table]["bytes_per_row"]
@@ -0,0 +1,135 @@
+import json
+
+import pytest
+import sqlalchemy
+from fastapi.testclient import TestClient
+
+from src import database as db
+from src import versions
+from src.api import conversations
+from src.api.server import app
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'bulk.db'}")
+    db.metadata_obj.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(db.movies.insert(), [{"movie_id": 1}, {"movie_id": 2}])
+        conn.execute(
+            db.characters.insert(),
+            [
+                {"character_id": 10, "movie_id": 1},
+                {"character_id": 11, "movie_id": 1},
+                {"character_id": 20, "movie_id": 2},
+            ],
+        )
+    monkeypatch.setattr(db, "engine", engine)
+    # Keep the new rows out of the process's search index, graph and columns.
+    monkeypatch.setattr(versions, "_seen", None)
+    monkeypatch.setattr(versions, "_tracked", [])
+    return engine
+
+
+def record(movie_id=1, c1=10, c2=11, text="hi"):
+    return {
+        "movie_id": movie_id,
+        "character_1_id": c1,
+        "character_2_id": c2,
+        "lines": [{"character_id": c1, "line_text": text}],
+    }
+
+
+def stored(engine):
+    with engine.connect() as conn:
+        return conn.execute(
+            sqlalchemy.select(db.lines.c.conversation_id, db.lines.c.line_text)
+        ).all()
+
+
+def committed(engine):
+    """The number of conversations each data version added, in order."""
+    log = db.conversation_versions.c
+    with engine.connect() as conn:
+        return conn.execute(
+            sqlalchemy.select(sqlalchemy.func.count())
+            .select_from(db.conversation_versions)
+            .group_by(log.version)
+            .order_by(log.version)
+        ).scalars().all()
+
+
+def test_ndjson(engine):
+    body = "\n".join(
+        [
+            json.dumps(record(text="one")),
+            "{not json",
+            json.dumps(record(movie_id=2)),
+            json.dumps({"movie_id": 1}),
+            json.dumps(record(text="two")),
+        ]
+    )
+    response = client.post("/conversations/bulk", content=body)
+    assert response.status_code == 200
+    result = response.json()
+    assert [r["index"] for r in result["inserted"]] == [0, 4]
+    assert [e["index"] for e in result["errors"]] == [1, 2, 3]
+    assert result["errors"][0]["detail"].startswith("invalid json")
+    assert result["errors"][1]["detail"] == "character not in movie"
+    ids = {r["id"]: text for r, text in zip(result["inserted"], ["one", "two"])}
+    assert sorted(stored(engine)) == sorted(ids.items())
+
+
+def test_array_skips_a_malformed_element(engine):
+    body = (
+        f'[{json.dumps(record(text="one"))},'
+        ' {"movie_id": 1, "lines": [oops, "]"]},'
+        f' {json.dumps(record(text="two"))} trailing,'
+        f' {json.dumps(record(text="three, ]"))}]'
+    )
+
+    def chunks():
+        # Split mid-string, mid-escape and between tokens.
+        encoded = body.encode()
+        for i in range(0, len(encoded), 7):
+            yield encoded[i : i + 7]
+
+    result = client.post("/conversations/bulk", content=chunks()).json()
+    assert [r["index"] for r in result["inserted"]] == [0, 3]
+    assert [e["index"] for e in result["errors"]] == [1, 2]
+    assert all(e["detail"].startswith("invalid json") for e in result["errors"])
+    assert sorted(text for _, text in stored(engine)) == ["one", "three, ]"]
+
+
+def test_unterminated_array(engine):
+    body = f'[{json.dumps(record(text="one"))}, {json.dumps(record(text="two"))}'
+    result = client.post("/conversations/bulk", content=body).json()
+    assert [r["index"] for r in result["inserted"]] == [0, 1]
+    assert result["errors"] == [
+        {"index": 2, "detail": "invalid json: unterminated array"}
+    ]
+
+
+def test_data_after_the_array(engine):
+    body = f'[{json.dumps(record(text="one"))}] \n{json.dumps(record(text="two"))}'
+    result = client.post("/conversations/bulk", content=body).json()
+    assert [r["index"] for r in result["inserted"]] == [0]
+    assert result["errors"] == [
+        {"index": 1, "detail": "invalid json: data after the closing ]"}
+    ]
+    assert client.post("/conversations/bulk", content="[] \n").json() == {
+        "inserted": [],
+        "errors": [],
+    }
+
+
+def test_chunks_commit_separately(engine, monkeypatch):
+    monkeypatch.setattr(conversations, "BULK_CHUNK_SIZE", 2)
+    body = "\n".join(json.dumps(record(text=str(i))) for i in range(5))
+    result = client.post("/conversations/bulk", content=body).json()
+    assert [r["index"] for r in result["inserted"]] == [0, 1, 2, 3, 4]
+    assert len({r["id"] for r in result["inserted"]}) == 5
+    assert committed(engine) == [2, 2, 1]
+    assert len(stored(engine)) == 5
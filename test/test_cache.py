@@ -0,0 +1,105 @@
+from fastapi import HTTPException
+
+from src import cache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_local_cache_evicts_least_recently_used():
+    lru = cache.LocalCache(size=2, ttl=60)
+    lru.set("a", 1)
+    lru.set("b", 2)
+    assert lru.get("a") == 1
+    lru.set("c", 3)
+    assert lru.get("b") is None
+    assert (lru.get("a"), lru.get("c")) == (1, 3)
+    assert lru.evictions == 1
+
+
+def test_local_cache_expires_entries():
+    clock = Clock()
+    lru = cache.LocalCache(size=2, ttl=10, clock=clock)
+    lru.set("a", 1)
+    clock.now = 9.9
+    assert lru.get("a") == 1
+    clock.now = 10
+    assert lru.get("a") is None
+    assert len(lru) == 0
+
+
+def test_cached_route_hits_and_invalidation():
+    cache.set_backend(cache.LocalCache(size=10, ttl=60))
+    calls = []
+
+    @cache.cached("movie", "movie_id")
+    def get_movie(movie_id: int):
+        calls.append(movie_id)
+        if movie_id < 0:
+            raise HTTPException(status_code=404, detail="movie not found.")
+        return {"movie_id": movie_id, "calls": len(calls)}
+
+    assert get_movie(movie_id=1) == {"movie_id": 1, "calls": 1}
+    assert get_movie(movie_id=1) == {"movie_id": 1, "calls": 1}
+    cache.invalidate("movie", [1])
+    assert get_movie(movie_id=1) == {"movie_id": 1, "calls": 2}
+    for _ in range(2):
+        try:
+            get_movie(movie_id=-1)
+        except HTTPException:
+            pass
+    assert calls == [1, 1, -1, -1]
+    assert cache.stats()["routes"]["movie"] == {
+        "hits": 1,
+        "misses": 4,
+        "hit_rate": 0.2,
+        "invalidations": 1,
+    }
+
+
+def test_response_computed_during_a_write_is_not_stored():
+    cache.set_backend(cache.LocalCache(size=10, ttl=60))
+
+    @cache.cached("character", "id")
+    def get_character(id: int):
+        # A write lands while this response is being built.
+        cache.invalidate("character", [id])
+        return {"character_id": id}
+
+    get_character(id=7)
+    assert cache.backend().get(cache.key("character", 7)) is None
+
+
+class SharedCache(cache.LocalCache):
+    """Stands in for RedisCache, which every worker reads."""
+
+    shared = True
+
+
+def test_shared_cache_is_keyed_by_data_version(monkeypatch):
+    from src import versions
+
+    shared = SharedCache(size=10, ttl=60)
+    monkeypatch.setattr(cache, "_backend", shared)
+    state = ["e", 1]
+    data = ["old"]
+    monkeypatch.setattr(versions, "latest", lambda: tuple(state))
+
+    @cache.cached("character", "id")
+    def get_character(id: int):
+        return {"character_id": id, "data": data[0]}
+
+    # Built from the old data and stored after another worker's write
+    # deleted the key, which no one deletes again.
+    assert get_character(id=7)["data"] == "old"
+    data[0] = "new"
+    assert get_character(id=7)["data"] == "old"
+    # Once this worker catches up with the write it reads new entries.
+    state[1] = 2
+    assert get_character(id=7)["data"] == "new"
+    assert shared.get(cache.versioned(cache.key("character", 7), "e", 2))
@@ -1,3 +1,4 @@
+import pytest
 from fastapi.testclient import TestClient
 
 from src.api.server import app
@@ -7,6 +8,7 @@ import json
 client = TestClient(app)
 
 
+@pytest.mark.needs_lines
 def test_get_character():
     response = client.get("/characters/7421")
     assert response.status_code == 200
@@ -15,6 +17,7 @@ def test_get_character():
         assert response.json() == json.load(f)
 
 
+@pytest.mark.needs_lines
 def test_characters():
     response = client.get("/characters/")
     assert response.status_code == 200
@@ -23,6 +26,7 @@ def test_characters():
         assert response.json() == json.load(f)
 
 # New test case (includes multiple conversation partners)
+@pytest.mark.needs_lines
 def test_get_character2():
     response = client.get("/characters/2")
     assert response.status_code == 200
@@ -31,6 +35,7 @@ def test_get_character2():
         assert response.json() == json.load(f)
 
 
+@pytest.mark.needs_lines
 def test_sort_filter():
     response = client.get(
         "/characters/?name=amy&limit=50&offset=0&sort=number_of_lines"
@@ -44,6 +49,7 @@ def test_sort_filter():
         assert response.json() == json.load(f)
 
 # New test case ()
+@pytest.mark.needs_lines
 def test_sort_filter2():
     response = client.get(
         "/characters/?name=%20&limit=250&offset=42&sort=movie"
@@ -0,0 +1,149 @@
+import pytest
+import sqlalchemy
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from src import cache, counters, versions
+from src import database as db
+from src.api.server import app
+
+client = TestClient(app)
+
+
+def test_backfill_and_record_lines(tmp_path):
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'counts.db'}")
+    db.metadata_obj.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(
+            db.conversations.insert(),
+            [
+                {"conversation_id": 1, "character1_id": 10, "character2_id": 11},
+                {"conversation_id": 2, "character1_id": 11, "character2_id": 12},
+            ],
+        )
+        conn.execute(
+            db.lines.insert(),
+            [
+                {"line_id": 1, "character_id": 10, "conversation_id": 1},
+                {"line_id": 2, "character_id": 11, "conversation_id": 1},
+                {"line_id": 3, "character_id": 12, "conversation_id": 2},
+                {"line_id": 5, "character_id": None, "conversation_id": 2},
+                {"line_id": 6, "character_id": 10, "conversation_id": None},
+            ],
+        )
+        counters.backfill(conn)
+
+        conversation = {"conversation_id": 3, "character1_id": 12, "character2_id": 10}
+        lines = [{"line_id": 4, "character_id": 12, "conversation_id": 3}]
+        conn.execute(db.conversations.insert(), [conversation])
+        conn.execute(db.lines.insert(), lines)
+        counters.record_lines(conn, lines, [conversation])
+
+        pairs = db.character_pair_lines
+        assert sorted(conn.execute(sqlalchemy.select(pairs)).all()) == [
+            (10, 11, 2),
+            (10, 12, 1),
+            (11, 10, 2),
+            (11, 12, 2),
+            (12, 10, 1),
+            (12, 11, 2),
+        ]
+        assert sorted(
+            conn.execute(sqlalchemy.select(db.character_line_counts)).all()
+        ) == [(10, 2), (11, 1), (12, 2)]
+        assert sorted(
+            conn.execute(sqlalchemy.select(db.conversation_line_counts)).all()
+        ) == [(1, 2), (2, 2), (3, 1)]
+
+
+@pytest.fixture
+def movie(tmp_path, monkeypatch):
+    """
+    Movie 1, where AMY has two lines, BOB one and CAT none, with its counts
+    backfilled and the app reading from it.
+    """
+    path = tmp_path / "movie.db"
+    engine = sqlalchemy.create_engine(f"sqlite:///{path}")
+    db.metadata_obj.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(db.movies.insert(), [{"movie_id": 1, "title": "alpha"}])
+        conn.execute(
+            db.characters.insert(),
+            [
+                {"character_id": id, "name": name, "movie_id": 1}
+                for id, name in [(10, "AMY"), (11, "BOB"), (12, "CAT")]
+            ],
+        )
+        conn.execute(
+            db.conversations.insert(),
+            [{"conversation_id": 1, "character1_id": 10, "character2_id": 11}],
+        )
+        conn.execute(
+            db.lines.insert(),
+            [
+                {"line_id": id, "character_id": c, "movie_id": 1, "conversation_id": 1}
+                for id, c in [(1, 10), (2, 11), (3, 10)]
+            ],
+        )
+        counters.backfill(conn)
+    monkeypatch.setattr(db, "engine", engine)
+    monkeypatch.setattr(
+        db, "async_engine", create_async_engine(f"sqlite+aiosqlite:///{path}")
+    )
+    monkeypatch.setattr(counters, "_ready", True)
+    # Keep the new rows out of the process's search index, graph and columns.
+    monkeypatch.setattr(versions, "_seen", None)
+    monkeypatch.setattr(versions, "_tracked", [])
+    return engine
+
+
+def get(url):
+    cache.backend().clear()
+    response = client.get(url)
+    assert response.status_code == 200
+    return response.json()
+
+
+def line_counts():
+    return [
+        (c["character_id"], c["number_of_lines"])
+        for c in get("/characters/?sort=number_of_lines")
+    ]
+
+
+def test_reads_use_the_backfilled_counts(movie):
+    assert line_counts() == [(10, 2), (11, 1)]
+    assert [c["num_lines"] for c in get("/movies/1")["top_characters"]] == [2, 1]
+
+
+def test_new_conversations_update_the_counts(movie):
+    response = client.post(
+        "/movies/1/conversations/",
+        json={
+            "character_1_id": 11,
+            "character_2_id": 12,
+            "lines": [
+                {"character_id": 12, "line_text": "a"},
+                {"character_id": 11, "line_text": "b"},
+                {"character_id": 12, "line_text": "c"},
+                {"character_id": 12, "line_text": "d"},
+            ],
+        },
+    )
+    assert response.status_code == 200
+    assert line_counts() == [(12, 3), (10, 2), (11, 2)]
+    assert [c["character_id"] for c in get("/movies/1")["top_characters"]] == [
+        12,
+        10,
+        11,
+    ]
+    with movie.connect() as conn:
+        # The same as aggregating the lines again.
+        for table, key in [
+            (db.character_line_counts, db.lines.c.character_id),
+            (db.conversation_line_counts, db.lines.c.conversation_id),
+        ]:
+            grouped = sqlalchemy.select(key, sqlalchemy.func.count()).group_by(key)
+            assert sorted(conn.execute(sqlalchemy.select(table)).all()) == sorted(
+                conn.execute(grouped).all()
+            )
@@ -0,0 +1,138 @@
+import time
+
+import pytest
+import sqlalchemy
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from src import cache
+from src import database as db
+from src import etags, versions
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    path = tmp_path / "etags.db"
+    engine = sqlalchemy.create_engine(f"sqlite:///{path}")
+    db.metadata_obj.create_all(engine)
+    with engine.begin() as conn:
+        versions.seed(conn)
+    monkeypatch.setattr(db, "engine", engine)
+    monkeypatch.setattr(
+        db, "async_engine", create_async_engine(f"sqlite+aiosqlite:///{path}")
+    )
+    monkeypatch.setattr(versions, "_seen", None)
+    monkeypatch.setattr(versions, "_tracked", [])
+    monkeypatch.setattr(versions, "_latest", {})
+    return engine
+
+
+def add_conversation(engine, conversation_id):
+    """Commits a conversation to movie 1, as another worker would."""
+    with engine.begin() as conn:
+        conn.execute(
+            db.conversations.insert(),
+            [
+                {
+                    "conversation_id": conversation_id,
+                    "character1_id": 1,
+                    "character2_id": 2,
+                    "movie_id": 1,
+                }
+            ],
+        )
+        conn.execute(
+            db.lines.insert(),
+            [
+                {
+                    "line_id": conversation_id * 10,
+                    "character_id": 1,
+                    "movie_id": 1,
+                    "conversation_id": conversation_id,
+                }
+            ],
+        )
+        versions.record(conn, [conversation_id])
+
+
+def make_client():
+    calls = []
+    app = FastAPI()
+    app.add_middleware(etags.ConditionalGetMiddleware)
+
+    @app.get("/movies/{movie_id}")
+    def get_movie(movie_id: int):
+        calls.append(movie_id)
+        if movie_id < 0:
+            raise HTTPException(status_code=404, detail="movie not found.")
+        return {"movie_id": movie_id}
+
+    @app.get("/cache/")
+    def get_cache_stats():
+        return {}
+
+    return TestClient(app), calls
+
+
+def test_if_none_match_skips_the_handler(engine):
+    client, calls = make_client()
+    first = client.get("/movies/1")
+    tag = first.headers["etag"]
+    assert first.headers["cache-control"] == etags.CACHE_CONTROL
+    with engine.connect() as conn:
+        assert tag == etags.etag(etags.version(*versions.state(conn)))
+
+    again = client.get("/movies/1", headers={"If-None-Match": f'"x", W/{tag}'})
+    assert again.status_code == 304
+    assert again.headers["etag"] == tag
+    assert calls == [1]
+
+
+def test_another_workers_write_makes_old_tags_stale(engine):
+    client, calls = make_client()
+    tag = client.get("/movies/1").headers["etag"]
+    cache.backend().set(cache.key("movie", 1), {"cached": True})
+
+    add_conversation(engine, 5)
+    # What the background thread does on its next check.
+    versions.check()
+
+    response = client.get("/movies/1", headers={"If-None-Match": tag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != tag
+    assert calls == [1, 1]
+    # This worker's cached response for the movie went with the old tag.
+    assert cache.backend().get(cache.key("movie", 1)) is None
+
+
+def test_only_successful_reads_are_tagged(engine):
+    client, _ = make_client()
+    assert "etag" not in client.get("/movies/-1").headers
+    assert "etag" not in client.get("/cache/").headers
+
+
+def test_answers_without_a_query(engine):
+    client, calls = make_client()
+    tag = client.get("/movies/1").headers["etag"]
+    queries = []
+
+    def count(*args):
+        queries.append(args)
+
+    for e in (engine, db.async_engine.sync_engine):
+        sqlalchemy.event.listen(e, "before_cursor_execute", count)
+    assert client.get("/movies/1", headers={"If-None-Match": tag}).status_code == 304
+    assert client.get("/movies/2").headers["etag"] == tag
+    assert queries == []
+
+
+def test_polls_for_other_workers_writes(engine, monkeypatch):
+    monkeypatch.setattr(versions, "POLL_INTERVAL", 0.01)
+    client, _ = make_client()
+    tag = client.get("/movies/1").headers["etag"]
+    add_conversation(engine, 5)
+    deadline = time.monotonic() + 5
+    while client.get("/movies/1").headers["etag"] == tag:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
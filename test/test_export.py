@@ -0,0 +1,41 @@
+import csv
+import io
+import json
+
+from fastapi.testclient import TestClient
+
+from src.api.server import app
+
+
+def test_export_ndjson_with_filter():
+    client = TestClient(app)
+    response = client.get("/export/characters?movie_id=0")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert rows
+    assert {row["movie_id"] for row in rows} == {0}
+    ids = [row["character_id"] for row in rows]
+    assert ids == sorted(ids)
+
+
+def test_export_csv():
+    client = TestClient(app)
+    response = client.get("/export/movies?format=csv")
+    assert response.status_code == 200
+    rows = list(csv.reader(io.StringIO(response.text)))
+    assert rows[0] == [
+        "movie_id",
+        "title",
+        "year",
+        "imdb_rating",
+        "imdb_votes",
+        "raw_script_url",
+    ]
+    assert ["269", "the big lebowski"] in [row[:2] for row in rows[1:]]
+
+
+def test_export_rejects_filters_the_table_lacks():
+    client = TestClient(app)
+    response = client.get("/export/movies?conversation_id=3")
+    assert response.status_code == 400
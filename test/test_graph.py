@@ -0,0 +1,78 @@
+import sqlalchemy
+
+from src import database as db
+from src import graph
+from src import versions
+from src.graph import Graph
+
+
+def _two_triangles() -> Graph:
+    # Two tight groups of three in movie 7, joined by a single conversation
+    # between 3 and 4, plus a character who never talks.
+    characters = [(id, f"C{id}", 7) for id in range(1, 8)]
+    edges = [(1, 2, 2), (2, 3, 1), (3, 2, 1), (1, 3, 2), (3, 4, 1)]
+    edges += [(4, 5, 2), (5, 6, 2), (4, 6, 2)]
+    return Graph(characters, edges)
+
+
+def test_centrality():
+    ranking = {c["character_id"]: c for c in _two_triangles().centrality(7)}
+    assert ranking[3]["degree"] == 3
+    assert ranking[3]["conversations"] == 5
+    # The bridge characters carry the 6 paths between the two groups, out
+    # of the 15 between pairs of the other six characters.
+    assert ranking[3]["betweenness"] == ranking[4]["betweenness"] == 0.4
+    assert ranking[1]["betweenness"] == 0.0
+    assert ranking[7]["degree"] == 0
+
+
+def test_shortest_path_and_updates():
+    g = _two_triangles()
+    assert [c["character_id"] for c in g.shortest_path(1, 6)] == [1, 3, 4, 6]
+    assert g.shortest_path(1, 7) is None
+    g.add_conversation(1, 7)
+    assert [c["character_id"] for c in g.shortest_path(7, 2)] == [7, 1, 2]
+
+
+def test_communities():
+    communities = _two_triangles().communities(7)
+    assert [[c["character_id"] for c in group] for group in communities] == [
+        [1, 2, 3],
+        [4, 5, 6],
+    ]
+
+
+def test_catches_up_with_other_workers(tmp_path, monkeypatch):
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'graph.db'}")
+    db.metadata_obj.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(
+            db.characters.insert(),
+            [{"character_id": id, "name": f"C{id}", "movie_id": 7} for id in (1, 2, 3)],
+        )
+        conn.execute(
+            db.conversations.insert(),
+            {"conversation_id": 1, "character1_id": 1, "character2_id": 2},
+        )
+    monkeypatch.delenv("MOVIE_API_BACKEND", raising=False)
+    monkeypatch.setattr(db, "engine", engine)
+    monkeypatch.setattr(graph, "_graph", None)
+    monkeypatch.setattr(versions, "_seen", None)
+    monkeypatch.setattr(versions, "_tracked", [graph.loaded_graph])
+
+    g = graph.get_graph()
+    assert g.version == 0
+    assert g.shortest_path(1, 3) is None
+
+    # Committed by another worker, which only logs it.
+    with engine.begin() as conn:
+        conn.execute(
+            db.conversations.insert(),
+            {"conversation_id": 2, "character1_id": 3, "character2_id": 2},
+        )
+        versions.record(conn, [2])
+    versions.refresh()
+    versions.refresh()
+    assert g.version == 1
+    assert [c["character_id"] for c in g.shortest_path(1, 3)] == [1, 2, 3]
+    assert g.adjacent(g.node[2]) == {g.node[1]: 1, g.node[3]: 1}
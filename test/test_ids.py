@@ -0,0 +1,59 @@
+import threading
+
+import pytest
+import sqlalchemy
+
+from src import database as db
+from src import ids
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'ids.db'}")
+    db.metadata_obj.create_all(engine)
+    monkeypatch.setattr(db, "engine", engine)
+    return engine
+
+
+def test_first_block_starts_after_the_largest_id(engine):
+    with engine.begin() as conn:
+        conn.execute(db.lines.insert(), [{"line_id": 41}, {"line_id": 7}])
+    allocator = ids.IdAllocator("lines", db.lines.c.line_id, block_size=10)
+    assert allocator.allocate() == 42
+    assert allocator.allocate(3) == 43
+    with engine.connect() as conn:
+        assert conn.execute(sqlalchemy.select(db.id_allocations)).all() == [
+            ("lines", 52)
+        ]
+
+
+def test_blocks_roll_over(engine):
+    allocator = ids.IdAllocator("lines", db.lines.c.line_id, block_size=4)
+    assert [allocator.allocate() for _ in range(4)] == [0, 1, 2, 3]
+    # Doesn't fit in the 4-id block, so it starts a new one of its own size.
+    assert allocator.allocate(2) == 4
+    assert allocator.allocate(5) == 8
+    assert allocator.allocate() == 13
+
+
+def test_workers_never_share_ids(engine):
+    # Two allocators stand in for two worker processes sharing the table.
+    workers = [
+        ids.IdAllocator("conversations", db.conversations.c.conversation_id, 3)
+        for _ in range(2)
+    ]
+    handed_out = []
+
+    def allocate(allocator):
+        for _ in range(50):
+            first = allocator.allocate(2)
+            handed_out.extend([first, first + 1])
+
+    threads = [
+        threading.Thread(target=allocate, args=(workers[i % 2],)) for i in range(6)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(handed_out) == len(set(handed_out)) == 600
@@ -0,0 +1,47 @@
+import io
+
+import sqlalchemy
+
+from src import database as db
+from src import loader
+
+
+def write(path, text):
+    path.write_text(text, encoding="utf8")
+
+
+def test_load_into_sqlite(tmp_path):
+    write(
+        tmp_path / "movies.csv",
+        "movie_id,title,year,imdb_rating,imdb_votes,raw_script_url\n"
+        "0,big fish,2003,8.1,144264,\n"
+        "1,the big lebowski,1998/I,,182170,\n",
+    )
+    write(tmp_path / "characters.csv", "character_id,name,movie_id,gender,age\n")
+    write(
+        tmp_path / "lines.csv",
+        "line_id,character_id,movie_id,conversation_id,line_sort,line_text\n"
+        '1000,10,0,100,0,""\n'
+        '1001,10,0,100,1,"tab\there"\n',
+    )
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'db.sqlite'}")
+    out = io.StringIO()
+    loader.load(engine, data_dir=str(tmp_path), chunk_size=1, out=out)
+
+    with engine.connect() as conn:
+        assert conn.execute(sqlalchemy.select(db.movies)).all() == [
+            (0, "big fish", "2003", 8.1, 144264, None),
+            (1, "the big lebowski", "1998/I", None, 182170, None),
+        ]
+        assert conn.execute(
+            sqlalchemy.select(db.lines.c.line_text).order_by(db.lines.c.line_id)
+        ).scalars().all() == ["", "tab\there"]
+    assert "movies: 2 rows" in out.getvalue()
+    assert "conversations: no data file" in out.getvalue()
+
+
+def test_copy_value_escapes_text_format():
+    assert loader._copy_value(None) == "\\N"
+    assert loader._copy_value("") == ""
+    assert loader._copy_value("a\\b\tc\nd") == "a\\\\b\\tc\\nd"
+    assert loader._copy_value(8.1) == "8.1"
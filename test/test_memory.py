@@ -0,0 +1,220 @@
+import numpy as np
+import sqlalchemy
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from src import cache, counters
+from src import database as db
+from src import memory, ngrams
+from src.api.server import app
+from src.datatypes import Character, Movie, Conversation, Line
+from src.memory import Corpus, SortedIndex
+
+
+def make_corpus():
+    movies = [
+        Movie(0, "big fish", "2003", 8.1, 144264, None),
+        Movie(1, "the big lebowski", "1998", 8.2, 182170, None),
+    ]
+    characters = [
+        Character(10, "AMY", 0, "F", None, 0),
+        Character(11, "BRUCE", 0, None, None, 0),
+        Character(12, "WALTER", 1, "M", None, 0),
+        Character(13, "SILENT", 1, None, None, 0),
+    ]
+    conversations = [
+        Conversation(100, 10, 11, 0, 0),
+        Conversation(101, 12, 13, 1, 0),
+    ]
+    lines = [
+        Line(1000, 10, 0, 100, 0, "Hello."),
+        Line(1001, 11, 0, 100, 1, "Bye."),
+        Line(1002, 10, 0, 100, 2, "Wait!"),
+        Line(1003, 12, 1, 101, 0, "Shut up, Donny."),
+    ]
+    return Corpus(movies, characters, conversations, lines)
+
+
+def test_get_movie():
+    corpus = make_corpus()
+    assert corpus.get_movie(0) == {
+        "movie_id": 0,
+        "title": "big fish",
+        "top_characters": [
+            {"character_id": 10, "character": "AMY", "num_lines": 2},
+            {"character_id": 11, "character": "BRUCE", "num_lines": 1},
+        ],
+    }
+    assert corpus.get_movie(2) is None
+
+
+def test_list_movies_sort_filter():
+    corpus = make_corpus()
+    assert [m["movie_id"] for m in corpus.list_movies("", 50, 0, "rating")] == [1, 0]
+    assert [m["movie_id"] for m in corpus.list_movies("", 50, 0, "year")] == [1, 0]
+    assert [m["movie_id"] for m in corpus.list_movies("LEB", 50, 0, "year")] == [1]
+
+
+def test_list_characters_skips_characters_without_lines():
+    corpus = make_corpus()
+    json = corpus.list_characters("", 50, 0, "number_of_lines")
+    assert [c["character_id"] for c in json] == [10, 11, 12]
+    assert json[0] == {
+        "character_id": 10,
+        "character": "AMY",
+        "movie": "big fish",
+        "number_of_lines": 2,
+    }
+
+
+def test_get_character():
+    corpus = make_corpus()
+    assert corpus.get_character(11)["top_conversations"] == [
+        {
+            "character_id": 10,
+            "character": "AMY",
+            "gender": "F",
+            "number_of_lines_together": 3,
+        }
+    ]
+    assert corpus.get_character(400) is None
+
+
+def test_add_conversation_updates_indexes():
+    corpus = make_corpus()
+    corpus.add_conversation(
+        Conversation(102, 11, 10, 0, 0),
+        [
+            Line(1004, 11, 0, 102, 0, "Again?"),
+            Line(1005, 11, 0, 102, 1, "Again."),
+        ],
+    )
+    json = corpus.list_characters("", 50, 0, "number_of_lines")
+    assert [c["character_id"] for c in json] == [11, 10, 12]
+    assert corpus.list_lines("bruce", 50, 0, "line_text")[0]["line_id"] == 1005
+    assert len(corpus.get_conversation(102)["lines"]) == 2
+
+
+def test_sorted_index_over_an_array():
+    values = {row_id: (row_id % 4, row_id) for row_id in range(0, 40, 2)}
+    listed = SortedIndex(values.get, (True, False), list(values))
+    mapped = SortedIndex(
+        values.get, (True, False), list(values), np.array(listed.tolist())
+    )
+    for row_id in (7, 13, 41, -1):
+        values[row_id] = (row_id % 4, row_id)
+        listed.insert(row_id)
+        mapped.insert(row_id)
+    assert mapped.ids.dtype == np.int64
+    assert mapped.tolist() == listed.tolist()
+
+    # Works on an id and, as a mask, on an array of them.
+    def kept(row_ids):
+        return row_ids % 3 != 0
+
+    for offset, limit, after in ((0, 50, None), (3, 5, None), (2, 7, (3, 7))):
+        assert mapped.page(offset, limit, None, after) == listed.page(
+            offset, limit, None, after
+        )
+        assert mapped.page(offset, limit, kept, after, kept) == listed.page(
+            offset, limit, kept, after
+        )
+
+
+def test_list_characters_after_cursor():
+    corpus = make_corpus()
+    first = corpus.list_characters("", 2, 0, "number_of_lines")
+    after = [first[-1]["number_of_lines"], first[-1]["character_id"]]
+    rest = corpus.list_characters("", 2, 0, "number_of_lines", after)
+    assert [c["character_id"] for c in first + rest] == [10, 11, 12]
+
+
+def test_matches_sql_backend_with_nulls(tmp_path, monkeypatch):
+    path = tmp_path / "nulls.db"
+    engine = sqlalchemy.create_engine(f"sqlite:///{path}")
+    db.metadata_obj.create_all(engine)
+    movie = dict.fromkeys(["title", "year", "imdb_rating", "imdb_votes"])
+    character = dict.fromkeys(["name", "movie_id", "gender"])
+    with engine.begin() as conn:
+        conn.execute(
+            db.movies.insert(),
+            [
+                dict(movie, movie_id=1, title="alpha", year="1999", imdb_rating=7.0),
+                dict(movie, movie_id=2),
+            ],
+        )
+        # No name, a movie without a title, no movie and a missing movie.
+        conn.execute(
+            db.characters.insert(),
+            [
+                dict(character, character_id=10, name="AMY", movie_id=1),
+                dict(character, character_id=11, movie_id=1),
+                dict(character, character_id=12, name="BOB", movie_id=2),
+                dict(character, character_id=13, name="CAT"),
+                dict(character, character_id=14, name="DAN", movie_id=99),
+            ],
+        )
+        conn.execute(
+            db.conversations.insert(),
+            [
+                {"conversation_id": 100, "character1_id": 10, "character2_id": 11},
+                {"conversation_id": 101, "character1_id": 12, "character2_id": 13},
+                {"conversation_id": 102, "character1_id": 14, "character2_id": 99},
+            ],
+        )
+        conn.execute(
+            db.lines.insert(),
+            [
+                {
+                    "line_id": 1000 + i,
+                    "character_id": c,
+                    "movie_id": m,
+                    "conversation_id": conv,
+                    "line_sort": i,
+                    "line_text": text,
+                }
+                for i, (c, m, conv, text) in enumerate(
+                    [
+                        (10, 1, 100, "hi"),
+                        (11, 1, 100, None),
+                        (12, 2, 101, "yo"),
+                        (13, None, 101, "x"),
+                        (14, 99, 102, "y"),
+                        (None, 1, 102, "nobody"),
+                    ]
+                )
+            ],
+        )
+        counters.backfill(conn)
+    monkeypatch.setattr(db, "engine", engine)
+    monkeypatch.setattr(
+        db, "async_engine", create_async_engine(f"sqlite+aiosqlite:///{path}")
+    )
+    monkeypatch.setattr(ngrams, "_indexes", {})
+
+    client = TestClient(app)
+    urls = [
+        "/movies/?sort=rating",
+        "/movies/?sort=year",
+        "/characters/?sort=movie",
+        "/characters/?name=a",
+        "/characters/autocomplete?prefix=",
+        "/lines/?sort=movie_title",
+        "/lines/?text=a",
+    ]
+    urls += [f"/movies/{id}" for id in (1, 2)]
+    urls += [f"/characters/{id}" for id in range(10, 15)]
+    urls += [f"/lines/{id}" for id in range(1000, 1006)]
+    urls += [f"/conversations/{id}" for id in range(100, 103)]
+    responses = {}
+    for backend in ("postgres", "memory"):
+        monkeypatch.setenv("MOVIE_API_BACKEND", backend)
+        monkeypatch.setattr(memory, "_corpus", None)
+        for url in urls:
+            cache.backend().clear()
+            response = client.get(url)
+            responses.setdefault(url, []).append(
+                (response.status_code, response.json())
+            )
+    for url, (sql, in_memory) in responses.items():
+        assert in_memory == sql, url
@@ -1,3 +1,4 @@
+import pytest
 from fastapi.testclient import TestClient
 
 from src.api.server import app
@@ -7,6 +8,7 @@ import json
 client = TestClient(app)
 
 
+@pytest.mark.needs_lines
 def test_get_movie():
     response = client.get("/movies/44")
     assert response.status_code == 200
@@ -23,6 +25,7 @@ def test_movies():
         assert response.json() == json.load(f)
 
 # New test case
+@pytest.mark.needs_lines
 def test_get_movie2():
     # tests null character in top characters
     response = client.get("/movies/436")
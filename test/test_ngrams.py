@@ -0,0 +1,44 @@
+import sqlalchemy
+
+from src import ngrams
+from src.ngrams import NgramIndex
+
+
+def make_index():
+    return NgramIndex(
+        [(1, "AMY"), (2, "AMYLASE"), (3, "TAMMY"), (4, "MR. AMES"), (5, None)]
+    )
+
+
+def test_search_substring():
+    index = make_index()
+    assert index.search("amy") == {1, 2}
+    assert index.search("am") == {1, 2, 3, 4}
+    assert index.search("mr. a") == {4}
+    assert index.search("zz") == set()
+
+
+def test_search_empty_matches_everything():
+    assert make_index().search("") == {1, 2, 3, 4}
+
+
+def test_complete_prefix():
+    index = make_index()
+    assert index.complete("am", 10) == [1, 2]
+    assert index.complete("A", 1) == [1]
+    assert index.complete("x", 10) == []
+
+
+def test_contains_matches_like_search():
+    engine = sqlalchemy.create_engine("sqlite://")
+    names = sqlalchemy.table(
+        "names", sqlalchemy.column("id"), sqlalchemy.column("name")
+    )
+    rows = [(1, "AMY"), (2, "AMYLASE"), (3, "100% MAX"), (4, "A_B"), (5, None)]
+    query = sqlalchemy.select(names.c.id).where(ngrams.contains(names.c.name))
+    with engine.connect() as conn:
+        conn.exec_driver_sql("CREATE TABLE names (id INTEGER, name TEXT)")
+        conn.exec_driver_sql("INSERT INTO names VALUES (?, ?)", rows)
+        for needle in ("amy", "% m", "_", "a_b", "\\", ""):
+            matched = conn.execute(query, {"pattern": ngrams.pattern(needle)})
+            assert set(matched.scalars()) == NgramIndex(rows).search(needle), needle
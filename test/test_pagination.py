@@ -0,0 +1,80 @@
+import sqlalchemy
+from fastapi.testclient import TestClient
+
+from src import database as db
+from src import pagination
+from src.api import movies
+from src.api.server import app
+
+client = TestClient(app)
+
+
+def make_engine(tmp_path):
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'db.sqlite'}")
+    db.metadata_obj.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(
+            db.movies.insert(),
+            [
+                {"movie_id": 1, "title": "b", "imdb_rating": 7.0},
+                {"movie_id": 2, "title": None, "imdb_rating": None},
+                {"movie_id": 3, "title": "a", "imdb_rating": 7.0},
+                {"movie_id": 4, "title": "b", "imdb_rating": 9.5},
+                {"movie_id": 5, "title": "", "imdb_rating": 1.0},
+            ],
+        )
+    return engine
+
+
+def walk(engine, sort, limit=2):
+    """Every movie id in ``sort`` order, a page at a time via cursors."""
+    ids, after = [], None
+    with engine.connect() as conn:
+        while True:
+            params = {"limit": limit, "offset": 0}
+            if after is not None:
+                params.update(pagination.after_params(after))
+            query = movies._list_movies_query(sort, False, after is not None)
+            page = [r._asdict() for r in conn.execute(query, params)]
+            ids += [r["movie_id"] for r in page]
+            if len(page) < limit:
+                return ids
+            field = {"movie_title": "movie_title", "rating": "imdb_rating"}[sort]
+            after = [page[-1][field], page[-1]["movie_id"]]
+
+
+def test_sql_cursor_walk_sorts_nulls_explicitly(tmp_path):
+    engine = make_engine(tmp_path)
+    # NULL sorts as an empty string or zero on every database.
+    assert walk(engine, "movie_title") == [2, 5, 3, 1, 4]
+    assert walk(engine, "rating") == [4, 1, 3, 5, 2]
+
+
+def test_sql_cursor_seeks_the_index(tmp_path):
+    engine = make_engine(tmp_path)
+    query = movies._list_movies_query("rating", False, True)
+    compiled = query.compile(engine)
+    params = compiled.construct_params(
+        {"limit": 2, "offset": 0, **pagination.after_params([7.0, 1])}
+    )
+    with engine.connect() as conn:
+        plan = conn.exec_driver_sql(
+            f"EXPLAIN QUERY PLAN {compiled}",
+            tuple(params[name] for name in compiled.positiontup),
+        ).all()
+    assert "SEARCH movies USING INDEX ix_movies_rating_key" in plan[0][3]
+
+
+def test_forged_cursor_is_400():
+    for values in (["a", "1"], [1, 2], ["a", None], ["a", True], ["a"]):
+        cursor = pagination.encode_cursor("movie_title", values)
+        response = client.get(f"/movies/?sort=movie_title&cursor={cursor}")
+        assert response.status_code == 400
+    cursor = pagination.encode_cursor("rating", [None, 3])
+    assert client.get(f"/movies/?sort=rating&cursor={cursor}").status_code == 200
+    for values in ([float("nan"), 3], [8.1, 2**63]):
+        cursor = pagination.encode_cursor("rating", values)
+        assert client.get(f"/movies/?sort=rating&cursor={cursor}").status_code == 400
+    # Too big to bind as a parameter.
+    cursor = pagination.encode_cursor("line_text", ["a", 10**30])
+    assert client.get(f"/lines/?sort=line_text&cursor={cursor}").status_code == 400
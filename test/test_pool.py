@@ -0,0 +1,48 @@
+import pytest
+import sqlalchemy
+
+from src import pool
+
+
+def test_engine_options_from_env(monkeypatch):
+    monkeypatch.setenv("DB_POOL_SIZE", "2")
+    monkeypatch.setenv("DB_POOL_PRE_PING", "true")
+    options = pool.engine_options()
+    assert options["poolclass"] is pool.TimedQueuePool
+    assert options["pool_size"] == 2
+    assert options["pool_pre_ping"] is True
+
+    monkeypatch.setenv("DB_POOL", "null")
+    options = pool.engine_options()
+    assert options["poolclass"] is pool.TimedNullPool
+    assert "pool_size" not in options
+
+
+def test_checkout_waits_and_timeouts_are_counted(tmp_path):
+    pool.checkout_stats.reset()
+    engine = sqlalchemy.create_engine(
+        f"sqlite:///{tmp_path / 'pool.db'}",
+        poolclass=pool.TimedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.01,
+    )
+    with engine.connect():
+        with pytest.raises(sqlalchemy.exc.TimeoutError):
+            engine.connect()
+    with engine.connect():
+        pass
+
+    json = pool.stats(engine.pool, None)
+    assert json["checkouts"] == 2
+    assert json["timeouts"] == 1
+    assert json["wait_seconds_buckets"]["inf"] == 2
+    assert json["pools"] == [
+        {
+            "class": "TimedQueuePool",
+            "size": 1,
+            "checked_out": 0,
+            "checked_in": 1,
+            "overflow": 0,
+        }
+    ]
@@ -0,0 +1,30 @@
+import json
+
+import pytest
+import sqlalchemy
+from pydantic import BaseModel
+
+from src import responses
+
+
+class Pair(BaseModel):
+    a: int
+    b: str
+
+
+def test_rows_are_keyed_by_labels_and_encoded():
+    engine = sqlalchemy.create_engine("sqlite://")
+    query = sqlalchemy.select(
+        sqlalchemy.literal(1).label("a"), sqlalchemy.literal("é").label("b")
+    )
+    responses.check(query, Pair)
+    with engine.connect() as conn:
+        content = responses.rows(conn.execute(query))
+    assert content == [{"a": 1, "b": "é"}]
+    assert json.loads(responses.JSONResponse(content).body) == content
+
+
+def test_check_rejects_mismatched_columns():
+    query = sqlalchemy.select(sqlalchemy.literal(1).label("a"))
+    with pytest.raises(ValueError):
+        responses.check(query, Pair)
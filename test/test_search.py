@@ -0,0 +1,76 @@
+import sqlalchemy
+
+from src import database as db
+from src import search
+from src import versions
+from src.search import LineIndex, parse_query
+
+
+def make_index():
+    index = LineIndex()
+    index.add(1, "Do you like red apples?")
+    index.add(2, "No I like green apples.")
+    index.add(3, "Apples, apples, apples!")
+    index.add(4, "I like you.")
+    return index
+
+
+def test_parse_query():
+    assert parse_query('big "green apples"') == (
+        ["big", "green", "apples"],
+        [["green", "apples"]],
+    )
+
+
+def test_search_requires_every_term():
+    index = make_index()
+    assert [line_id for line_id, _ in index.search("like apples")] == [1, 2]
+    assert index.search("like pears") == []
+
+
+def test_search_ranks_by_term_frequency():
+    index = make_index()
+    assert index.search("apples")[0][0] == 3
+
+
+def test_search_phrase():
+    index = make_index()
+    assert [line_id for line_id, _ in index.search('"like green"')] == [2]
+    assert index.search('"green like"') == []
+
+
+def test_search_limit():
+    index = make_index()
+    assert len(index.search("apples", 2)) == 2
+
+
+def test_catches_up_with_other_workers(tmp_path, monkeypatch):
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'search.db'}")
+    db.metadata_obj.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(db.lines.insert(), {"line_id": 1, "line_text": "red apples"})
+    monkeypatch.delenv("MOVIE_API_BACKEND", raising=False)
+    monkeypatch.setattr(db, "engine", engine)
+    monkeypatch.setattr(search, "_index", None)
+    monkeypatch.setattr(versions, "_seen", None)
+    monkeypatch.setattr(versions, "_tracked", [search.loaded_index])
+
+    index = search.get_index()
+    assert [id for id, _ in index.search("apples")] == [1]
+
+    # Committed by another worker, which only logs it.
+    with engine.begin() as conn:
+        conn.execute(
+            db.conversations.insert(),
+            {"conversation_id": 1, "character1_id": 10, "character2_id": 11},
+        )
+        conn.execute(
+            db.lines.insert(),
+            {"line_id": 2, "conversation_id": 1, "line_text": "green apples"},
+        )
+        versions.record(conn, [1])
+    versions.refresh()
+    versions.refresh()
+    assert index.version == 1
+    assert [id for id, _ in index.search("apples")] == [1, 2]
+    assert [id for id, _ in index.search("green")] == [2]
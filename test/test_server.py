@@ -0,0 +1,45 @@
+import os
+import subprocess
+import sys
+
+from fastapi.testclient import TestClient
+
+
+def test_import_does_not_touch_the_database():
+    # Nothing listens on port 1, so any connection attempt would fail.
+    env = dict(os.environ, DATABASE_URL="postgresql://nobody@127.0.0.1:1/none")
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import src.api.server, src.database as db; print('engine' in vars(db))",
+        ],
+        env=env,
+        capture_output=True,
+        text=True,
+        cwd=os.path.join(os.path.dirname(__file__), ".."),
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "False"
+
+
+def test_reads_against_the_stand_in():
+    from src.api.server import app
+
+    client = TestClient(app)
+    response = client.get("/movies/autocomplete?prefix=the big")
+    assert response.status_code == 200
+    assert {"movie_id": 269, "movie_title": "the big lebowski"} in response.json()
+    assert client.get("/movies/?limit=3").status_code == 200
+
+
+def test_get_conversation_miss_is_404():
+    from src.api.server import app
+
+    client = TestClient(app)
+    response = client.get("/conversations/999999999")
+    assert response.status_code == 404
+    assert response.json() == {"detail": "conversation not found."}
+    response = client.get("/conversations/0")
+    assert response.status_code == 200
+    assert response.json()["convo_id"] == 0
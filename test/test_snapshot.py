@@ -0,0 +1,185 @@
+import io
+
+import pytest
+import sqlalchemy
+
+from src import database as db
+from src import memory
+from src import snapshot
+from src import versions
+
+
+def make_database(tmp_path):
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'db.sqlite'}")
+    db.metadata_obj.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(
+            db.movies.insert(),
+            [
+                {
+                    "movie_id": 0,
+                    "title": "big fish",
+                    "year": "2003",
+                    "imdb_rating": 8.1,
+                    "imdb_votes": 144264,
+                    "raw_script_url": None,
+                },
+                {
+                    "movie_id": 1,
+                    "title": "amélie",
+                    "year": None,
+                    "imdb_rating": None,
+                    "imdb_votes": 1,
+                    "raw_script_url": None,
+                },
+            ],
+        )
+        conn.execute(
+            db.characters.insert(),
+            [
+                {
+                    "character_id": 10,
+                    "name": "AMY",
+                    "movie_id": 0,
+                    "gender": "F",
+                    "age": None,
+                },
+                {
+                    "character_id": 11,
+                    "name": "BRUCE",
+                    "movie_id": 0,
+                    "gender": None,
+                    "age": 40,
+                },
+            ],
+        )
+        conn.execute(
+            db.conversations.insert(),
+            [
+                {
+                    "conversation_id": 100,
+                    "character1_id": 10,
+                    "character2_id": 11,
+                    "movie_id": 0,
+                }
+            ],
+        )
+        conn.execute(
+            db.lines.insert(),
+            [
+                {
+                    "line_id": 1000,
+                    "character_id": 10,
+                    "movie_id": 0,
+                    "conversation_id": 100,
+                    "line_sort": 0,
+                    "line_text": "Hello.",
+                },
+                {
+                    "line_id": 1001,
+                    "character_id": 11,
+                    "movie_id": 0,
+                    "conversation_id": 100,
+                    "line_sort": 1,
+                    "line_text": "",
+                },
+                {
+                    "line_id": 1002,
+                    "character_id": 10,
+                    "movie_id": 0,
+                    "conversation_id": 100,
+                    "line_sort": 2,
+                    "line_text": "Ça va ?",
+                },
+            ],
+        )
+    return engine
+
+
+def test_round_trip(tmp_path):
+    engine = make_database(tmp_path)
+    path = str(tmp_path / "corpus.snapshot")
+    snapshot.write(engine, path, out=io.StringIO())
+
+    snap = snapshot.read(path)
+    movies = snap["movies"]
+    assert len(movies) == 2
+    assert movies["title"].tolist() == ["big fish", "amélie"]
+    assert movies["year"].tolist() == ["2003", None]
+    assert movies["imdb_rating"][1] is None
+    assert movies["imdb_votes"][0] == 144264
+    assert snap["lines"]["line_text"].tolist() == ["Hello.", "", "Ça va ?"]
+
+    corpus = memory.load_from_snapshot(snap)
+    expected = memory.load_from_database(engine)
+    # Conversations and lines are read from the snapshot, not copied.
+    assert isinstance(corpus.lines, memory.Rows)
+    assert corpus.lines == expected.lines
+    assert corpus.conversations == expected.conversations
+    assert corpus.orders() == expected.orders()
+    assert corpus.get_movie(0) == expected.get_movie(0)
+    assert corpus.get_character(10) == expected.get_character(10)
+    assert corpus.get_conversation(100) == expected.get_conversation(100)
+    assert corpus.list_lines("amy", 10, 0, "line_text") == expected.list_lines(
+        "amy", 10, 0, "line_text"
+    )
+
+
+def add_conversation(engine, conversation_id, line_id, text):
+    """Commits a conversation from BRUCE to AMY as the write endpoints do."""
+    with engine.begin() as conn:
+        conn.execute(
+            db.conversations.insert(),
+            {
+                "conversation_id": conversation_id,
+                "character1_id": 11,
+                "character2_id": 10,
+                "movie_id": 0,
+            },
+        )
+        conn.execute(
+            db.lines.insert(),
+            {
+                "line_id": line_id,
+                "character_id": 11,
+                "movie_id": 0,
+                "conversation_id": conversation_id,
+                "line_sort": 0,
+                "line_text": text,
+            },
+        )
+        versions.record(conn, [conversation_id])
+
+
+def test_catches_up_with_the_database(tmp_path, monkeypatch):
+    engine = make_database(tmp_path)
+    path = str(tmp_path / "corpus.snapshot")
+    snapshot.write(engine, path, out=io.StringIO())
+    add_conversation(engine, 50, 500, "Late.")
+
+    snap = snapshot.read(path)
+    assert snap.data_version == 0
+    corpus = memory.load_from_snapshot(snap, engine)
+    assert corpus.version == 1
+    assert corpus.get_conversation(50)["lines"][0]["line_text"] == "Late."
+    assert corpus.characters[11].num_lines == 2
+    assert corpus.orders() == memory.load_from_database(engine).orders()
+
+    # Another worker's write reaches the corpus through versions.refresh.
+    monkeypatch.setattr(db, "engine", engine)
+    monkeypatch.setattr(versions, "_seen", None)
+    monkeypatch.setattr(versions, "_tracked", [lambda: corpus])
+    add_conversation(engine, 51, 510, "Later.")
+    versions.refresh()
+    assert corpus.version == 2
+    assert corpus.get_conversation(51)["lines"][0]["line_text"] == "Later."
+    assert corpus.characters[11].num_lines == 3
+
+
+def test_rejects_another_database(tmp_path):
+    path = str(tmp_path / "corpus.snapshot")
+    snapshot.write(make_database(tmp_path), path, out=io.StringIO())
+    (tmp_path / "other").mkdir()
+    other = make_database(tmp_path / "other")
+    with pytest.raises(ValueError):
+        memory.load_from_snapshot(snapshot.read(path), other)
@@ -0,0 +1,92 @@
+import sqlalchemy
+
+from src import database as db
+from src import stats
+from src import versions
+from src.stats import Columns
+
+
+def _columns() -> Columns:
+    titles = {1: "one", 2: "two", 3: "silent"}
+    genders = {10: "f", 11: "M", 12: "?", 20: "m"}
+    lines = [
+        (10, 1, 100, "a b c"),
+        (11, 1, 100, "a"),
+        (10, 1, 100, "a b"),
+        (12, 1, 101, "a b c d"),
+        (20, 2, 200, "a b"),
+    ]
+    return Columns(titles, genders, lines)
+
+
+def test_movie_stats():
+    stats = _columns().movie_stats(1)
+    assert stats["title"] == "one"
+    assert stats["lines"] == 4
+    assert stats["words"] == 10
+    assert stats["lines_per_character"]["max"] == 2
+    assert stats["gender_share"]["F"] == {"lines": 0.5, "words": 0.5}
+    assert stats["gender_share"]["unknown"] == {"lines": 0.25, "words": 0.4}
+    lengths = stats["conversation_length"]
+    assert (lengths["count"], lengths["max"]) == (2, 3)
+    assert lengths["histogram"]["1"] == lengths["histogram"]["3"] == 1
+    assert stats["words_per_line"]["median"] == 2.5
+
+
+def test_empty_and_missing_movies():
+    columns = _columns()
+    assert columns.movie_stats(3)["lines"] == 0
+    assert columns.movie_stats(4) is None
+
+
+def test_added_lines():
+    columns = _columns()
+    columns.add_lines([(20, 2, 200, "a b c d"), (20, 3, 300, "a")])
+    assert columns.movie_stats(2)["conversation_length"]["max"] == 2
+    assert columns.movie_stats(3)["lines"] == 1
+    assert columns.corpus_stats()["lines"] == 7
+
+
+def test_catches_up_with_other_workers(tmp_path, monkeypatch):
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'stats.db'}")
+    db.metadata_obj.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(db.movies.insert(), {"movie_id": 1, "title": "one"})
+        conn.execute(
+            db.characters.insert(),
+            {"character_id": 10, "movie_id": 1, "gender": "f"},
+        )
+    monkeypatch.delenv("MOVIE_API_BACKEND", raising=False)
+    monkeypatch.setattr(db, "engine", engine)
+    monkeypatch.setattr(stats, "_columns", None)
+    monkeypatch.setattr(versions, "_seen", None)
+    monkeypatch.setattr(versions, "_tracked", [stats.loaded_columns])
+
+    columns = stats.get_columns()
+    assert columns.movie_stats(1)["lines"] == 0
+
+    # Committed by another worker, which only logs it.
+    with engine.begin() as conn:
+        conn.execute(
+            db.conversations.insert(),
+            {"conversation_id": 1, "character1_id": 10, "character2_id": 10},
+        )
+        conn.execute(
+            db.lines.insert(),
+            [
+                {
+                    "line_id": id,
+                    "character_id": 10,
+                    "movie_id": 1,
+                    "conversation_id": 1,
+                    "line_text": "a b",
+                }
+                for id in (1, 2)
+            ],
+        )
+        versions.record(conn, [1])
+    versions.refresh()
+    versions.refresh()
+    assert columns.version == 1
+    assert columns.movie_stats(1)["lines"] == 2
+    assert columns.movie_stats(1)["gender_share"]["F"]["words"] == 1.0
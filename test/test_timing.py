@@ -0,0 +1,91 @@
+import logging
+import time
+
+import sqlalchemy
+from fastapi import APIRouter, FastAPI
+from fastapi.testclient import TestClient
+
+from src import timing
+
+
+def _client(engine, middleware=()):
+    router = APIRouter(route_class=timing.TimedRoute)
+
+    @router.get("/things/{id}")
+    async def get_thing(id: int):
+        with engine.connect() as conn:
+            return {
+                "id": conn.execute(sqlalchemy.text("select :id"), {"id": id}).scalar()
+            }
+
+    app = FastAPI()
+    for m in middleware:
+        app.add_middleware(m)
+    app.add_middleware(timing.TimingMiddleware)
+    app.include_router(router)
+    return TestClient(app)
+
+
+def test_server_timing_and_metrics():
+    timing.metrics.reset()
+    client = _client(sqlalchemy.create_engine("sqlite://"))
+
+    response = client.get("/things/7")
+    assert response.json() == {"id": 7}
+    entries = dict(
+        entry.split(";", 1) for entry in response.headers["server-timing"].split(", ")
+    )
+    assert set(entries) == {"db", "app", "serialize", "queries", "total"}
+    assert entries["queries"] == 'desc="1"'
+
+    client.get("/things/8")
+    client.get("/nothing")
+    text = timing.metrics.render()
+    assert (
+        'movie_api_request_duration_seconds_count{method="GET",route="/things/{id}"} 2'
+        in text
+    )
+    assert (
+        'movie_api_request_queries_bucket{method="GET",route="/things/{id}",le="1"} 2'
+        in text
+    )
+    assert (
+        'movie_api_responses_total{method="GET",route="unmatched",status="404"} 1'
+        in text
+    )
+
+
+class QueryingMiddleware:
+    """Spends 50ms on a query before the route runs."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        time.sleep(0.05)
+        timing.record("db", 0.05)
+        await self.app(scope, receive, send)
+
+
+def test_phases_add_up_with_queries_in_middleware():
+    client = _client(sqlalchemy.create_engine("sqlite://"), [QueryingMiddleware])
+    header = client.get("/things/7").headers["server-timing"]
+    durations = {
+        name: float(value.removeprefix("dur="))
+        for name, value in (entry.split(";", 1) for entry in header.split(", "))
+        if value.startswith("dur=")
+    }
+    total = durations.pop("total")
+    assert durations["db"] >= 50
+    assert durations["serialize"] < 40
+    assert abs(sum(durations.values()) - total) < 5
+
+
+def test_slow_queries_are_logged(monkeypatch, caplog):
+    monkeypatch.setattr(timing, "SLOW_QUERY_MS", 0.000001)
+    engine = sqlalchemy.create_engine("sqlite://")
+    with caplog.at_level(logging.WARNING, logger="src.timing"):
+        with engine.connect() as conn:
+            conn.execute(sqlalchemy.text("select :n"), {"n": 42})
+    assert "select ?" in caplog.text
+    assert "(42,)" in caplog.text
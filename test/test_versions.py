@@ -0,0 +1,97 @@
+import pytest
+import sqlalchemy
+
+from src import database as db
+from src import versions
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'versions.db'}")
+    db.metadata_obj.create_all(engine)
+    monkeypatch.setattr(db, "engine", engine)
+    monkeypatch.setattr(versions, "_seen", None)
+    monkeypatch.setattr(versions, "_tracked", [])
+    return engine
+
+
+def add(engine, conversation_id, lines=1):
+    """Commits a conversation with ``lines`` lines as a write would."""
+    with engine.begin() as conn:
+        conn.execute(
+            db.conversations.insert(),
+            [
+                {
+                    "conversation_id": conversation_id,
+                    "character1_id": 1,
+                    "character2_id": 2,
+                    "movie_id": 1,
+                }
+            ],
+        )
+        conn.execute(
+            db.lines.insert(),
+            [
+                {
+                    "line_id": conversation_id * 10 + i,
+                    "character_id": 1,
+                    "movie_id": 1,
+                    "conversation_id": conversation_id,
+                }
+                for i in range(lines)
+            ],
+        )
+        return versions.record(conn, [conversation_id])
+
+
+class Copy:
+    def __init__(self, version):
+        self.version = version
+        self.conversations = []
+        self.lines = []
+
+    def apply(self, conversations, lines):
+        self.conversations += [row["conversation_id"] for row in conversations]
+        self.lines += [row["line_id"] for row in lines]
+
+
+def test_changes_since_a_version(engine):
+    assert versions.current() == 0
+    assert [add(engine, 7), add(engine, 3, lines=2), add(engine, 5)] == [1, 2, 3]
+    with engine.connect() as conn:
+        latest, conversations, lines = versions.changes(conn, 1)
+        assert latest == 3
+        assert [(r["conversation_id"], r["version"]) for r in conversations] == [
+            (3, 2),
+            (5, 3),
+        ]
+        assert [r["line_id"] for r in lines] == [30, 31, 50]
+        assert versions.changes(conn, 3) == (3, [], [])
+
+
+def test_build_repeats_when_a_write_lands(engine):
+    built = []
+
+    def make():
+        built.append(versions.current())
+        if len(built) == 1:
+            add(engine, 1)
+        return len(built)
+
+    assert versions.build(make) == (1, 2)
+
+
+def test_refresh_applies_only_what_each_copy_lacks(engine):
+    add(engine, 1)
+    old, new = Copy(0), Copy(1)
+    versions.track(lambda: old)
+    versions.track(lambda: new)
+    versions.refresh()
+    assert not versions.behind(1)
+
+    add(engine, 2, lines=2)
+    assert versions.behind(2)
+    versions.refresh()
+    assert (old.version, old.conversations, old.lines) == (2, [1, 2], [10, 20, 21])
+    assert (new.version, new.conversations, new.lines) == (2, [2], [20, 21])
+    assert not versions.behind(2)